@@ -0,0 +1,127 @@
+# Copyright (c) 2020, Sky UK Ltd
+# BSD 3-Clause License
+#
+# Waits, in a single task, for many async jobs (e.g. the registered results of a looped 'async: ..., poll: 0' task) to finish, instead of looping async_status over
+# each job with a fixed delay (which is a module round-trip, for every job, on every retry).
+#   + When the connection is local (e.g. the cloud create tasks, which run on localhost), the job status files are read directly, without running any module.
+#     Otherwise, the async_status module is run for each still-running job, in each round.
+#   + The poll interval starts at 'delay', and backs off (x1.5, up to 'max_delay') while no job finishes; it is reset when one does.
+#   + It fails after 'timeout' seconds (default 900, the ceiling of the async_status loops it replaces: 300 retries x 3s).
+#
+# The results have the same shape as those of a looped async_status task (each with an 'item' that is the original job), so they are a drop-in replacement.  The
+# time at which each job was seen to finish (relative to the start of the wait) is returned in 'latency', with summary statistics.
+#
+#    - async_wait:
+#        jobs: "{{ r__ec2.results }}"
+#      register: r__async_status__ec2
+#
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from ansible.errors import AnsibleError
+from ansible.plugins.action import ActionBase
+from ansible.module_utils._text import to_text
+import json
+import os
+import time
+
+
+class ActionModule(ActionBase):
+    VALID_ARGUMENTS = ['jobs', 'delay', 'max_delay', 'timeout']
+
+    def run(self, tmp=None, task_vars=None):
+
+        if task_vars is None:
+            task_vars = dict()
+
+        for arg in self._task.args:
+            if not arg in self.VALID_ARGUMENTS:
+                raise AnsibleError('%s is not a valid option in async_wait' % arg)
+
+        jobs = self._task.args.get('jobs') or []
+        delay = float(self._task.args.get('delay', 1))
+        max_delay = float(self._task.args.get('max_delay', 15))
+        timeout = float(self._task.args.get('timeout', 900))
+
+        result = super(ActionModule, self).run(task_vars=task_vars)
+        result.update({'changed': False, 'results': [None] * len(jobs), 'polls': 0})
+
+        async_dir = self._remote_expand_user(self.get_shell_option('async_dir', default="~/.ansible_async"))
+        local = self._connection.transport == 'local'
+
+        start_time = time.time()
+        latency = {}
+        running = {}
+        for idx, job in enumerate(jobs):
+            if 'ansible_job_id' in job:
+                running[idx] = to_text(job['ansible_job_id'])
+            else:
+                result['results'][idx] = dict(job, item=job)  # Skipped, or failed to start; pass it through
+
+        interval = delay
+        while running:
+            result['polls'] += 1
+            finished = [(idx, self._job_status(jid, async_dir, local, task_vars)) for idx, jid in running.items()]
+            finished = [(idx, status) for idx, status in finished if status.get('finished')]
+            for idx, status in finished:
+                jid = running.pop(idx)
+                status.update({'ansible_job_id': jid, 'item': jobs[idx]})
+                result['results'][idx] = status
+                latency[jid] = round(max(status.pop('_finished_time', time.time()) - start_time, 0), 3)
+
+            if not running:
+                break
+            if time.time() - start_time > timeout:
+                result.update({'failed': True, 'msg': 'Timed out after %ss waiting for %d of %d jobs' % (timeout, len(running), len(jobs))})
+                for idx, jid in running.items():
+                    result['results'][idx] = {'ansible_job_id': jid, 'started': 1, 'finished': 0, 'failed': True, 'msg': 'timed out', 'item': jobs[idx]}
+                break
+            interval = delay if finished else min(interval * 1.5, max_delay)
+            time.sleep(interval)
+
+        result['changed'] = any(job_result.get('changed') for job_result in result['results'])
+        result['latency'] = dict(self._latency_stats(list(latency.values())), jobs=latency)
+        result['elapsed'] = round(time.time() - start_time, 3)
+
+        failed = [job_result for job_result in result['results'] if job_result.get('failed')]
+        if failed and not result.get('failed'):
+            result.update({'failed': True, 'msg': '%d of %d jobs failed: %s' % (len(failed), len(jobs), '; '.join(to_text(job_result.get('msg', '')) for job_result in failed))})
+
+        return result
+
+    # The job status, in the same form as returned by the async_status module.  When reading the status file directly, '_finished_time' is the file's mtime (i.e. when the job wrote its result).
+    def _job_status(self, jid, async_dir, local, task_vars):
+        if not local:
+            return self._execute_module(module_name='ansible.legacy.async_status', module_args={'jid': jid, '_async_dir': async_dir}, task_vars=task_vars)
+
+        log_path = os.path.join(os.path.expanduser(async_dir), jid)
+        try:
+            with open(log_path) as log_file:
+                data = json.loads(log_file.read())
+            finished_time = os.path.getmtime(log_path)
+        except (IOError, OSError):
+            if not os.path.exists(log_path):
+                return {'started': 1, 'finished': 1, 'failed': True, 'msg': 'could not find job'}
+            return {'started': 1, 'finished': 0}
+        except ValueError:
+            return {'started': 1, 'finished': 0}  # Not (completely) written yet, so still running
+
+        if 'started' not in data:
+            data.update({'finished': 1, '_finished_time': finished_time})
+        elif 'finished' not in data:
+            data['finished'] = 0
+        return data
+
+    @staticmethod
+    def _latency_stats(latencies):
+        if not latencies:
+            return {}
+        latencies = sorted(latencies)
+        return {
+            'count': len(latencies),
+            'min': latencies[0],
+            'p50': latencies[int(0.50 * (len(latencies) - 1))],
+            'p95': latencies[int(0.95 * (len(latencies) - 1))],
+            'max': latencies[-1]
+        }
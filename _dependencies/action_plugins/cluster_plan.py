@@ -0,0 +1,124 @@
+# Copyright (c) 2020, Sky UK Ltd
+# BSD 3-Clause License
+#
+# Diffs cluster_hosts_target (the hosts that should exist) against cluster_hosts_state (the hosts that do exist) once, on the controller, and sets the 'cluster_plan'
+# fact, which the create, clean and redeploy roles use instead of each re-scanning cluster_hosts_state (or asking the cloud, host by host) to work out what to do:
+#   + create:          The cluster_hosts_target entries whose hostname does not exist.
+#   + existing:        The hostnames (of cluster_hosts_target) that exist already.
+#   + retire:          The cluster_hosts_state hosts that are not in cluster_hosts_target, each with 'replaced_by' - the cluster_hosts_target hostname with the same
+#                      name (without the cluster_suffix), or None when it is not replaced (i.e. scaling in).
+#   + relabel:         The lifecycle_state label changes ({name, from, to}) that retiring those hosts means ('current' -> 'retiring').
+#   + volumes_to_move: The auto_volumes of cluster_hosts_target that have a 'src' (i.e. a disk to detach from a previous instance and attach to the new one), each
+#                      denormalised with its host, (as cluster_hosts_target_denormalised_by_volume).
+#   + clean:           The hosts that '-e clean=<lifecycle_state>' (or '_all_') would delete.
+#   + tidy:            The powered-down, non-current hosts (that a redeploy's tidy step would delete).
+#   + dns:             If 'dns_user_domain' is given, the A and CNAME records that creating and cleaning those hosts would change ({action, name, type, values}).
+#
+# Nothing is queried: in check mode, the plan is the output.  A one-line summary of each section is returned in 'summary'.
+#
+#    - cluster_plan:
+#        cluster_hosts_target: "{{ cluster_hosts_target }}"
+#        cluster_hosts_state: "{{ cluster_hosts_state }}"
+#        clean: "{{ clean | default(omit) }}"
+#        dns_user_domain: "{{ cluster_vars.dns_user_domain | default(omit) }}"
+#      register: r__cluster_plan
+#
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from ansible.errors import AnsibleError
+from ansible.plugins.action import ActionBase
+from ansible.module_utils._text import to_text
+
+
+class ActionModule(ActionBase):
+
+    VALID_ARGUMENTS = ['cluster_hosts_target', 'cluster_hosts_state', 'clean', 'dns_user_domain']
+    RUNNING_STATES = ['RUNNING', 'running', 'poweredOn']
+
+    def run(self, tmp=None, task_vars=None):
+
+        if task_vars is None:
+            task_vars = dict()
+
+        for arg in self._task.args:
+            if not arg in self.VALID_ARGUMENTS:
+                raise AnsibleError('%s is not a valid option in cluster_plan' % arg)
+
+        cluster_hosts_target = self._task.args.get('cluster_hosts_target') or []
+        cluster_hosts_state = self._task.args.get('cluster_hosts_state') or []
+        clean = self._task.args.get('clean')
+        dns_user_domain = self._task.args.get('dns_user_domain')
+
+        result = super(ActionModule, self).run(task_vars=task_vars)
+
+        plan = self.plan(cluster_hosts_target, cluster_hosts_state, clean, dns_user_domain)
+        result.update({'changed': False, 'ansible_facts': {'cluster_plan': plan}, 'summary': self.summary(plan)})
+        return result
+
+    @staticmethod
+    def nosuffix(hostname):
+        return to_text(hostname).rsplit('-', 1)[0]
+
+    @staticmethod
+    def lifecycle_state(host):
+        return (host.get('tagslabels') or {}).get('lifecycle_state')
+
+    def plan(self, cluster_hosts_target, cluster_hosts_state, clean=None, dns_user_domain=None):
+        state_by_name = dict((host['name'], host) for host in cluster_hosts_state)
+        target_by_nosuffix = dict((self.nosuffix(host['hostname']), host['hostname']) for host in cluster_hosts_target)
+
+        plan = {
+            'create': [host for host in cluster_hosts_target if host['hostname'] not in state_by_name],
+            'existing': [host['hostname'] for host in cluster_hosts_target if host['hostname'] in state_by_name],
+            'retire': [],
+            'relabel': [],
+            'volumes_to_move': [],
+            'clean': [],
+            'tidy': [host for host in cluster_hosts_state if self.lifecycle_state(host) != 'current' and host.get('instance_state') not in self.RUNNING_STATES],
+            'dns': []
+        }
+
+        target_hostnames = set(host['hostname'] for host in cluster_hosts_target)
+        for host in cluster_hosts_state:
+            if host['name'] not in target_hostnames:
+                plan['retire'].append(dict(host, replaced_by=target_by_nosuffix.get(self.nosuffix(host['name']))))
+                if self.lifecycle_state(host) == 'current':
+                    plan['relabel'].append({'name': host['name'], 'from': 'current', 'to': 'retiring'})
+
+        for host in cluster_hosts_target:
+            for auto_volume in host.get('auto_volumes') or []:
+                if 'src' in auto_volume:
+                    plan['volumes_to_move'].append(dict([(key, value) for key, value in host.items() if key != 'auto_volumes'], auto_volume=auto_volume))
+
+        if clean:
+            plan['clean'] = list(cluster_hosts_state) if clean == '_all_' else [host for host in cluster_hosts_state if self.lifecycle_state(host) == clean]
+
+        if dns_user_domain:
+            for host in plan['create']:
+                fqdn = host['hostname'] + '.' + dns_user_domain
+                plan['dns'].append({'action': 'create', 'name': fqdn, 'type': 'A', 'values': []})  # The value (IP) is not known until the host exists
+                plan['dns'].append({'action': 'update', 'name': self.nosuffix(host['hostname']) + '.' + dns_user_domain, 'type': 'CNAME', 'values': [fqdn]})
+            for host in plan['clean']:
+                fqdn = host['name'] + '.' + dns_user_domain
+                plan['dns'].append({'action': 'delete', 'name': fqdn, 'type': 'A', 'values': []})
+                plan['dns'].append({'action': 'delete', 'name': self.nosuffix(host['name']) + '.' + dns_user_domain, 'type': 'CNAME', 'values': [fqdn]})
+
+        return plan
+
+    @staticmethod
+    def summary(plan):
+        def names(hosts, key):
+            return ', '.join(to_text(host[key]) for host in hosts) or '-'
+
+        return [
+            'create: %s' % names(plan['create'], 'hostname'),
+            'existing: %s' % (', '.join(plan['existing']) or '-'),
+            'retire: %s' % (', '.join('%s%s' % (host['name'], ' (replaced by %s)' % host['replaced_by'] if host['replaced_by'] else '') for host in plan['retire']) or '-'),
+            'relabel: %s' % (', '.join('%s (%s -> %s)' % (relabel['name'], relabel['from'], relabel['to']) for relabel in plan['relabel']) or '-'),
+            'volumes_to_move: %s' % (', '.join('%s:%s -> %s:%s' % (vol['auto_volume']['src'].get('instance_id', vol['auto_volume']['src'].get('hostname', '')), vol['auto_volume']['src'].get('device_name', ''), vol['hostname'], vol['auto_volume']['device_name']) for vol in plan['volumes_to_move']) or '-'),
+            'clean: %s' % names(plan['clean'], 'name'),
+            'tidy: %s' % names(plan['tidy'], 'name'),
+            'dns: %s' % (', '.join('%s %s %s' % (record['action'], record['type'], record['name']) for record in plan['dns']) or '-')
+        ]
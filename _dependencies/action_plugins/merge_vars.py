@@ -47,6 +47,17 @@
 #        from:
 #           - "./cluster_defs/{{ clusterid }}"
 #
+#
+# If 'cache_dir' is set, the merged result is also written there as a compiled artifact, named by a hash of the content of all the source files, and is loaded instead of
+# the source files for as long as none of them has changed (e.g. for each of the many cluster.yml invocations of a redeploy).  On a cache miss, the source files are parsed
+# concurrently.  Inline '!vault' values are written still encrypted; if any source file is vault-encrypted as a whole, the entire artifact is vault-encrypted (and if no
+# vault secret is available with which to do that, or the result contains '!unsafe' values, no artifact is written).
+#    - merge_vars:
+#        ignore_missing_files: True
+#        cache_dir: "~/.cache/clusterverse/merge_vars"
+#        from:
+#           - "./cluster_defs/{{ clusterid }}"
+#
 
 from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
@@ -54,15 +65,25 @@ __metaclass__ = type
 from ansible.errors import AnsibleError
 from ansible.plugins.action import ActionBase
 from ansible.utils.vars import merge_hash
-from ansible.module_utils._text import to_native, to_text
+from ansible.module_utils._text import to_bytes, to_native, to_text
+from ansible.parsing.yaml.dumper import AnsibleDumper
 from ansible.utils.display import Display
+from ansible.utils.unsafe_proxy import AnsibleUnsafe
+from concurrent.futures import ThreadPoolExecutor
 from os import path, listdir
+import hashlib
+import json
+import os
+import tempfile
+import yaml
 
 display = Display()
 
+MERGE_VARS_CACHE_VERSION = 1
+
 class ActionModule(ActionBase):
 
-    VALID_ARGUMENTS = [ 'from', 'ignore_missing_files' ]
+    VALID_ARGUMENTS = [ 'from', 'ignore_missing_files', 'cache_dir' ]
 
     def run(self, tmp=None, task_vars=None):
 
@@ -97,14 +118,30 @@ class ActionModule(ActionBase):
                 break
 
         data = {}
+        cache_hit = False
+        cache_artifact = None
         if not failed:
-            for filename in files:
-                try:
-                    data = merge_hash(data, self._load_from_file(filename))
-
-                except AnsibleError as e:
-                    failed = True
-                    err_msg = to_native(e)
+            try:
+                if self._task.args.get('cache_dir'):
+                    cache_artifact = self._cache_artifact_path(files)
+                    if path.isfile(cache_artifact):
+                        data, self.show_content = self._load_from_file(cache_artifact)
+                        cache_hit = True
+
+                if not cache_hit:
+                    # Parse (and decrypt) the files concurrently, then merge them in order.
+                    with ThreadPoolExecutor(max_workers=min(8, len(files) or 1)) as executor:
+                        loaded = list(executor.map(self._load_from_file, files))
+                    for file_data, show_content in loaded:
+                        data = merge_hash(data, file_data)
+                    self.show_content = all(show_content for file_data, show_content in loaded)
+
+                    if cache_artifact:
+                        self._write_cache_artifact(cache_artifact, data)
+
+            except AnsibleError as e:
+                failed = True
+                err_msg = to_native(e)
 
         result = super(ActionModule, self).run(task_vars=task_vars)
 
@@ -115,16 +152,71 @@ class ActionModule(ActionBase):
         result['ansible_included_var_files'] = files
         result['ansible_facts'] = data
         result['_ansible_no_log'] = not self.show_content
-        
+        if cache_artifact:
+            result['cache_artifact'] = cache_artifact
+            result['cache_hit'] = cache_hit
+
         return result
 
+    # The artifact name is derived from the 'from' list, and from the (ordered) list and content of the source files, so any change to any source file results in a new artifact.
+    def _cache_artifact_path(self, files):
+        sources_hash = hashlib.sha256(to_bytes(json.dumps([path.abspath(source) for source in self._task.args['from']])))
+        content_hash = hashlib.sha256(to_bytes(json.dumps([MERGE_VARS_CACHE_VERSION, [path.abspath(filename) for filename in files]])))
+        for filename in files:
+            with open(filename, 'rb') as source_file:
+                content_hash.update(hashlib.sha256(source_file.read()).digest())
+        cache_dir = path.expanduser(path.expandvars(self._task.args['cache_dir']))
+        return path.join(cache_dir, 'merge_vars-%s-%s.yml' % (sources_hash.hexdigest()[:16], content_hash.hexdigest()))
+
+    @staticmethod
+    def _contains_unsafe(data):
+        if isinstance(data, AnsibleUnsafe):
+            return True
+        if isinstance(data, dict):
+            return any(ActionModule._contains_unsafe(k) or ActionModule._contains_unsafe(v) for k, v in data.items())
+        if isinstance(data, (list, tuple)):
+            return any(ActionModule._contains_unsafe(v) for v in data)
+        return False
+
+    def _write_cache_artifact(self, cache_artifact, data):
+        if self._contains_unsafe(data):
+            display.vvv("merge_vars: not caching, as the merged vars contain '!unsafe' values")
+            return
+
+        # Inline '!vault' values are dumped as-is (i.e. still encrypted).  Values from a wholly-encrypted file are plaintext by now, so the whole artifact must be encrypted.
+        b_artifact = to_bytes(yaml.dump(data, Dumper=AnsibleDumper, default_flow_style=False, allow_unicode=True))
+        if not self.show_content:
+            if not self._loader._vault.secrets:
+                display.vvv("merge_vars: not caching, as there is no vault secret with which to encrypt the artifact")
+                return
+            b_artifact = self._loader._vault.encrypt(b_artifact)
+
+        cache_dir = path.dirname(cache_artifact)
+        if not path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0o700)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                tmp_file.write(b_artifact)
+            os.rename(tmp_path, cache_artifact)
+        except Exception:
+            if path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        # Remove any stale artifacts for the same source files
+        artifact_prefix = path.basename(cache_artifact).rsplit('-', 1)[0] + '-'
+        for filename in listdir(cache_dir):
+            if filename.startswith(artifact_prefix) and filename != path.basename(cache_artifact):
+                os.unlink(path.join(cache_dir, filename))
+
     def _load_from_file(self, filename):
         # this is the approach used by include_vars in order to get the show_content
         # value based on whether decryption occured.  load_from_file does not return
         # that value. 
         #    https://github.com/ansible/ansible/blob/v2.7.5/lib/ansible/plugins/action/include_vars.py#L236-L240
+        # Returns (data, show_content), as this is called concurrently for several files.
         b_data, show_content = self._loader._get_file_contents(filename)
         data = to_text(b_data, errors='surrogate_or_strict')
 
-        self.show_content = show_content
-        return self._loader.load(data, file_name=filename, show_content=show_content) or {}
+        return self._loader.load(data, file_name=filename, show_content=show_content) or {}, show_content
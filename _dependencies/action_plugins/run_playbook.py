@@ -0,0 +1,136 @@
+# Copyright (c) 2020, Sky UK Ltd
+# BSD 3-Clause License
+#
+# Runs a (nested) playbook, e.g. cluster.yml for each host during a redeploy, using a copy of the command line of the calling playbook (the 'argv' fact, from
+# vars_plugins/cli_facts.py), to which extra_vars (dicts, passed as JSON) and extra_args are appended.
+#
+# There are two drivers:
+#   + subprocess: runs a new ansible-playbook process (as a shell task would).  Its output is captured and returned in stdout/stderr.
+#   + inprocess:  runs the playbook in this (already-initialised) ansible process, avoiding the start-up cost of a new process (importing ansible, loading the collections,
+#                 parsing the inventory etc.) for every invocation.  The command line is parsed exactly as ansible-playbook would parse it.  Its output is displayed as it
+#                 runs (not captured).  (Action plugins run in a forked worker process, so changes to the global CLI context do not affect the calling playbook.)
+#                 The 'facts' (names of variables of the calling host) are set as facts of localhost in the nested run, so that it can reuse what the calling playbook has
+#                 already derived (e.g. the cluster definitions (cluster_definition_vars) and the discovered cluster_hosts_state), rather than derive it again.  The names of the facts that were
+#                 set are in the 'run_playbook_facts' fact.  (The subprocess driver cannot share facts, so ignores them.)
+#
+#    - run_playbook:
+#        argv: "{{ argv | map('regex_replace', 'redeploy.yml', mainclusteryml) | list }}"
+#        extra_vars:
+#          - cluster_suffix: "{{ cluster_suffix | string }}"
+#          - cluster_hosts_target: ["{{ host_to_redeploy }}"]
+#        extra_args: ["--tags=clusterverse_dynamic_inventory,clusterverse_readiness"]
+#        facts: "{{ cluster_definition_vars + ['cluster_hosts_state', 'cluster_hosts_state_index'] }}"
+#        driver: inprocess
+#      register: r__mainclusteryml
+#
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from ansible import context
+from ansible.cli.playbook import PlaybookCLI
+from ansible.errors import AnsibleError
+from ansible.plugins.action import ActionBase
+from ansible.module_utils._text import to_native, to_text
+from ansible.module_utils.six import string_types
+from ansible.utils.context_objects import CLIArgs
+from ansible.utils.display import Display
+import json
+import subprocess
+import sys
+import time
+import warnings
+
+display = Display()
+
+
+# ansible-playbook, with its command line parsed into a (plain) CLIArgs object in context.CLIARGS, rather than into the GlobalCLIArgs singleton, which can only be set
+# once per process.  'facts' are set as facts of localhost before the playbook runs.
+class NestedPlaybookCLI(PlaybookCLI):
+    def __init__(self, args, facts=None):
+        super(NestedPlaybookCLI, self).__init__(args)
+        self.facts = facts or {}
+
+    def parse(self):
+        self.init_parser()
+        try:
+            options = self.parser.parse_args(self.args[1:])
+        except SystemExit as ex:
+            if ex.code != 0:
+                self.parser.exit(status=2, message=" \n%s" % self.parser.format_help())
+            raise
+        context.CLIARGS = CLIArgs.from_options(self.post_process_args(options))
+
+    def _play_prereqs(self):
+        loader, inventory, variable_manager = super(NestedPlaybookCLI, self)._play_prereqs()
+        if self.facts:
+            variable_manager.set_nonpersistent_facts('localhost', dict(self.facts, run_playbook_facts=sorted(self.facts)))
+        return loader, inventory, variable_manager
+
+
+class ActionModule(ActionBase):
+
+    VALID_ARGUMENTS = ['argv', 'extra_vars', 'extra_args', 'facts', 'driver']
+    DRIVERS = ['subprocess', 'inprocess']
+
+    def run(self, tmp=None, task_vars=None):
+
+        if task_vars is None:
+            task_vars = dict()
+
+        for arg in self._task.args:
+            if not arg in self.VALID_ARGUMENTS:
+                raise AnsibleError('%s is not a valid option in run_playbook' % arg)
+
+        driver = self._task.args.get('driver', 'subprocess')
+        if driver not in self.DRIVERS:
+            raise AnsibleError('driver must be one of %s (not %s)' % (self.DRIVERS, driver))
+
+        extra_vars = self._task.args.get('extra_vars') or []
+        if isinstance(extra_vars, dict):
+            extra_vars = [extra_vars]
+
+        cmd = [to_text(arg) for arg in self._task.args['argv']]
+        for extra_var in extra_vars:
+            if extra_var:
+                cmd.extend(['-e', extra_var if isinstance(extra_var, string_types) else json.dumps(extra_var, separators=(',', ':'))])
+        cmd.extend([to_text(arg) for arg in self._task.args.get('extra_args') or []])
+
+        # The facts are taken (untemplated, as the calling host has them) from the task vars; those that are not defined are not set.
+        facts = dict((name, task_vars[name]) for name in self._task.args.get('facts') or [] if name in task_vars)
+
+        result = super(ActionModule, self).run(task_vars=task_vars)
+        result.update({'cmd': cmd, 'driver': driver, 'changed': True, 'stdout': '', 'stderr': ''})
+
+        start_time = time.time()
+        if driver == 'subprocess':
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            stdout, stderr = process.communicate()
+            result.update({'rc': process.returncode, 'stdout': to_text(stdout, errors='surrogate_or_strict').rstrip('\n'), 'stderr': to_text(stderr, errors='surrogate_or_strict').rstrip('\n')})
+        else:
+            result.update({'rc': self._run_inprocess(cmd, facts), 'facts': sorted(facts)})
+        result['elapsed'] = round(time.time() - start_time, 3)
+
+        result['stdout_lines'] = result['stdout'].splitlines()
+        result['stderr_lines'] = result['stderr'].splitlines()
+        if result['rc'] != 0:
+            result['failed'] = True
+            result['msg'] = 'non-zero return code'
+
+        return result
+
+    # The nested run sees its own command line (in context.CLIARGS and sys.argv, which vars_plugins/cli_facts.py exposes); both are restored afterwards.
+    def _run_inprocess(self, cmd, facts):
+        cliargs, argv = context.CLIARGS, sys.argv
+        sys.argv = list(cmd)
+        try:
+            with warnings.catch_warnings():
+                warnings.filterwarnings('ignore', message='AnsibleCollectionFinder has already been configured')
+                return NestedPlaybookCLI(cmd, facts=facts).run()
+        except SystemExit as e:
+            return e.code if isinstance(e.code, int) else 1
+        except AnsibleError as e:
+            display.error(to_native(e))
+            return 1
+        finally:
+            context.CLIARGS, sys.argv = cliargs, argv
@@ -0,0 +1,348 @@
+# Copyright (c) 2020, Sky UK Ltd
+# BSD 3-Clause License
+#
+# Profiles a clusterverse run (cluster.yml, redeploy.yml), including the nested playbooks that redeploy runs (run_playbook, with either driver).  Records the
+# duration of each task (per role, and per host), the calls to cloud APIs (count and latency, per module), and the time spent templating the set_fact tasks.
+# At the end of the (top-level) run, writes a trace in Chrome trace format (load in chrome://tracing or https://ui.perfetto.dev), and displays a summary.
+#
+# Nested runs inherit (through the environment) the directory to which each run writes its own part of the trace, which the top-level run then merges, so each
+# nested run appears as a separate process in the trace.
+#
+# The headline metrics of the run (wall-clock time, time per role, cloud API calls per module, peak controller memory) are also written to a .metrics.json file.  If
+# a 'baseline' file is given, they are compared with the baseline for the same playbook and number of hosts, and any that are worse by more than the
+# 'regression_threshold' are flagged as regressions; with 'update_baseline', this run's metrics become the baseline.  E.g. to benchmark a change against a local
+# cloud simulator (see README.md):
+#   CLUSTERVERSE_PROFILE_BASELINE=~/cv-baseline.json CLUSTERVERSE_PROFILE_UPDATE_BASELINE=true ansible-playbook cluster.yml ...    # before the change
+#   CLUSTERVERSE_PROFILE_BASELINE=~/cv-baseline.json ansible-playbook cluster.yml ...                                              # after the change
+#
+# Enable it in ansible.cfg:
+#   [defaults]
+#   callbacks_enabled = clusterverse_profile
+#
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = '''
+    name: clusterverse_profile
+    type: aggregate
+    short_description: Profiles clusterverse runs (including nested runs), writing a Chrome trace and a summary
+    description:
+        - Records per-role, per-task and per-host durations, cloud API call counts and latencies, and set_fact templating time.
+        - Nested ansible-playbook runs (e.g. from redeploy) are included in the trace of the top-level run.
+        - Optionally compares the run's metrics with a stored baseline, and flags regressions.
+    requirements:
+      - enable in configuration
+    options:
+      output_dir:
+        description: The directory in which the trace (<playbook>-<timestamp>.trace.json) is written.
+        default: ~/.cache/clusterverse/profile
+        type: path
+        env:
+          - name: CLUSTERVERSE_PROFILE_OUTPUT_DIR
+        ini:
+          - section: callback_clusterverse_profile
+            key: output_dir
+      summary_rows:
+        description: The number of rows in each table of the summary.
+        default: 15
+        type: int
+        env:
+          - name: CLUSTERVERSE_PROFILE_SUMMARY_ROWS
+        ini:
+          - section: callback_clusterverse_profile
+            key: summary_rows
+      baseline:
+        description: A JSON file of baseline metrics (per playbook and number of hosts) with which to compare the run's metrics.
+        type: path
+        env:
+          - name: CLUSTERVERSE_PROFILE_BASELINE
+        ini:
+          - section: callback_clusterverse_profile
+            key: baseline
+      update_baseline:
+        description: Store the run's metrics in the I(baseline) file (replacing those of the same playbook and number of hosts), rather than comparing them.
+        default: false
+        type: bool
+        env:
+          - name: CLUSTERVERSE_PROFILE_UPDATE_BASELINE
+        ini:
+          - section: callback_clusterverse_profile
+            key: update_baseline
+      regression_threshold:
+        description: The ratio (of a metric to its baseline) above which it is flagged as a regression.
+        default: 1.2
+        type: float
+        env:
+          - name: CLUSTERVERSE_PROFILE_REGRESSION_THRESHOLD
+        ini:
+          - section: callback_clusterverse_profile
+            key: regression_threshold
+'''
+
+import glob
+import json
+import os
+import re
+import resource
+import shutil
+import sys
+import time
+
+from ansible.module_utils._text import to_text
+from ansible.plugins.callback import CallbackBase
+
+PARTS_DIR_ENV = 'CLUSTERVERSE_PROFILE_PARTS_DIR'
+DEPTH_ENV = 'CLUSTERVERSE_PROFILE_DEPTH'
+
+# Modules that call a cloud API
+CLOUD_ACTION_RE = re.compile(r'(^|\.)(ec2\w*|route53\w*|elb\w*|s3_\w+|iam\w*|sts_\w+|aws_\w+|gcp_\w+|clouddns_\w+|azure_rm_\w+)$')
+# The counters of API calls that (some of) those modules return
+API_CALL_RESULT_KEYS = ['api_calls', 'calls', 'launch_calls']
+# Differences in time smaller than this (seconds) are never regressions (they are noise)
+REGRESSION_MIN_SECONDS = 1.0
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))] if values else 0
+
+
+# The peak resident memory (MB) of this process, or of the largest of its (finished) children, i.e. the forked workers.  (ru_maxrss is in KB on Linux, bytes on macOS.)
+def maxrss_mb():
+    scale = 1048576.0 if sys.platform == 'darwin' else 1024.0
+    return round(max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / scale, 1)
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'clusterverse_profile'
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self):
+        super(CallbackModule, self).__init__()
+        self.start = time.time()
+        self.playbook = 'playbook'
+        self.tasks = []
+        self.current_task = None
+        self.current_play = None
+        self.plays = []
+        self.depth = int(os.environ.get(DEPTH_ENV, '-1')) + 1
+        self.is_top_level = PARTS_DIR_ENV not in os.environ
+        self.parts_dir = os.environ.get(PARTS_DIR_ENV)
+
+    def set_options(self, task_keys=None, var_options=None, direct=None):
+        super(CallbackModule, self).set_options(task_keys=task_keys, var_options=var_options, direct=direct)
+        # Set in the environment here (in the controller process), so that the worker processes (and the nested runs they start) inherit them.
+        if self.is_top_level:
+            self.parts_dir = os.path.join(os.path.expanduser(self.get_option('output_dir')), '.parts-%d-%d' % (os.getpid(), int(self.start)))
+            os.environ[PARTS_DIR_ENV] = self.parts_dir
+        os.environ[DEPTH_ENV] = str(self.depth)
+
+    def v2_playbook_on_start(self, playbook):
+        self.playbook = os.path.basename(playbook._file_name)
+
+    def v2_playbook_on_play_start(self, play):
+        self._end_task()
+        self._end_play()
+        self.current_play = {'name': to_text(play.get_name()), 'start': time.time(), 'end': None}
+
+    def _end_play(self):
+        if self.current_play:
+            self.current_play['end'] = time.time()
+            self.plays.append(self.current_play)
+            self.current_play = None
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self._end_task()
+        self.current_task = {'name': to_text(task.get_name()), 'action': to_text(task.action), 'role': to_text(task._role.get_name()) if task._role else '',
+                             'start': time.time(), 'end': None, 'hosts': {}, 'api_calls': 0}
+
+    v2_playbook_on_handler_task_start = v2_playbook_on_task_start
+
+    def _end_task(self):
+        if self.current_task:
+            self.current_task['end'] = time.time()
+            self.tasks.append(self.current_task)
+            self.current_task = None
+
+    def v2_runner_on_start(self, host, task):
+        if self.current_task:
+            self.current_task['hosts'].setdefault(host.get_name(), {'start': time.time(), 'end': None, 'status': None})
+
+    def _host_result(self, result, status):
+        if not self.current_task:
+            return
+        now = time.time()
+        host = self.current_task['hosts'].setdefault(result._host.get_name(), {'start': now, 'end': None, 'status': None})
+        host.update({'end': now, 'status': status})
+        if status != 'skipped' and CLOUD_ACTION_RE.search(self.current_task['action']):
+            results = result._result.get('results')
+            if not (isinstance(results, list) and results and isinstance(results[0], dict) and 'ansible_loop_var' in results[0]):
+                results = [result._result]
+            for item_result in results:
+                counted = [item_result[key] for key in API_CALL_RESULT_KEYS if isinstance(item_result.get(key), int)]
+                self.current_task['api_calls'] += counted[0] if counted else 1
+
+    def v2_runner_on_ok(self, result):
+        self._host_result(result, 'ok')
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._host_result(result, 'failed')
+
+    def v2_runner_on_skipped(self, result):
+        self._host_result(result, 'skipped')
+
+    def v2_runner_on_unreachable(self, result):
+        self._host_result(result, 'unreachable')
+
+    def v2_playbook_on_stats(self, stats):
+        self._end_task()
+        self._end_play()
+        part = {'pid': os.getpid(), 'depth': self.depth, 'playbook': self.playbook, 'start': self.start, 'end': time.time(), 'plays': self.plays, 'tasks': self.tasks, 'maxrss_mb': maxrss_mb()}
+
+        if not self.is_top_level:
+            if not os.path.isdir(self.parts_dir):
+                os.makedirs(self.parts_dir)
+            with open(os.path.join(self.parts_dir, 'part-%d-%d.json' % (os.getpid(), int(self.start * 1000))), 'w') as part_file:
+                json.dump(part, part_file)
+            return
+
+        parts = [part]
+        for part_filename in sorted(glob.glob(os.path.join(self.parts_dir, 'part-*.json'))):
+            with open(part_filename, 'r') as part_file:
+                parts.append(json.load(part_file))
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
+
+        output_dir = os.path.expanduser(self.get_option('output_dir'))
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        output_basename = os.path.join(output_dir, '%s-%s' % (os.path.splitext(self.playbook)[0], time.strftime('%Y%m%dT%H%M%S', time.localtime(self.start))))
+        with open(output_basename + '.trace.json', 'w') as trace_file:
+            json.dump(self._chrome_trace(parts), trace_file)
+        metrics = self._metrics(parts)
+        with open(output_basename + '.metrics.json', 'w') as metrics_file:
+            json.dump(metrics, metrics_file, indent=2, sort_keys=True)
+
+        self._display_summary(parts)
+        if self.get_option('baseline'):
+            self._baseline(metrics)
+        self._display.display(u"clusterverse_profile: trace written to %s.trace.json" % output_basename)
+
+    # Each run is a process; its plays and tasks are on the first thread, and each host has its own thread.
+    @staticmethod
+    def _chrome_trace(parts):
+        events = []
+
+        def span(name, cat, start, end, pid, tid, args=None):
+            events.append({'name': name, 'cat': cat, 'ph': 'X', 'ts': int(start * 1e6), 'dur': max(0, int(((end or start) - start) * 1e6)), 'pid': pid, 'tid': tid, 'args': args or {}})
+
+        for part_index, part in enumerate(parts):
+            pid = part_index + 1
+            events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': '%s%s (pid %d)' % ('  ' * part['depth'], part['playbook'], part['pid'])}})
+            events.append({'name': 'process_sort_index', 'ph': 'M', 'pid': pid, 'args': {'sort_index': pid}})
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': 'plays/tasks'}})
+            span(part['playbook'], 'playbook', part['start'], part['end'], pid, 0)
+            for play in part['plays']:
+                span(play['name'], 'play', play['start'], play['end'], pid, 0)
+            host_tids = {}
+            for task in part['tasks']:
+                span(task['name'], 'task', task['start'], task['end'], pid, 0, {'role': task['role'], 'action': task['action'], 'api_calls': task['api_calls']})
+                for host_name, host in sorted(task['hosts'].items()):
+                    if host_name not in host_tids:
+                        host_tids[host_name] = len(host_tids) + 1
+                        events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': host_tids[host_name], 'args': {'name': host_name}})
+                    span(task['name'], 'host', host['start'], host['end'], pid, host_tids[host_name], {'status': host['status'], 'role': task['role']})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def _display_summary(self, parts):
+        rows = self.get_option('summary_rows')
+        tasks = [dict(task, depth=part['depth']) for part in parts for task in part['tasks']]
+        duration = lambda entry: (entry['end'] or entry['start']) - entry['start']
+
+        lines = ['', 'CLUSTERVERSE PROFILE: %s, %.1fs, %d nested run(s)' % (self.playbook, parts[0]['end'] - parts[0]['start'], len(parts) - 1), '']
+
+        by_role = {}
+        for task in tasks:
+            role = by_role.setdefault((task['role'] or '(play)', task['depth']), {'tasks': 0, 'seconds': 0.0})
+            role['tasks'] += 1
+            role['seconds'] += duration(task)
+        lines.append('%-50s %5s %7s %10s' % ('Role', 'Depth', 'Tasks', 'Seconds'))
+        for (role, depth), totals in sorted(by_role.items(), key=lambda item: -item[1]['seconds'])[:rows]:
+            lines.append('%-50s %5d %7d %10.2f' % (role[:50], depth, totals['tasks'], totals['seconds']))
+
+        lines += ['', '%-70s %5s %10s %10s' % ('Task', 'Depth', 'Seconds', 'Slowest host')]
+        for task in sorted(tasks, key=lambda task: -duration(task))[:rows]:
+            slowest = max(task['hosts'].items(), key=lambda item: duration(item[1]))[0] if task['hosts'] else ''
+            lines.append('%-70s %5d %10.2f %s' % (task['name'][:70], task['depth'], duration(task), slowest))
+
+        set_facts = [task for task in tasks if task['action'] in ['set_fact', 'ansible.builtin.set_fact', 'ansible.legacy.set_fact']]
+        if set_facts:
+            lines += ['', '%-70s %10s   (templating time, %.2fs in total)' % ('set_fact', 'Seconds', sum(duration(task) for task in set_facts))]
+            for task in sorted(set_facts, key=lambda task: -duration(task))[:rows]:
+                lines.append('%-70s %10.2f' % (task['name'][:70], duration(task)))
+
+        by_action = {}
+        for task in tasks:
+            if task['api_calls']:
+                action = by_action.setdefault(task['action'], {'calls': 0, 'latencies': []})
+                action['calls'] += task['api_calls']
+                action['latencies'].extend(duration(host) for host in task['hosts'].values() if host['status'] not in [None, 'skipped'])
+        if by_action:
+            lines += ['', '%-50s %7s %9s %9s %9s %9s' % ('Cloud module', 'Calls', 'Total(s)', 'p50(s)', 'p95(s)', 'max(s)')]
+            for action_name, action in sorted(by_action.items(), key=lambda item: -sum(item[1]['latencies'])):
+                lines.append('%-50s %7d %9.2f %9.2f %9.2f %9.2f' % (action_name[:50], action['calls'], sum(action['latencies']), percentile(action['latencies'], 50), percentile(action['latencies'], 95), max(action['latencies'] or [0])))
+
+        self._display.display(u'\n'.join(lines))
+
+    # The headline metrics of the run (including the nested runs).  The (cluster) hosts are those that any task ran on, other than localhost.
+    @staticmethod
+    def _metrics(parts):
+        tasks = [task for part in parts for task in part['tasks']]
+        metrics = {'playbook': parts[0]['playbook'], 'hosts': len(set(host for task in tasks for host in task['hosts']) - set(['localhost'])),
+                   'seconds': round(parts[0]['end'] - parts[0]['start'], 2), 'maxrss_mb': max(part['maxrss_mb'] for part in parts), 'roles': {}, 'api_calls': {}}
+        for task in tasks:
+            role = task['role'] or '(play)'
+            metrics['roles'][role] = round(metrics['roles'].get(role, 0.0) + (task['end'] or task['start']) - task['start'], 2)
+            if task['api_calls']:
+                metrics['api_calls'][task['action']] = metrics['api_calls'].get(task['action'], 0) + task['api_calls']
+        return metrics
+
+    # Compare the metrics with (or store them as) the baseline of the same playbook and number of hosts.
+    def _baseline(self, metrics):
+        baseline_filename = os.path.expanduser(self.get_option('baseline'))
+        key = '%s/%d' % (metrics['playbook'], metrics['hosts'])
+        baselines = {}
+        if os.path.isfile(baseline_filename):
+            with open(baseline_filename, 'r') as baseline_file:
+                baselines = json.load(baseline_file)
+
+        if self.get_option('update_baseline'):
+            baselines[key] = metrics
+            with open(baseline_filename, 'w') as baseline_file:
+                json.dump(baselines, baseline_file, indent=2, sort_keys=True)
+            self._display.display(u"clusterverse_profile: baseline for %s written to %s" % (key, baseline_filename))
+            return
+
+        if key not in baselines:
+            self._display.warning(u"clusterverse_profile: no baseline for %s in %s" % (key, baseline_filename))
+            return
+
+        base = baselines[key]
+        threshold = self.get_option('regression_threshold')
+        comparisons = [('seconds', metrics['seconds'], base['seconds'], REGRESSION_MIN_SECONDS), ('maxrss_mb', metrics['maxrss_mb'], base['maxrss_mb'], 0)]
+        comparisons += [('role %s (seconds)' % role, seconds, base['roles'].get(role, 0.0), REGRESSION_MIN_SECONDS) for role, seconds in sorted(metrics['roles'].items())]
+        comparisons += [('%s (api calls)' % action, calls, base['api_calls'].get(action, 0), 0) for action, calls in sorted(metrics['api_calls'].items())]
+
+        lines = ['', '%-60s %12s %12s %8s' % ('Metric (vs baseline %s)' % key, 'This run', 'Baseline', 'Ratio')]
+        regressions = []
+        for name, value, base_value, min_difference in comparisons:
+            ratio = (value / float(base_value)) if base_value else (float('inf') if value else 1.0)
+            regressed = ratio > threshold and value - base_value > min_difference
+            lines.append('%-60s %12s %12s %8s%s' % (name[:60], value, base_value, '%.2f' % ratio if base_value else '-', '  REGRESSION' if regressed else ''))
+            if regressed:
+                regressions.append(name)
+        self._display.display(u'\n'.join(lines))
+        if regressions:
+            self._display.warning(u"clusterverse_profile: %d regression(s) (more than x%s the baseline): %s" % (len(regressions), threshold, ', '.join(regressions)))
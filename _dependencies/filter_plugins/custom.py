@@ -1,8 +1,11 @@
 #!/usr/bin/env python
 
+import threading
+
 from ansible.utils.display import Display
 from ansible import constants as C
 from ansible.module_utils._text import to_native, to_text
+from ansible.module_utils.six import string_types
 from ansible.template import AnsibleUndefined
 
 display = Display()
@@ -31,14 +34,81 @@ def dict_agg(dictarr, aggkeys):
     return json.dumps(results, indent=4)
 
 
-# Lookup IP from fqdn.  If fqdn is an IP, just return it
-def iplookup(fqdn):
+# Create a dict of dicts from the dictarr array of dicts, indexed on indexkey (which may be a nested key).  Differs from dict_agg in that each index value maps to a single dict (the last one found), and returns a dict rather than a json string.
+def dict_index(dictarr, indexkey):
+    results = {}
+
+    if dictarr:
+        for dictItem in dictarr:
+            newDictItem = dictItem
+            for subkey in indexkey.split('.'):
+                if subkey in newDictItem:
+                    newDictItem = newDictItem[subkey]
+                else:
+                    newDictItem = None
+                    break
+            if newDictItem is not None:
+                results[newDictItem] = dictItem
+
+    return results
+
+
+# Cache of DNS lookups, shared by the iplookup filters (for the life of the process): {(fqdn, rdtype): (expiration, [addresses])}.  Entries expire with the TTL of the answer.
+_iplookup_cache = {}
+_iplookup_cache_stats = {'hits': 0, 'misses': 0}
+_iplookup_cache_lock = threading.Lock()
+
+
+# Lookup all the addresses of fqdn (cached, for the TTL of the answer).  If fqdn is an IP, just return it.
+def _iplookup(fqdn, rdtype='A'):
     import re
+    import time
     if re.match(r"^(?:(?:\d|[1-9]\d|1\d\d|2[0-4]\d|25[0-5])\.){3}(?:\d|[1-9]\d|1\d\d|2[0-4]\d|25[0-5])$", fqdn):
-        return fqdn
+        return [fqdn]
+
+    cached = _iplookup_cache.get((fqdn, rdtype))
+    hit = cached is not None and cached[0] > time.time()
+    with _iplookup_cache_lock:
+        _iplookup_cache_stats['hits' if hit else 'misses'] += 1
+    if hit:
+        return cached[1]
+
+    import dns.resolver
+    answer = getattr(dns.resolver, 'resolve', dns.resolver.query)(fqdn, rdtype)       # dnspython < 2.0 only has query()
+    addresses = [to_text(rdata) for rdata in answer]
+    _iplookup_cache[(fqdn, rdtype)] = (answer.expiration, addresses)
+    return addresses
+
+
+def _iplookup_display_stats():
+    lookups = _iplookup_cache_stats['hits'] + _iplookup_cache_stats['misses']
+    display.vvv(u"iplookup cache: %d hits, %d misses (%d%% hit rate)" % (_iplookup_cache_stats['hits'], _iplookup_cache_stats['misses'], 100 * _iplookup_cache_stats['hits'] // lookups if lookups else 0))
+
+
+# Lookup IP from fqdn.  If fqdn is an IP, just return it
+def iplookup(fqdn):
+    return _iplookup(fqdn)[0]
+
+
+# Lookup all the IPs of fqdn, (or of each of a list of fqdns, concurrently, returning a dict of {fqdn: [IPs]}).  With errors='ignore', names that cannot be resolved have no IPs, (otherwise the error is raised).
+def iplookup_all(fqdns, errors='strict', max_concurrency=16):
+    def lookup(fqdn):
+        try:
+            return _iplookup(fqdn)
+        except Exception:
+            if errors == 'ignore':
+                return []
+            raise
+
+    if isinstance(fqdns, string_types):
+        addresses = lookup(fqdns)
     else:
-        import dns.resolver
-        return to_text(dns.resolver.query(fqdn, 'A')[0])
+        from concurrent.futures import ThreadPoolExecutor
+        fqdns = list(fqdns)
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(fqdns)))) as executor:
+            addresses = dict(zip(fqdns, executor.map(lookup, fqdns)))
+    _iplookup_display_stats()
+    return addresses
 
 
 # Return extra_vars string from a dict of extra variables
@@ -52,10 +122,200 @@ def extravars_from_dict(extravars_dict):
         return ""
 
 
+# Create the cluster_hosts_target array of dicts (one per host, for every hosttype and AZ) from the cluster_vars definition, in a single pass.
+def cluster_hosts_target_from_cluster_vars(cluster_vars, buildenv, cluster_name, cluster_suffix):
+    import copy
+    results = []
+
+    for hosttype, hosttype_vars in cluster_vars[buildenv]['hosttype_vars'].items():
+        for azname, azcount in hosttype_vars['vms_by_az'].items():
+            for azidx in range(0, int(azcount)):
+                results.append({
+                    'hosttype': hosttype,
+                    'hostname': cluster_name + '-' + hosttype + '-' + to_text(azname) + to_text(azidx) + '-' + to_text(cluster_suffix),
+                    'az_name': to_text(azname),
+                    'flavor': hosttype_vars['flavor'],
+                    'image': hosttype_vars['image'] if 'image' in hosttype_vars else cluster_vars.get('image'),
+                    'auto_volumes': copy.deepcopy(hosttype_vars['auto_volumes'])
+                })
+
+    return results
+
+
+# Replace the image of each host in cluster_hosts_target with the image used by the 'current' hosts of the same hosttype in cluster_hosts_state (indexed by hosttype, first found wins).
+def cluster_hosts_target_existing_images(cluster_hosts_target, cluster_hosts_state):
+    image_by_hosttype = {}
+    for host in cluster_hosts_state or []:
+        tagslabels = host.get('tagslabels') or {}
+        if tagslabels.get('lifecycle_state') == 'current' and host.get('image') and tagslabels.get('hosttype') not in image_by_hosttype:
+            image_by_hosttype[tagslabels.get('hosttype')] = host['image']
+
+    return [dict(host, image=image_by_hosttype[host['hosttype']]) if host['hosttype'] in image_by_hosttype else dict(host) for host in cluster_hosts_target]
+
+
+# Add the 'vpc_subnet_id' to each host in cluster_hosts_target, (the first subnet whose Name tag starts with vpc_subnet_name_prefix + az_name).  Subnets are indexed by AZ, so the subnet list is only scanned once per AZ rather than once per host.
+def cluster_hosts_target_aws_subnets(cluster_hosts_target, subnets, vpc_subnet_name_prefix):
+    subnet_id_by_az = {}
+    for host in cluster_hosts_target:
+        if host['az_name'] not in subnet_id_by_az:
+            subnet_id_by_az[host['az_name']] = next((subnet['subnet_id'] for subnet in subnets if to_text((subnet.get('tags') or {}).get('Name', '')).startswith(vpc_subnet_name_prefix + host['az_name'])), None)
+
+    return [dict(host, vpc_subnet_id=to_text(subnet_id_by_az[host['az_name']])) for host in cluster_hosts_target]
+
+
+# Add the 'snapshot' id to the auto_volumes (that define 'snapshot_tags') of each host in cluster_hosts_target, matching the snapshot Name tag against the host topology (e.g. '-a0-').  Snapshots are indexed by topology.
+def cluster_hosts_target_aws_snapshots(cluster_hosts_target, snapshots):
+    import copy
+    import re
+    results = copy.deepcopy(cluster_hosts_target)
+    snapshot_by_topology = {}
+
+    for host in results:
+        topology = re.sub(r'^.*(-.*?-).*$', r'\1', host['hostname'])
+        if topology not in snapshot_by_topology:
+            snapshot_by_topology[topology] = next((snapshot for snapshot in snapshots or [] if topology in to_text((snapshot.get('tags') or {}).get('Name', ''))), None)
+        cur_snapshot = snapshot_by_topology[topology]
+        if cur_snapshot:
+            for vol in host['auto_volumes']:
+                if 'snapshot_tags' in vol:
+                    vol.update({'snapshot': cur_snapshot['snapshot_id']})
+                    vol.pop('snapshot_tags')
+
+    return results
+
+
+# Replace the image of each host in cluster_hosts_target with the latest baked image of its hosttype that was baked from that image (baked_images is a list of
+# {hosttype, source, image, created}).  On GCP, the source label is the lower-cased image name (truncated to 63 characters), rather than the image URL.
+def cluster_hosts_target_baked_images(cluster_hosts_target, baked_images):
+    latest_baked_image = {}
+    for baked_image in sorted(baked_images or [], key=lambda baked_image: to_text(baked_image.get('created', ''))):
+        latest_baked_image[(baked_image.get('hosttype'), baked_image.get('source'))] = baked_image['image']
+
+    results = []
+    for host in cluster_hosts_target:
+        image = to_text(host.get('image', ''))
+        baked_image = latest_baked_image.get((host['hosttype'], image), latest_baked_image.get((host['hosttype'], image.rsplit('/', 1)[-1].lower()[:63])))
+        results.append(dict(host, image=baked_image) if baked_image else dict(host))
+    return results
+
+
+# The keys on which cluster_hosts_state is indexed, and how to find each within a cluster_hosts_state host.
+CLUSTER_HOSTS_STATE_INDEX_KEYS = {
+    'name': lambda host: host.get('name'),
+    'hosttype': lambda host: (host.get('tagslabels') or {}).get('hosttype'),
+    'lifecycle_state': lambda host: (host.get('tagslabels') or {}).get('lifecycle_state'),
+    'cluster_suffix': lambda host: (host.get('tagslabels') or {}).get('cluster_suffix'),
+    'regionzone': lambda host: host.get('regionzone')
+}
+
+
+# Create an index of cluster_hosts_state, so it can be queried with cluster_hosts_state_select/cluster_hosts_state_reject without re-scanning the whole array.  Returns {'hosts': [...], '<indexkey>': {'<value>': [positions in hosts]}, ...} for each of CLUSTER_HOSTS_STATE_INDEX_KEYS.
+def cluster_hosts_state_index(cluster_hosts_state):
+    index = {'hosts': list(cluster_hosts_state or [])}
+    for indexkey in CLUSTER_HOSTS_STATE_INDEX_KEYS:
+        index[indexkey] = {}
+
+    for pos, host in enumerate(index['hosts']):
+        for indexkey, getter in CLUSTER_HOSTS_STATE_INDEX_KEYS.items():
+            value = getter(host)
+            if value is not None:
+                index[indexkey].setdefault(to_text(value), []).append(pos)
+
+    return index
+
+
+# Return the positions (within the index's 'hosts') of the hosts that match ALL of criteria (e.g. {'lifecycle_state': 'current', 'hosttype': ['sys', 'data']}).
+def _cluster_hosts_state_positions(index, criteria):
+    from ansible.errors import AnsibleFilterError
+    positions = None
+
+    for indexkey, values in criteria.items():
+        if indexkey not in CLUSTER_HOSTS_STATE_INDEX_KEYS:
+            raise AnsibleFilterError("cluster_hosts_state index key '%s' is not one of: %s" % (indexkey, ", ".join(CLUSTER_HOSTS_STATE_INDEX_KEYS)))
+        if not isinstance(values, (list, tuple, set)):
+            values = [values]
+        matched = set(pos for value in values for pos in index[indexkey].get(to_text(value), []))
+        positions = matched if positions is None else positions & matched
+
+    return set(range(len(index['hosts']))) if positions is None else positions
+
+
+# Select the cluster_hosts_state hosts that match all of the criteria (e.g. "cluster_hosts_state_index | cluster_hosts_state_select(lifecycle_state='current')").  Accepts either a cluster_hosts_state_index, or a plain cluster_hosts_state array (which is indexed first).  Preserves the cluster_hosts_state order.
+def cluster_hosts_state_select(cluster_hosts_state, **criteria):
+    index = cluster_hosts_state if isinstance(cluster_hosts_state, dict) else cluster_hosts_state_index(cluster_hosts_state)
+    return [index['hosts'][pos] for pos in sorted(_cluster_hosts_state_positions(index, criteria))]
+
+
+# Reject the cluster_hosts_state hosts that match all of the criteria (e.g. "cluster_hosts_state_index | cluster_hosts_state_reject(lifecycle_state='current')").  The inverse of cluster_hosts_state_select.
+def cluster_hosts_state_reject(cluster_hosts_state, **criteria):
+    index = cluster_hosts_state if isinstance(cluster_hosts_state, dict) else cluster_hosts_state_index(cluster_hosts_state)
+    positions = _cluster_hosts_state_positions(index, criteria)
+    return [host for pos, host in enumerate(index['hosts']) if pos not in positions]
+
+
+# Create the dynamic inventory entries ({'name': ..., 'groups': [...], 'vars': {...}}) for the running hosts in cluster_hosts_state, in a single pass.  host_vars (e.g. ansible_user, ansible_ssh_common_args) are
+# added to every host.  If cluster_hosts_target is given, hosts that are not in it are also added to the 'not_target_hosts' group.
+def cluster_hosts_inventory(cluster_hosts_state, cluster_name, clusterid, inventory_ip='private', cluster_hosts_target=None, host_vars=None):
+    target_hostnames = set(host['hostname'] for host in cluster_hosts_target) if cluster_hosts_target is not None else None
+    results = []
+
+    for host in cluster_hosts_state or []:
+        if host.get('instance_state') not in ['RUNNING', 'running', 'poweredOn']:
+            continue
+        hosttype = host['tagslabels']['hosttype']
+        groups = [hosttype, cluster_name, clusterid]
+        hostvars = {'ansible_host': host['ipv4']['public'] if inventory_ip == 'public' else host['ipv4']['private'], 'hosttype': hosttype}
+        if host.get('regionzone'):
+            groups.append(host['regionzone'])
+            hostvars['regionzone'] = host['regionzone']
+        if target_hostnames is not None and host['name'] not in target_hostnames:
+            groups.append('not_target_hosts')
+        groups = sorted(set(groups), key=groups.index)      # A group (e.g. when cluster_name == clusterid) is listed once, as add_host would
+        hostvars.update(host_vars or {})
+        results.append({'name': host['name'], 'groups': groups, 'vars': hostvars})
+
+    return results
+
+
+# The order in which the (known) host vars are written to the INI inventory, and whether they are quoted.  Any other vars are written (quoted) after these.
+CLUSTER_HOSTS_INVENTORY_INI_VARS = [('ansible_host', False), ('hosttype', False), ('ansible_user', True), ('ansible_ssh_private_key_file', True), ('regionzone', False), ('ansible_ssh_common_args', True)]
+
+
+# Render the dynamic inventory entries (from cluster_hosts_inventory) as an INI inventory: a section for each group (sorted), containing its hosts (sorted), each with its vars.
+def cluster_hosts_inventory_ini(inventory):
+    known_vars = [var for var, quoted in CLUSTER_HOSTS_INVENTORY_INI_VARS]
+    hosts_by_group = {}
+    for host in inventory or []:
+        for group in host['groups']:
+            hosts_by_group.setdefault(group, []).append(host)
+
+    lines = []
+    for group in sorted(hosts_by_group):
+        lines.append('[' + group + ']')
+        for host in sorted(hosts_by_group[group], key=lambda host: host['name']):
+            host_vars = [(var, quoted) for var, quoted in CLUSTER_HOSTS_INVENTORY_INI_VARS if var in host['vars']] + [(var, True) for var in sorted(host['vars']) if var not in known_vars]
+            lines.append(' '.join([host['name']] + [var + "=" + ("'" + to_text(host['vars'][var]) + "'" if quoted else to_text(host['vars'][var])) for var, quoted in host_vars]))
+        lines.append('')
+
+    return '\n'.join(lines)
+
+
 class FilterModule(object):
     def filters(self):
         return {
             'dict_agg': dict_agg,
             'iplookup': iplookup,
-            'extravars_from_dict': extravars_from_dict
+            'iplookup_all': iplookup_all,
+            'extravars_from_dict': extravars_from_dict,
+            'cluster_hosts_target_from_cluster_vars': cluster_hosts_target_from_cluster_vars,
+            'cluster_hosts_target_existing_images': cluster_hosts_target_existing_images,
+            'cluster_hosts_target_aws_subnets': cluster_hosts_target_aws_subnets,
+            'cluster_hosts_target_aws_snapshots': cluster_hosts_target_aws_snapshots,
+            'cluster_hosts_target_baked_images': cluster_hosts_target_baked_images,
+            'dict_index': dict_index,
+            'cluster_hosts_state_index': cluster_hosts_state_index,
+            'cluster_hosts_state_select': cluster_hosts_state_select,
+            'cluster_hosts_state_reject': cluster_hosts_state_reject,
+            'cluster_hosts_inventory': cluster_hosts_inventory,
+            'cluster_hosts_inventory_ini': cluster_hosts_inventory_ini
         }
\ No newline at end of file
@@ -0,0 +1,250 @@
+# Copyright 2021 Dougal Seeley <github@dougalseeley.com>
+# BSD 3-Clause License
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+DOCUMENTATION = '''
+---
+module: auto_volumes
+version_added: 1.0.0
+short_description: Format, mount and check all of a host's auto_volumes in one module execution
+description:
+    - For each of I(volumes), finds its unpartitioned, unmounted block device in I(device_map) (from C(blockdevmap)), by C(device_name_cloud).
+    - Creates the filesystems on the devices that do not have one (C(mkfs) runs concurrently across devices, with the I(mkfs_opts) of the fstype, or the volume's
+      own C(mkfs_opts)), then adds them to fstab (by UUID) and mounts them.
+    - Sets the ownership and mode of each mountpoint (from C(perms)).
+    - Optionally (I(test_touch)), touches a C(.clusterversetest__) file in each mountpoint, and fails if there is more than one such file in any mountpoint,
+      (which indicates that a mountpoint has been mapped to a different device than on a previous run).
+    - This replaces the separate filesystem/mount/file/find tasks (one per volume), which each need a round-trip to the host.
+authors:
+    - Dougal Seeley <github@dougalseeley.com>
+options:
+  volumes:
+    description: The host's auto_volumes, (dicts of C(device_name), C(mountpoint), C(fstype) and optionally C(perms) (C(owner), C(group), C(mode)) and C(mkfs_opts)).
+    required: true
+    type: list
+    elements: dict
+  device_map:
+    description: The C(device_map) returned by C(blockdevmap).
+    required: true
+    type: list
+    elements: dict
+  mkfs_opts:
+    description: The extra options passed to mkfs, per fstype, e.g. C({"ext4": "-E lazy_itable_init=0,nodiscard", "xfs": "-K"}).
+    required: false
+    default: {}
+    type: dict
+  opts:
+    description: The mount options.
+    required: false
+    default: _netdev
+    type: str
+  fstab:
+    description: The fstab file.
+    required: false
+    default: /etc/fstab
+    type: path
+  max_concurrency:
+    description: The maximum number of filesystems that are created at the same time.
+    required: false
+    default: 8
+    type: int
+  test_touch:
+    description: Touch (and check) a C(.clusterversetest__) file in each mountpoint.
+    required: false
+    default: false
+    type: bool
+  test_touch_id:
+    description: The identity of the host in the C(.clusterversetest__) filename (e.g. the hostname without the cluster suffix).
+    required: false
+    default: ''
+    type: str
+  test_touch_device_name:
+    description: Include the device_name in the C(.clusterversetest__) filename, (not on GCP, where disks cannot be renamed when they are moved to a new host).
+    required: false
+    default: true
+    type: bool
+'''
+
+EXAMPLES = '''
+- name: Format, mount and check the auto_volumes
+  auto_volumes:
+    volumes: "{{ auto_vols }}"
+    device_map: "{{ r__blockdevmap.device_map }}"
+    mkfs_opts: { ext4: "-E nodiscard", xfs: "-K" }
+    test_touch: "{{ test_touch_disks | default(false) | bool }}"
+    test_touch_id: "{{ inventory_hostname | regex_replace('-(?!.*-).*') }}"
+    test_touch_device_name: "{{ cluster_vars.type != 'gcp' }}"
+  become: yes
+  register: r__auto_volumes
+'''
+
+RETURN = '''
+volumes:
+  description: The result for each volume.
+  returned: always
+  type: list
+  sample: [{"device_name": "/dev/sdf", "device_name_os": "/dev/nvme1n1", "mountpoint": "/media/mysvc", "fstype": "ext4", "uuid": "c3630dbe-042e-44e5-ac67-54fa1c9e4cd2",
+            "mkfs": true, "mkfs_opts": "-E nodiscard", "mounted": true, "test_files": ["/media/mysvc/.clusterversetest__test-sys-a0___media_mysvc___dev_sdf"]}]
+timings:
+  description: The time taken (seconds) by each step.
+  returned: always
+  type: dict
+  sample: {"map": 0.0, "mkfs": 1.234, "mount": 0.052, "perms": 0.001, "test_touch": 0.002}
+'''
+
+import os
+import shlex
+import time
+
+from ansible.module_utils.basic import AnsibleModule
+
+
+class AutoVolumes(object):
+    def __init__(self, module):
+        self.module = module
+        self.volumes = []
+        self.timings = {}
+
+    def timed(self, step, func):
+        start_time = time.time()
+        func()
+        self.timings[step] = round(time.time() - start_time, 3)
+
+    # The (unpartitioned, unmounted) device of each volume.  Volumes whose device is already mounted (or not attached) are left alone, as before.
+    def map(self):
+        for volume in self.module.params['volumes']:
+            device = next((device for device in self.module.params['device_map'] if device.get('device_name_cloud') == volume['device_name'] and device.get('TYPE') == 'disk'
+                           and device.get('parttable_type', '') == '' and device.get('MOUNTPOINT', '') == ''), None)
+            self.volumes.append({'device_name': volume['device_name'], 'mountpoint': volume['mountpoint'], 'fstype': volume['fstype'], 'perms': volume.get('perms') or {},
+                                 'mkfs_opts': volume.get('mkfs_opts', self.module.params['mkfs_opts'].get(volume['fstype'])) or '',
+                                 'device_name_os': device['device_name_os'] if device else None, 'uuid': (device.get('UUID') or None) if device else None,
+                                 'has_fs': bool(device and device.get('FSTYPE')), 'mkfs': False, 'mounted': False})
+
+    def blkid(self, device_name_os, tag):
+        rc, out, err = self.module.run_command(['blkid', '-p', '-s', tag, '-o', 'value', device_name_os])
+        return out.strip() if rc == 0 else ''
+
+    def mkfs_volume(self, volume):
+        if self.blkid(volume['device_name_os'], 'TYPE'):  # Never format a device that has gained a filesystem since blockdevmap ran
+            return volume
+        rc, out, err = self.module.run_command([self.module.get_bin_path('mkfs.' + volume['fstype'], required=True)] + shlex.split(volume['mkfs_opts']) + [volume['device_name_os']])
+        if rc != 0:
+            volume['mkfs_error'] = err or out
+            return volume
+        volume.update({'mkfs': True, 'uuid': self.blkid(volume['device_name_os'], 'UUID')})
+        return volume
+
+    def mkfs(self):
+        volumes = [volume for volume in self.volumes if volume['device_name_os'] and not volume['has_fs']]
+        if not volumes or self.module.check_mode:
+            for volume in volumes:
+                volume['mkfs'] = True
+            return
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=max(1, min(self.module.params['max_concurrency'], len(volumes)))) as executor:
+            list(executor.map(self.mkfs_volume, volumes))
+        failed = [volume for volume in volumes if volume.get('mkfs_error')]
+        if failed:
+            self.module.fail_json(msg="Failed to create filesystem(s): " + "; ".join("%s: %s" % (volume['device_name_os'], volume['mkfs_error']) for volume in failed), volumes=self.volumes)
+
+    # Add all the volumes to fstab (in one write, replacing any existing entry for the mountpoint), then mount them.
+    def mount(self):
+        volumes = [volume for volume in self.volumes if volume['uuid']]
+        if not volumes:
+            return
+        with open(self.module.params['fstab'], 'r') as fstab_file:
+            lines = fstab_file.readlines()
+        entries = dict((volume['mountpoint'], "UUID=%s %s %s %s 0 0\n" % (volume['uuid'], volume['mountpoint'], volume['fstype'], self.module.params['opts'])) for volume in volumes)
+        new_lines = []
+        for line in lines:
+            mountpoint = line.split()[1] if not line.strip().startswith('#') and len(line.split()) > 1 else None
+            if mountpoint not in entries:
+                new_lines.append(line)
+            elif entries[mountpoint]:
+                new_lines.append(entries[mountpoint])
+                entries[mountpoint] = None
+        if new_lines and not new_lines[-1].endswith('\n'):
+            new_lines[-1] += '\n'
+        new_lines += [entries[volume['mountpoint']] for volume in volumes if entries[volume['mountpoint']]]
+        if new_lines != lines and not self.module.check_mode:
+            tmp_fstab = self.module.params['fstab'] + '.auto_volumes'
+            with open(tmp_fstab, 'w') as fstab_file:
+                fstab_file.writelines(new_lines)
+            self.module.atomic_move(tmp_fstab, self.module.params['fstab'])
+
+        for volume in volumes:
+            volume['mounted'] = True
+            if not self.module.check_mode:
+                if not os.path.isdir(volume['mountpoint']):
+                    os.makedirs(volume['mountpoint'])
+                rc, out, err = self.module.run_command(['mount', '--fstab', self.module.params['fstab'], volume['mountpoint']])
+                if rc != 0:
+                    self.module.fail_json(msg="Failed to mount %s on %s: %s" % (volume['device_name_os'], volume['mountpoint'], err or out), volumes=self.volumes)
+
+    def perms(self):
+        for volume in self.volumes:
+            if self.module.check_mode and not os.path.isdir(volume['mountpoint']):
+                continue
+            if not os.path.isdir(volume['mountpoint']):
+                os.makedirs(volume['mountpoint'])
+            changed = False
+            if volume['perms'].get('owner') is not None:
+                changed = self.module.set_owner_if_different(volume['mountpoint'], volume['perms']['owner'], changed)
+            if volume['perms'].get('group') is not None:
+                changed = self.module.set_group_if_different(volume['mountpoint'], volume['perms']['group'], changed)
+            if volume['perms'].get('mode') is not None:
+                changed = self.module.set_mode_if_different(volume['mountpoint'], volume['perms']['mode'], changed)
+            volume['perms_changed'] = changed
+
+    def test_touch(self):
+        for volume in self.volumes:
+            test_file = ".clusterversetest__%s__%s" % (self.module.params['test_touch_id'], volume['mountpoint'].replace('/', '_'))
+            if self.module.params['test_touch_device_name']:
+                test_file += "__" + volume['device_name'].replace('/', '_')
+            if not self.module.check_mode:
+                with open(os.path.join(volume['mountpoint'], test_file), 'a'):
+                    os.utime(os.path.join(volume['mountpoint'], test_file), None)
+            volume['test_files'] = sorted(os.path.join(volume['mountpoint'], name) for name in os.listdir(volume['mountpoint']) if name.startswith('.clusterversetest__')) if os.path.isdir(volume['mountpoint']) else []
+
+        in_error = [{'device_name': volume['device_name'], 'mountpoint': volume['mountpoint'], 'files': volume['test_files']} for volume in self.volumes if len(volume['test_files']) > 1]
+        if in_error:
+            self.module.fail_json(msg="ERROR - Exactly one file should exist per storage device.  In error %s" % in_error, volumes=self.volumes, timings=self.timings)
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            volumes=dict(type='list', elements='dict', required=True),
+            device_map=dict(type='list', elements='dict', required=True),
+            mkfs_opts=dict(type='dict', default={}),
+            opts=dict(type='str', default='_netdev'),
+            fstab=dict(type='path', default='/etc/fstab'),
+            max_concurrency=dict(type='int', default=8),
+            test_touch=dict(type='bool', default=False),
+            test_touch_id=dict(type='str', default=''),
+            test_touch_device_name=dict(type='bool', default=True)
+        ),
+        supports_check_mode=True
+    )
+
+    mountpoints = [volume['mountpoint'] for volume in module.params['volumes']]
+    if len(set(mountpoints)) != len(mountpoints):
+        module.fail_json(msg="Each of the volumes must have a different mountpoint: %s" % mountpoints)
+
+    auto_volumes = AutoVolumes(module)
+    auto_volumes.timed('map', auto_volumes.map)
+    auto_volumes.timed('mkfs', auto_volumes.mkfs)
+    auto_volumes.timed('mount', auto_volumes.mount)
+    auto_volumes.timed('perms', auto_volumes.perms)
+    if module.params['test_touch']:
+        auto_volumes.timed('test_touch', auto_volumes.test_touch)
+
+    changed = any(volume['mkfs'] or volume['mounted'] or volume.get('perms_changed') for volume in auto_volumes.volumes)
+    module.exit_json(changed=changed, volumes=auto_volumes.volumes, timings=auto_volumes.timings)
+
+
+if __name__ == '__main__':
+    main()
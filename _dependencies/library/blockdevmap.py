@@ -19,6 +19,22 @@ version_added: 1.0.0
 short_description: blockdevmap
 description:
     - Map the block device name as defined in AWS/GCP/Azure (e.g. /dev/sdf) with the volume provided to the OS
+options:
+    cloud_type:
+        description:
+            - The cloud on which the host is running (determines how device_name_cloud is mapped), or 'lsblk' for no cloud mapping
+        required: true
+        choices: ['aws', 'gcp', 'azure', 'lsblk']
+    probe:
+        description:
+            - How the block devices are discovered.  'sysfs' reads /sys/class/block and the udev database (/run/udev/data) directly; 'lsblk' runs lsblk and udevadm for each device.
+            - 'auto' uses sysfs, falling back to lsblk if the udev database is not available (e.g. in a container), or if a device has not yet been processed by udev.
+        default: auto
+        choices: ['auto', 'sysfs', 'lsblk']
+    timeout:
+        description:
+            - (aws) Timeout, in seconds, for the instance metadata service requests, and for identifying all the NVMe devices (which is done concurrently)
+        default: 10
 authors:
     - Dougal Seeley <blockdevmap@dougalseeley.com>
     - Amazon.com Inc.
@@ -235,6 +251,13 @@ RETURN = '''
         "parttable_type": ""
     }
 ]
+
+## Time taken (seconds) by each phase (imds and nvme_identify are aws only)
+"timings": {
+    "discover": 0.004,
+    "imds": 0.011,
+    "nvme_identify": 0.002
+}
 '''
 
 from ctypes import *
@@ -244,6 +267,8 @@ import os
 import sys
 import json
 import re
+import threading
+import time
 
 try:
     from ansible.module_utils.basic import AnsibleModule
@@ -259,9 +284,9 @@ except NameError:
     FileNotFoundError = IOError
 
 try:
-    from urllib.request import urlopen
+    from http.client import HTTPConnection
 except ImportError:
-    from urllib2 import urlopen
+    from httplib import HTTPConnection
 
 NVME_ADMIN_IDENTIFY = 0x06
 NVME_IOCTL_ADMIN_CMD = 0xC0484E41
@@ -347,9 +372,140 @@ class nvme_identify_controller(Structure):
 
 
 class cBlockDevMap(object):
+    # The root under which get_sysfs() finds sys/, run/udev/data/ and proc/.  Can be pointed at a recorded tree (see main()) to check the mapping of a different machine.
+    root = '/'
+
     def __init__(self, module, **kwds):
         self.module = module
-        self.device_map = self.get_lsblk()
+        self.device_map = None
+        self.timings = {}
+        start_time = time.time()
+        probe = module.params.get('probe', 'auto')
+        if probe in ['auto', 'sysfs']:
+            try:
+                self.device_map = self.get_sysfs()
+            except (IOError, OSError, ValueError) as e:
+                if probe == 'sysfs':
+                    self.module.fail_json(msg="Could not read the block devices from sysfs/udev: " + str(e))
+            if self.device_map is None and probe == 'sysfs':
+                self.module.fail_json(msg="The udev database is not available under " + os.path.join(self.root, 'run/udev/data'))
+        if self.device_map is None:
+            self.device_map = self.get_lsblk()
+        self.timings['discover'] = round(time.time() - start_time, 3)
+
+    class Timeout(Exception):
+        pass
+
+    # Call func(arg) for each of args, each in its own thread, waiting no longer than timeout (seconds) in total.  Returns {arg: (result, exception)}.  An arg whose call did
+    # not complete in time has a cBlockDevMap.Timeout exception (its thread is a daemon, so is abandoned rather than blocking the module from exiting).
+    @staticmethod
+    def run_concurrently(func, args, timeout):
+        results = dict((arg, (None, cBlockDevMap.Timeout("Timed out after %ss" % timeout))) for arg in args)
+
+        def run(arg):
+            try:
+                results[arg] = (func(arg), None)
+            except Exception as e:
+                results[arg] = (None, e)
+
+        threads = [threading.Thread(target=run, args=(arg,)) for arg in args]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        deadline = time.time() + timeout
+        for thread in threads:
+            thread.join(max(0, deadline - time.time()))
+        return dict(results)
+
+    def _read_attr(self, *path):
+        try:
+            with open(os.path.join(*path), 'r') as attr_file:
+                return attr_file.read().strip()
+        except (IOError, OSError):
+            return ""
+
+    # Unescape the octal sequences (e.g. '\040' for a space) used in /proc/self/mountinfo and /proc/swaps
+    @staticmethod
+    def _unmangle(path):
+        return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), path)
+
+    # Returns the mountpoints, indexed by both "major:minor" and the (resolved) source device path.  Swap devices are '[SWAP]', as per lsblk.
+    def get_mountpoints(self):
+        mountpoints = {}
+        with open(os.path.join(self.root, 'proc/self/mountinfo'), 'r') as mountinfo_file:
+            for line in mountinfo_file:
+                fields, _, super_fields = line.partition(' - ')
+                fields, super_fields = fields.split(), super_fields.split()
+                mountpoint = self._unmangle(fields[4])
+                mountpoints.setdefault(fields[2], mountpoint)
+                if len(super_fields) > 1 and super_fields[1].startswith('/dev/'):
+                    mountpoints.setdefault(os.path.realpath(self._unmangle(super_fields[1])), mountpoint)
+        try:
+            with open(os.path.join(self.root, 'proc/swaps'), 'r') as swaps_file:
+                for line in swaps_file.readlines()[1:]:
+                    mountpoints.setdefault(os.path.realpath(self._unmangle(line.split()[0])), '[SWAP]')
+        except (IOError, OSError):
+            pass
+        return mountpoints
+
+    def get_sysfs(self):
+        # Read the same attributes that get_lsblk() gets from lsblk and udevadm, directly from sysfs and the udev database, without any subprocesses.
+        # Returns None if there is no udev database (e.g. in a container), in which case we fall back to get_lsblk().  Also returns None if any device has not (yet) been processed by udev:
+        # lsblk would probe such a device itself, and reporting an empty FSTYPE for a formatted device is not safe (it may then be formatted again).
+        sys_class_block = os.path.join(self.root, 'sys/class/block')
+        udev_data = os.path.join(self.root, 'run/udev/data')
+        if not os.path.isdir(udev_data):
+            return None
+
+        mountpoints = self.get_mountpoints()
+        os_device_names = []
+        for name in os.listdir(sys_class_block):
+            sys_device = os.path.join(sys_class_block, name)
+            dev_t = self._read_attr(sys_device, 'dev')
+
+            # Only disk, part and lvm types (as get_lsblk()); exclude e.g. ram, loop, rom (sr), raid (md) and non-LVM device-mapper (e.g. crypt) devices.
+            if os.path.exists(os.path.join(sys_device, 'partition')):
+                devtype = 'part'
+            elif name.startswith('dm-'):
+                devtype = 'lvm' if self._read_attr(sys_device, 'dm', 'uuid').startswith('LVM-') else None
+            elif dev_t.split(':')[0] == '1' or re.match(r'^(ram|loop|sr|md|fd)\d', name):
+                devtype = None
+            else:
+                devtype = 'disk'
+            if devtype is None or not dev_t:
+                continue
+
+            udev_props = {}
+            try:
+                with open(os.path.join(udev_data, 'b' + dev_t), 'r') as udev_file:
+                    udev_props = dict(line[2:].rstrip('\n').split('=', 1) for line in udev_file if line.startswith('E:') and '=' in line)
+            except (IOError, OSError):
+                return None
+
+            device_name_os = '/dev/mapper/' + self._read_attr(sys_device, 'dm', 'name') if devtype == 'lvm' else '/dev/' + name
+            os_device = {'NAME': device_name_os.split('/')[-1],
+                         'TYPE': devtype,
+                         'UUID': udev_props.get('ID_FS_UUID', ""),
+                         'FSTYPE': udev_props.get('ID_FS_TYPE', ""),
+                         'MOUNTPOINT': mountpoints.get(dev_t, mountpoints.get(os.path.realpath(device_name_os), "")),
+                         'MODEL': "",
+                         'SERIAL': "",
+                         'SIZE': str(int(self._read_attr(sys_device, 'size') or 0) * 512),
+                         'HCTL': "",
+                         'device_name_os': device_name_os,
+                         'parttable_type': udev_props.get('ID_PART_TABLE_TYPE', "")}
+
+            # As lsblk, the model, serial and SCSI address (host:channel:target:lun) are only reported for whole disks
+            if devtype == 'disk':
+                os_device['MODEL'] = self._read_attr(sys_device, 'device', 'model') or udev_props.get('ID_MODEL', "").replace('_', ' ')
+                os_device['SERIAL'] = udev_props.get('ID_SCSI_SERIAL', udev_props.get('ID_SERIAL_SHORT', "")) or self._read_attr(sys_device, 'device', 'serial')
+                hctl = os.path.basename(os.path.realpath(os.path.join(sys_device, 'device')))
+                os_device['HCTL'] = hctl if re.match(r'^\d+:\d+:\d+:\d+$', hctl) else ""
+            os_device_names.append(os_device)
+
+        # Sort by NAME
+        os_device_names.sort(key=lambda k: k['NAME'])
+        return os_device_names
 
     def get_lsblk(self):
         # Get all existing block volumes by key=value, then parse this into a dictionary (which excludes non disk and partition block types, e.g. ram, loop).  Cannot use the --json output as it not supported on older versions of lsblk (e.g. CentOS 7)
@@ -406,35 +562,44 @@ class cGCPMapper(cBlockDevMap):
 
 
 class cAwsMapper(cBlockDevMap):
+    imds_endpoint = ('169.254.169.254', 80)
+
     def __init__(self, **kwds):
         super(cAwsMapper, self).__init__(**kwds)
+        timeout = self.module.params.get('timeout', 10)
 
         # Instance stores (AKA ephemeral volumes) do not appear to have a defined endpoint that maps between the /dev/sd[b-e] defined in the instance creation map, and the OS /dev/nvme[0-26]n1 device.
         # For this scenario, we can only return the instance stores in the order that they are defined.  Because instance stores do not survive a poweroff and cannot be detached and reattached, the order doesn't matter as much.
-        instance_store_map = []
-
-        response__block_device_mapping = urlopen('http://169.254.169.254/latest/meta-data/block-device-mapping/')
-        block_device_mappings = response__block_device_mapping.read().decode().split("\n")
-        for block_device_mappings__ephemeral_id in [dev for dev in block_device_mappings if dev.startswith('ephemeral')]:
-            response__ephemeral_device = urlopen("http://169.254.169.254/latest/meta-data/block-device-mapping/" + block_device_mappings__ephemeral_id)
-            block_device_mappings__ephemeral_mapped = response__ephemeral_device.read().decode()
-            instance_store_map.append({'ephemeral_id': block_device_mappings__ephemeral_id, 'ephemeral_map': block_device_mappings__ephemeral_mapped})
+        start_time = time.time()
+        try:
+            instance_store_map = self.get_instance_store_map(timeout)
+        except (IOError, OSError) as e:
+            self.module.fail_json(msg="Could not get the block-device-mapping from the instance metadata service: " + str(e))
+        self.timings['imds'] = round(time.time() - start_time, 3)
+
+        # Identify all the nvme devices concurrently (each is a separate ioctl), then map them in device order (which matters for the instance stores).
+        start_time = time.time()
+        nvme_devices = cBlockDevMap.run_concurrently(cAwsMapper.ebs_nvme_device, [os_device['device_name_os'] for os_device in self.device_map if os_device['NAME'].startswith("nvme")], timeout)
+        self.timings['nvme_identify'] = round(time.time() - start_time, 3)
 
         instance_store_count = 0
         for os_device in self.device_map:
             if os_device['NAME'].startswith("nvme"):
-                try:
-                    dev = cAwsMapper.ebs_nvme_device(os_device['device_name_os'])
-                except FileNotFoundError as e:
+                dev, e = nvme_devices[os_device['device_name_os']]
+                if isinstance(e, FileNotFoundError):
                     self.module.fail_json(msg=os_device['device_name_os'] + ": FileNotFoundError" + str(e))
-                except TypeError as e:
+                elif isinstance(e, cBlockDevMap.Timeout):
+                    self.module.fail_json(msg=os_device['device_name_os'] + ": NVMe identify did not complete: " + str(e))
+                elif isinstance(e, TypeError):
                     if instance_store_count < len(instance_store_map):
                         os_device.update({"device_name_os": os_device['device_name_os'], "device_name_cloud": '/dev/' + instance_store_map[instance_store_count]['ephemeral_map'], "volume_id": instance_store_map[instance_store_count]['ephemeral_id']})
                         instance_store_count += 1
                     else:
                         self.module.warn(u"%s is not an EBS device and there is no instance store mapping." % os_device['device_name_os'])
-                except OSError as e:
+                elif isinstance(e, OSError):
                     self.module.warn(u"%s is not an nvme device." % os_device['device_name_os'])
+                elif e is not None:
+                    raise e
                 else:
                     os_device.update({"device_name_os": os_device['device_name_os'], "device_name_cloud": '/dev/' + dev.get_block_device(stripped=True).rstrip(), "volume_id": dev.get_volume_id()})
             elif os_device['NAME'].startswith("xvd"):
@@ -442,6 +607,33 @@ class cAwsMapper(cBlockDevMap):
             else:
                 os_device.update({"device_name_os": os_device['device_name_os'], "device_name_cloud": ""})
 
+    # Get the ephemeral (instance store) entries of the block-device-mapping, over a single (keep-alive) connection to the IMDS.  Uses an IMDSv2 session token if the IMDS issues one (falls back to IMDSv1 if not).
+    def get_instance_store_map(self, timeout):
+        imds = HTTPConnection(*self.imds_endpoint, timeout=timeout)
+        try:
+            headers = {}
+            try:
+                imds.request('PUT', '/latest/api/token', headers={'X-aws-ec2-metadata-token-ttl-seconds': '60'})
+                response = imds.getresponse()
+                token = response.read().decode()
+                if response.status == 200:
+                    headers = {'X-aws-ec2-metadata-token': token}
+            except (IOError, OSError):
+                imds.close()
+
+            def imds_get(path):
+                imds.request('GET', '/latest/meta-data/' + path, headers=headers)
+                response = imds.getresponse()
+                body = response.read().decode()
+                if response.status != 200:
+                    raise IOError("HTTP %s for /latest/meta-data/%s" % (response.status, path))
+                return body
+
+            block_device_mappings = imds_get('block-device-mapping/').split("\n")
+            return [{'ephemeral_id': ephemeral_id, 'ephemeral_map': imds_get('block-device-mapping/' + ephemeral_id)} for ephemeral_id in block_device_mappings if ephemeral_id.startswith('ephemeral')]
+        finally:
+            imds.close()
+
     class ebs_nvme_device():
         def __init__(self, device):
             self.device = device
@@ -449,7 +641,7 @@ class cAwsMapper(cBlockDevMap):
 
         def _nvme_ioctl(self, id_response, id_len):
             admin_cmd = nvme_admin_command(opcode=NVME_ADMIN_IDENTIFY, addr=id_response, alen=id_len, cdw10=1)
-            with open(self.device, "rt") as nvme:
+            with open(self.device, "rb") as nvme:
                 ioctl(nvme, NVME_IOCTL_ADMIN_CMD, admin_cmd)
 
         def ctrl_identify(self):
@@ -473,7 +665,9 @@ class cAwsMapper(cBlockDevMap):
 
 def main():
     if not (len(sys.argv) > 1 and sys.argv[1] == "console"):
-        module = AnsibleModule(argument_spec={"cloud_type": {"type": "str", "required": True, "choices": ['aws', 'gcp', 'azure', 'lsblk']}}, supports_check_mode=True)
+        module = AnsibleModule(argument_spec={"cloud_type": {"type": "str", "required": True, "choices": ['aws', 'gcp', 'azure', 'lsblk']},
+                                              "probe": {"type": "str", "default": "auto", "choices": ['auto', 'sysfs', 'lsblk']},
+                                              "timeout": {"type": "float", "default": 10}}, supports_check_mode=True)
     else:
         class cDummyAnsibleModule():  # For testing without Ansible (e.g on Windows)
             def __init__(self):
@@ -487,7 +681,10 @@ def main():
                 exit(1)
 
         module = cDummyAnsibleModule()
-        module.params = {"cloud_type": sys.argv[2]}
+        module.params = {"cloud_type": sys.argv[2], "probe": sys.argv[3] if len(sys.argv) > 3 else "auto"}
+        # e.g. 'blockdevmap.py console lsblk sysfs /tmp/recorded_root' maps a recorded copy of another machine's sys/class/block, sys/devices, run/udev/data and proc/self/mountinfo
+        if len(sys.argv) > 4:
+            cBlockDevMap.root = sys.argv[4]
 
     if module.params['cloud_type'] == 'aws':
         blockdevmap = cAwsMapper(module=module)
@@ -500,7 +697,7 @@ def main():
     else:
         module.fail_json(msg="cloud_type not valid :" + module.params['cloud_type'])
 
-    module.exit_json(changed=False, device_map=blockdevmap.device_map)
+    module.exit_json(changed=False, device_map=blockdevmap.device_map, timings=blockdevmap.timings)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,164 @@
+# Copyright 2021 Dougal Seeley <github@dougalseeley.com>
+# BSD 3-Clause License
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+DOCUMENTATION = '''
+---
+module: clouddns_records_sync
+version_added: 1.0.0
+short_description: Make a set of Cloud DNS records present or absent, in one change per managed zone
+description:
+    - Finds the (non-peered) managed zones called I(zone), (there could be more than one, e.g. public and private), lists their current records, and compares
+      them with I(records).
+    - Only the records that differ are changed, all in one Cloud DNS C(change) per managed zone, (rather than one change per record), and the module waits once
+      for the changes to be C(done).
+    - With I(state=absent), a record is only deleted if its current values match the given C(values) (if any).
+authors:
+    - Dougal Seeley <github@dougalseeley.com>
+options:
+  zone:
+    description: The DNS name of the managed zone(s).
+    required: true
+    type: str
+  records:
+    description:
+      - The records, as dicts of C(name), C(type) (default C(A)), C(ttl) (default 60) and C(values) (or C(value)).
+      - In private managed zones, C(private_values) (if given) are used instead of C(values).
+      - Names that are not fully-qualified are relative to I(zone).
+    required: true
+    type: list
+    elements: dict
+  state:
+    description: Whether the records should be present or absent.
+    required: false
+    default: present
+    choices: ['present', 'absent']
+    type: str
+  retries:
+    description: The number of times each call is retried (with backoff) on throttling or server errors.
+    required: false
+    default: 8
+    type: int
+  timeout:
+    description: The maximum time (in seconds) to wait for the changes to be C(done).
+    required: false
+    default: 300
+    type: int
+extends_documentation_fragment:
+- google.cloud.gcp
+'''
+
+EXAMPLES = '''
+- name: Create/update the A records of the hosts
+  clouddns_records_sync:
+    zone: "{{cluster_vars.dns_nameserver_zone}}"
+    records: [{ name: "test-sys-a0-1620000000.sandbox.example.com.", type: "A", values: ["35.1.2.3"], private_values: ["10.0.0.1"] }]
+    project: "{{cluster_vars[buildenv].vpc_host_project_id}}"
+    auth_kind: "serviceaccount"
+    service_account_file: "{{gcp_credentials_file}}"
+'''
+
+RETURN = '''
+changes:
+  description: The records that were created, updated or deleted, in each managed zone.
+  returned: always
+  type: dict
+  sample: {"example-com-private": [{"action": "create", "name": "test-sys-a0-1620000000.sandbox.example.com.", "type": "A", "ttl": 60, "values": ["10.0.0.1"]}]}
+api_calls:
+  description: The number of API calls that were made.
+  returned: always
+  type: int
+  sample: 4
+'''
+
+import time
+
+from ansible_collections.google.cloud.plugins.module_utils.gcp_utils import GcpModule
+from ansible.module_utils._text import to_native
+
+from ansible.module_utils.dns_records import fqdn, normalise_records, diff_records, changes_summary, record_key
+from ansible.module_utils.gcp_compute_api import GcpComputeApi, GcpComputeApiError
+
+DNS_API = "https://dns.googleapis.com/dns/v1"
+
+
+def dns_url(module, path):
+    return "%s/projects/%s/%s" % (DNS_API, module.params['project'], path)
+
+
+def get_managed_zones(module, api):
+    response = api.check(api.request('GET', dns_url(module, 'managedZones'), params={'dnsName': fqdn(module.params['zone'])}))
+    return [managed_zone for managed_zone in response.get('managedZones', []) if not managed_zone.get('peeringConfig')]
+
+
+def get_current_records(module, api, managed_zone):
+    records = {}
+    params = {'maxResults': 1000}
+    while True:
+        page = api.check(api.request('GET', dns_url(module, 'managedZones/%s/rrsets' % managed_zone['name']), params=params))
+        for rrset in page.get('rrsets', []):
+            record = {'name': rrset['name'], 'type': rrset['type'], 'ttl': rrset.get('ttl'), 'values': sorted(rrset.get('rrdatas', []))}
+            records[record_key(record)] = record
+        if not page.get('nextPageToken'):
+            return records
+        params['pageToken'] = page['nextPageToken']
+
+
+def to_rrset(record):
+    return {'name': record['name'], 'type': record['type'], 'ttl': record['ttl'], 'rrdatas': record['values']}
+
+
+def wait_for_changes(module, api, pending):
+    deadline = time.time() + module.params['timeout']
+    attempt = 0
+    while pending:
+        if time.time() > deadline:
+            raise GcpComputeApiError("Timed out waiting for the changes to %s" % ", ".join(pending))
+        api.backoff(min(attempt, 3))
+        attempt += 1
+        for managed_zone_name, change in list(pending.items()):
+            if api.check(api.request('GET', dns_url(module, 'managedZones/%s/changes/%s' % (managed_zone_name, change['id']))))['status'] == 'done':
+                del pending[managed_zone_name]
+
+
+def main():
+    module = GcpModule(
+        argument_spec=dict(
+            zone=dict(type='str', required=True),
+            records=dict(type='list', elements='dict', required=True),
+            state=dict(type='str', default='present', choices=['present', 'absent']),
+            retries=dict(type='int', default=8),
+            timeout=dict(type='int', default=300)
+        ),
+        supports_check_mode=True
+    )
+
+    if not module.params['scopes']:
+        module.params['scopes'] = ['https://www.googleapis.com/auth/ndev.clouddns.readwrite']
+
+    api = GcpComputeApi(module, retries=module.params['retries'])
+    summary = {}
+    try:
+        pending = {}
+        for managed_zone in get_managed_zones(module, api):
+            records = [dict(record, values=record['private_values']) if managed_zone.get('visibility') == 'private' and record.get('private_values') is not None else record for record in module.params['records']]
+            changes = diff_records(normalise_records(records, module.params['zone']), get_current_records(module, api, managed_zone), module.params['state'])
+            summary[managed_zone['name']] = changes_summary(changes)
+            if any(changes.values()) and not module.check_mode:
+                change = {'additions': [to_rrset(record) for record in changes['create']] + [to_rrset(record) for current_record, record in changes['update']],
+                          'deletions': [to_rrset(current_record) for current_record, record in changes['update']] + [to_rrset(record) for record in changes['delete']]}
+                response = api.check(api.request('POST', dns_url(module, 'managedZones/%s/changes' % managed_zone['name']), json=change))
+                if response['status'] != 'done':
+                    pending[managed_zone['name']] = response
+        wait_for_changes(module, api, pending)
+    except GcpComputeApiError as e:
+        module.fail_json(msg=to_native(e), changes=summary)
+
+    module.exit_json(changed=any(summary.values()), changes=summary, api_calls=api.calls)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,7 +13,8 @@ version_added: 1.0.0
 short_description: EC2 instance type info
 description:
     - List details of EC2 instance types.
-    - Uses the boto describe_instance_types API
+    - Uses the boto describe_instance_types API (paginated, and concurrently across I(regions)).
+    - Can write, and later load (without calling AWS), a catalogue snapshot of the instance types.
 author: "Dougal Seeley (@dseeley)"
 options:
   filters:
@@ -28,6 +29,51 @@ options:
     required: false
     default: {}
     type: dict
+  cache_ttl:
+    description:
+      - Cache the result on the local (controller) disk for this many seconds, keyed by region, credential identity, instance_types and filters.
+      - C(0) disables the cache.
+    required: false
+    default: 0
+    type: int
+  cache_dir:
+    description: The directory in which to store cached results.
+    required: false
+    default: ~/.cache/clusterverse
+    type: str
+  cache_invalidate:
+    description: Remove all cached instance type results before running (the fresh result is then cached, if I(cache_ttl) > 0).
+    required: false
+    default: false
+    type: bool
+  regions:
+    description:
+      - A list of regions to describe (concurrently).  Defaults to I(region).
+      - When more than one region is given, each returned instance type has a C(region) key.
+    required: false
+    default: []
+    type: list
+    elements: str
+  fields:
+    description:
+      - Only return (and convert to snake_case) these keys of each instance type.  Nested keys are dot-separated snake_case paths
+        (e.g. C(processor_info.supported_architectures)).  C(instance_type) is always returned.
+      - By default, all keys are returned.
+    required: false
+    default: []
+    type: list
+    elements: str
+  catalogue_dest:
+    description:
+      - Write a compact, versioned catalogue snapshot of the (projected) instance types of all I(regions) to this path.  Gzipped if the path ends C(.gz).
+    required: false
+    type: path
+  catalogue_src:
+    description:
+      - Load the instance types from a catalogue snapshot (as written by I(catalogue_dest)) instead of calling AWS, (e.g. in air-gapped CI).
+      - I(instance_types), I(regions) and I(fields) are applied to the catalogue; I(filters) are not supported.
+    required: false
+    type: path
 extends_documentation_fragment:
 - amazon.aws.aws
 - amazon.aws.ec2
@@ -51,9 +97,38 @@ EXAMPLES = r'''
 
 - ansible.builtin.debug:
     msg: "{{ r__ec2_instance_type_info }}"
+
+- name: Snapshot the architecture, vCPU, memory and EBS bandwidth of every instance type in two regions
+  community.aws.ec2_instance_type_info:
+    regions: ["eu-west-1", "us-east-1"]
+    fields: ["processor_info.supported_architectures", "v_cpu_info.default_v_cpus", "memory_info.size_in_mi_b", "ebs_info.ebs_optimized_info.maximum_bandwidth_in_mbps"]
+    catalogue_dest: "instance_types.json.gz"
+
+- name: Get instance types from the catalogue snapshot (no AWS calls)
+  community.aws.ec2_instance_type_info:
+    instance_types: ["t3a.nano", "t4g.nano"]
+    regions: ["eu-west-1"]
+    catalogue_src: "instance_types.json.gz"
+  register: r__ec2_instance_type_info
+
+- name: List instance_types for a VM, caching the result locally for a day.
+  community.aws.ec2_instance_type_info:
+    instance_types: ["t3a.nano", "t4g.nano"]
+    cache_ttl: 86400
+  register: r__ec2_instance_type_info
 '''
 
 RETURN = '''
+cache:
+  description: Whether the cache was enabled, and the number of cache hits and misses.
+  returned: on success
+  type: dict
+  sample: {"enabled": true, "hits": 1, "misses": 0, "resource": "ec2_instance_types", "ttl": 86400}
+catalogue:
+  description: The catalogue snapshot that was written (I(catalogue_dest)) or loaded (I(catalogue_src)).
+  returned: when catalogue_dest or catalogue_src is set
+  type: dict
+  sample: {"path": "instance_types.json.gz", "version": 1, "generated": "2021-06-01T12:00:00Z", "regions": {"eu-west-1": 612}}
 instance_types:
   description: Properties of all instances matching the instance_types and provided filters. Each element is a dict with all the information related to an instance.
   returned: on success
@@ -144,9 +219,15 @@ instance_types:
 
 from ansible_collections.amazon.aws.plugins.module_utils.core import AnsibleAWSModule
 from ansible_collections.amazon.aws.plugins.module_utils.ec2 import (ansible_dict_to_boto3_filter_list,
+                                                                     boto3_conn,
                                                                      boto3_tag_list_to_ansible_dict,
-                                                                     camel_dict_to_snake_dict
+                                                                     camel_dict_to_snake_dict,
+                                                                     get_aws_connection_info
                                                                      )
+from ansible.module_utils.common.dict_transformations import _camel_to_snake
+from ansible.module_utils._text import to_native
+
+from ansible.module_utils.discovery_cache import DiscoveryCache
 
 try:
     from botocore.exceptions import (BotoCoreError, ClientError)
@@ -154,27 +235,173 @@ except ImportError:
     pass  # caught by imported AnsibleAWSModule
 
 
-def get_describe_instance_types(module):
-    connection = module.client('ec2')
+CATALOGUE_VERSION = 1
+
+
+# Return the keys of a (camelCase) boto3 dict that match one level of the 'fields' projection (a tree of snake_case keys, where None means 'everything below here').
+def project_camel_dict(camel_dict, fields_tree):
+    if fields_tree is None:
+        return camel_dict_to_snake_dict(camel_dict)
+    result = {}
+    for camel_key, value in camel_dict.items():
+        snake_key = _camel_to_snake(camel_key)
+        if snake_key in fields_tree:
+            if isinstance(value, dict):
+                result[snake_key] = project_camel_dict(value, fields_tree[snake_key])
+            elif isinstance(value, list):
+                result[snake_key] = [project_camel_dict(item, fields_tree[snake_key]) if isinstance(item, dict) else item for item in value]
+            else:
+                result[snake_key] = value
+    return result
+
+
+# The same projection, for an already-snake_case dict (e.g. loaded from a catalogue).
+def project_snake_dict(snake_dict, fields_tree):
+    if fields_tree is None:
+        return snake_dict
+    result = {}
+    for key, value in snake_dict.items():
+        if key in fields_tree:
+            if isinstance(value, dict):
+                result[key] = project_snake_dict(value, fields_tree[key])
+            elif isinstance(value, list):
+                result[key] = [project_snake_dict(item, fields_tree[key]) if isinstance(item, dict) else item for item in value]
+            else:
+                result[key] = value
+    return result
+
+
+# Turn a list of dot-separated fields into a tree, e.g. ['a.b', 'a.c', 'd'] -> {'instance_type': None, 'a': {'b': None, 'c': None}, 'd': None}.  Returns None (no projection) if there are no fields.
+def fields_to_tree(fields):
+    if not fields:
+        return None
+    tree = {'instance_type': None}
+    for field in fields:
+        node = tree
+        parts = field.split('.')
+        for part in parts[:-1]:
+            if node.get(part, {}) is None:
+                break
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = None
+    return tree
+
+
+def get_describe_instance_types(module, connection, fields_tree):
+    instance_types = []
     try:
-        response = connection.describe_instance_types(InstanceTypes=module.params.get("instance_types"), Filters=ansible_dict_to_boto3_filter_list(module.params.get("filters")))
+        paginator = connection.get_paginator('describe_instance_types')
+        for page in paginator.paginate(InstanceTypes=module.params.get("instance_types"), Filters=ansible_dict_to_boto3_filter_list(module.params.get("filters"))):
+            instance_types.extend([project_camel_dict(instance_type, fields_tree) for instance_type in page['InstanceTypes']])
     except (BotoCoreError, ClientError) as e:
         module.fail_json_aws(e, msg="Error retrieving InstanceTypes")
-
-    instance_types = camel_dict_to_snake_dict(response)['instance_types']
     return instance_types
 
 
+# Describe the instance types in each region concurrently (each region is paginated).  Returns {region: [instance_types]}
+def get_describe_instance_types_by_region(module, regions, fields_tree):
+    _region, endpoint_url, aws_connect_kwargs = get_aws_connection_info(module, boto3=True)
+    connections = dict((region, boto3_conn(module, conn_type='client', resource='ec2', region=region, endpoint=endpoint_url, **aws_connect_kwargs)) for region in regions)
+
+    if len(regions) == 1:
+        return {regions[0]: get_describe_instance_types(module, connections[regions[0]], fields_tree)}
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=min(len(regions), 16)) as executor:
+        futures = dict((region, executor.submit(get_describe_instance_types, module, connections[region], fields_tree)) for region in regions)
+        return dict((region, future.result()) for region, future in futures.items())
+
+
+def write_catalogue(path, instance_types_by_region, fields):
+    import gzip
+    import json
+    import os
+    import tempfile
+    from datetime import datetime
+
+    catalogue = {'version': CATALOGUE_VERSION, 'generated': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'), 'fields': fields, 'regions': instance_types_by_region}
+    data = json.dumps(catalogue, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.tmp')
+    with os.fdopen(fd, 'wb') as tmp_file:
+        tmp_file.write(gzip.compress(data) if path.endswith('.gz') else data)
+    os.chmod(tmp_path, 0o644)
+    os.rename(tmp_path, path)
+    return catalogue
+
+
+def read_catalogue(module, path):
+    import gzip
+    import json
+    try:
+        with open(path, 'rb') as catalogue_file:
+            data = catalogue_file.read()
+        catalogue = json.loads((gzip.decompress(data) if data[:2] == b'\x1f\x8b' else data).decode('utf-8'))
+    except (IOError, OSError, ValueError) as e:
+        module.fail_json(msg="Could not read instance type catalogue %s: %s" % (path, to_native(e)))
+    if catalogue.get('version') != CATALOGUE_VERSION:
+        module.fail_json(msg="Instance type catalogue %s has version %s; version %s is required" % (path, catalogue.get('version'), CATALOGUE_VERSION))
+    return catalogue
+
+
 def main():
     module = AnsibleAWSModule(
         argument_spec=dict(
             instance_types=dict(default=[], type='list', elements='str', aliases=['instance_type']),
-            filters=dict(type='dict', default={})
+            filters=dict(type='dict', default={}),
+            cache_ttl=dict(type='int', default=0),
+            cache_dir=dict(type='str', default='~/.cache/clusterverse'),
+            cache_invalidate=dict(type='bool', default=False),
+            regions=dict(type='list', elements='str', default=[]),
+            fields=dict(type='list', elements='str', default=[]),
+            catalogue_dest=dict(type='path'),
+            catalogue_src=dict(type='path')
         ),
+        mutually_exclusive=[['catalogue_src', 'catalogue_dest'], ['catalogue_src', 'filters']],
         supports_check_mode=True
     )
 
-    module.exit_json(changed=False, instance_types=get_describe_instance_types(module))
+    regions = module.params['regions'] or [module.params.get('region')]
+    fields_tree = fields_to_tree(module.params['fields'])
+    result = dict(changed=False)
+
+    if module.params['catalogue_src']:
+        catalogue = read_catalogue(module, module.params['catalogue_src'])
+        missing_regions = [region for region in regions if region not in catalogue['regions']]
+        if missing_regions:
+            module.fail_json(msg="Instance type catalogue %s does not contain regions: %s" % (module.params['catalogue_src'], ", ".join(missing_regions)))
+        wanted = set(module.params['instance_types'])
+        instance_types_by_region = dict((region, [project_snake_dict(instance_type, fields_tree) for instance_type in catalogue['regions'][region] if not wanted or instance_type['instance_type'] in wanted]) for region in regions)
+        result['catalogue'] = {'path': module.params['catalogue_src'], 'version': catalogue['version'], 'generated': catalogue['generated'], 'regions': dict((region, len(catalogue['regions'][region])) for region in regions)}
+    else:
+        cache = DiscoveryCache(module.params['cache_dir'], 'ec2_instance_types', ttl=module.params['cache_ttl'])
+        cache_key = {
+            'regions': sorted(regions),
+            'account': cache.identity(module.params.get('aws_access_key'), module.params.get('profile')),
+            'instance_types': sorted(module.params.get('instance_types')),
+            'filters': module.params.get('filters'),
+            'fields': sorted(module.params['fields'])
+        }
+        if module.params['cache_invalidate']:
+            cache.invalidate()
+
+        instance_types_by_region = cache.get(cache_key)
+        if instance_types_by_region is None:
+            instance_types_by_region = get_describe_instance_types_by_region(module, regions, fields_tree)
+            cache.set(cache_key, instance_types_by_region)
+        result['cache'] = cache.stats()
+
+        if module.params['catalogue_dest'] and not module.check_mode:
+            catalogue = write_catalogue(module.params['catalogue_dest'], instance_types_by_region, module.params['fields'])
+            result['catalogue'] = {'path': module.params['catalogue_dest'], 'version': catalogue['version'], 'generated': catalogue['generated'], 'regions': dict((region, len(catalogue['regions'][region])) for region in regions)}
+            result['changed'] = True
+
+    if len(regions) == 1:
+        result['instance_types'] = instance_types_by_region[regions[0]]
+    else:
+        result['instance_types'] = [dict(instance_type, region=region) for region in regions for instance_type in instance_types_by_region[region]]
+
+    module.exit_json(**result)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,306 @@
+# Copyright 2021 Dougal Seeley <github@dougalseeley.com>
+# BSD 3-Clause License
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+DOCUMENTATION = '''
+---
+module: ec2_instances_bulk
+version_added: 1.0.0
+short_description: Launch many (named) EC2 instances, grouping those with the same launch specification into one RunInstances call
+description:
+    - Launches an EC2 instance for each of I(hosts) that does not already exist (i.e. there is no C(running) or C(pending) instance with that C(Name) tag).
+    - Hosts with the same launch specification (hosttype, subnet, flavor, image, volumes, role and tags) are launched together, with one C(RunInstances) call,
+      and each instance is then given its host's C(Name) tag.
+    - Each C(RunInstances) call has a C(ClientToken) derived from its hosts and launch specification.  If the module is re-run after a failure (e.g. when only some
+      of the instances were named), the hosts of the original call (including those already named) are found again from the C(ClientToken) of their
+      instances, so the token is the same, and the original instances (running or pending, with that C(ClientToken)) are adopted and named, rather than new
+      ones being launched.
+    - The volumes in each host's C(auto_volumes) are created with the instance, except those with a C(src) (which are attached separately).
+authors:
+    - Dougal Seeley <github@dougalseeley.com>
+options:
+  hosts:
+    description:
+      - The hosts to launch (e.g. C(cluster_hosts_target)).  Each is a dict with C(hostname), C(hosttype), C(flavor), C(image), C(vpc_subnet_id) and (optionally) C(auto_volumes).
+      - Each may also have C(tags) (added to the common I(tags)), C(instance_role) and C(instance_initiated_shutdown_behavior).
+    required: true
+    type: list
+    elements: dict
+  key_name:
+    description: The name of the SSH key pair.
+    required: false
+    type: str
+  security_groups:
+    description: The security groups (names or IDs) of the instances.  Names are resolved in the VPC of each host's subnet.
+    required: false
+    default: []
+    type: list
+    elements: str
+  assign_public_ip:
+    description: Whether to assign a public IP address to the instances.
+    required: false
+    default: false
+    type: bool
+  termination_protection:
+    description: Whether to enable termination protection on the instances.
+    required: false
+    default: false
+    type: bool
+  user_data:
+    description: The user data of the instances.
+    required: false
+    type: str
+  tags:
+    description: The tags common to all the instances.
+    required: false
+    default: {}
+    type: dict
+  wait:
+    description: Whether to wait for the new instances to be C(running).
+    required: false
+    default: true
+    type: bool
+  wait_timeout:
+    description: The maximum time (in seconds) to wait for the new instances to be C(running).
+    required: false
+    default: 600
+    type: int
+extends_documentation_fragment:
+- amazon.aws.aws
+- amazon.aws.ec2
+'''
+
+EXAMPLES = '''
+- name: Launch the cluster_hosts_target hosts
+  ec2_instances_bulk:
+    region: "{{cluster_vars.region}}"
+    key_name: "{{cluster_vars[buildenv].key_name}}"
+    security_groups: ["{{ cluster_name }}-sg"]
+    tags: { cluster_name: "{{cluster_name}}", lifecycle_state: "current" }
+    hosts: "{{ cluster_hosts_target }}"
+  register: r__ec2_instances_bulk
+'''
+
+RETURN = '''
+instances:
+  description: The instance of each host, and whether it was created.
+  returned: always
+  type: list
+  sample: [{"hostname": "test-sys-a0-1620000000", "instance_id": "i-0123456789abcdef0", "changed": true}]
+created:
+  description: The hostnames of the hosts that were created.
+  returned: always
+  type: list
+  sample: ["test-sys-a0-1620000000"]
+launch_calls:
+  description: The number of RunInstances calls that were made (one per group of hosts with the same launch specification).
+  returned: always
+  type: int
+  sample: 1
+'''
+
+import hashlib
+import json
+
+from ansible_collections.amazon.aws.plugins.module_utils.core import AnsibleAWSModule
+from ansible_collections.amazon.aws.plugins.module_utils.ec2 import AWSRetry, ansible_dict_to_boto3_filter_list, ansible_dict_to_boto3_tag_list
+from ansible.module_utils._text import to_text
+
+try:
+    from botocore.exceptions import (BotoCoreError, ClientError, WaiterError)
+except ImportError:
+    pass  # caught by imported AnsibleAWSModule
+
+# The maximum number of values in a describe filter, or instance IDs in a waiter call
+DESCRIBE_BATCH_SIZE = 200
+
+AUTO_VOLUME_EBS_KEYS = [('volume_type', 'VolumeType'), ('volume_size', 'VolumeSize'), ('iops', 'Iops'), ('throughput', 'Throughput'), ('snapshot', 'SnapshotId'), ('encrypted', 'Encrypted'), ('delete_on_termination', 'DeleteOnTermination')]
+
+
+def batches(items, size=DESCRIBE_BATCH_SIZE):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+# The block device mappings of the auto_volumes that are created with the instance (i.e. not those with a 'src', which are attached afterwards).
+def auto_volumes_to_block_device_mappings(auto_volumes):
+    mappings = []
+    for vol in auto_volumes or []:
+        if 'src' in vol:
+            continue
+        if vol.get('volume_type') == 'ephemeral':
+            mappings.append({'DeviceName': vol['device_name'], 'VirtualName': vol['ephemeral']})
+        else:
+            mappings.append({'DeviceName': vol['device_name'], 'Ebs': dict((boto_key, vol[key]) for key, boto_key in AUTO_VOLUME_EBS_KEYS if key in vol)})
+    return mappings
+
+
+# The hostnames that already have a running or pending instance: {hostname: {'instance_id', 'client_token'}}
+def get_existing_instances(connection, hostnames):
+    existing = {}
+    for hostnames_batch in batches(hostnames):
+        filters = ansible_dict_to_boto3_filter_list({'tag:Name': hostnames_batch, 'instance-state-name': ['running', 'pending']})
+        for reservation in connection.get_paginator('describe_instances').paginate(Filters=filters).build_full_result()['Reservations']:
+            for instance in reservation['Instances']:
+                hostname = next((tag['Value'] for tag in instance.get('Tags', []) if tag['Key'] == 'Name'), None)
+                existing.setdefault(hostname, {'instance_id': instance['InstanceId'], 'client_token': instance.get('ClientToken') or None})
+    return existing
+
+
+def get_security_group_ids(connection, security_groups, subnet_id, cache):
+    group_ids = [group for group in security_groups if group.startswith('sg-')]
+    group_names = [group for group in security_groups if not group.startswith('sg-')]
+    if group_names:
+        if subnet_id not in cache:
+            vpc_id = connection.describe_subnets(aws_retry=True, SubnetIds=[subnet_id])['Subnets'][0]['VpcId']
+            groups = connection.describe_security_groups(aws_retry=True, Filters=ansible_dict_to_boto3_filter_list({'vpc-id': vpc_id, 'group-name': group_names}))['SecurityGroups']
+            cache[subnet_id] = dict((group['GroupName'], group['GroupId']) for group in groups)
+        missing = [name for name in group_names if name not in cache[subnet_id]]
+        if missing:
+            raise ValueError("Security groups not found in the VPC of subnet %s: %s" % (subnet_id, ", ".join(missing)))
+        group_ids.extend(cache[subnet_id][name] for name in group_names)
+    return group_ids
+
+
+# The launch specification of a host - hosts with the same specification can be launched by the same RunInstances call.
+def launch_spec(module, host):
+    tags = dict(module.params['tags'], **host.get('tags', {}))
+    tags.pop('Name', None)
+    return {
+        'hosttype': host['hosttype'],
+        'instance_type': host['flavor'],
+        'image_id': host['image'],
+        'subnet_id': host['vpc_subnet_id'],
+        'block_device_mappings': auto_volumes_to_block_device_mappings(host.get('auto_volumes')),
+        'instance_role': host.get('instance_role') or None,
+        'instance_initiated_shutdown_behavior': host.get('instance_initiated_shutdown_behavior') or None,
+        'tags': dict((to_text(key), to_text(value)) for key, value in tags.items())
+    }
+
+
+def get_client_token(module, spec, hostnames, security_group_ids):
+    return hashlib.sha256(json.dumps([spec, sorted(hostnames), module.params['key_name'], security_group_ids], sort_keys=True).encode('utf-8')).hexdigest()[:64]
+
+
+# The hosts of the RunInstances call that launches the 'missing' hosts of a launch specification, and its ClientToken.  If the missing hosts were launched by an
+# earlier call, (which failed before all its instances were named), that call's hosts include some that exist (are named) now: these are found by the ClientToken of
+# their instances, and included, so the token is the same as the earlier call's.
+def get_launch_hosts(module, spec, spec_hostnames, missing, existing, security_group_ids):
+    for client_token in set(existing[hostname]['client_token'] for hostname in spec_hostnames if hostname in existing and existing[hostname]['client_token']):
+        hostnames = sorted(missing + [hostname for hostname in spec_hostnames if hostname in existing and existing[hostname]['client_token'] == client_token])
+        if get_client_token(module, spec, hostnames, security_group_ids) == client_token:
+            return hostnames, client_token
+    return missing, get_client_token(module, spec, missing, security_group_ids)
+
+
+# The (running or pending) instances launched by an earlier RunInstances call with client_token, in AmiLaunchIndex order.  (Filtered on ClientToken here, rather than
+# with the 'client-token' filter, which not all EC2 endpoints support.)
+def get_client_token_instances(connection, spec, client_token):
+    filters = ansible_dict_to_boto3_filter_list({'subnet-id': spec['subnet_id'], 'image-id': spec['image_id'], 'instance-state-name': ['running', 'pending']})
+    reservations = connection.get_paginator('describe_instances').paginate(Filters=filters).build_full_result()['Reservations']
+    instances = [instance for reservation in reservations for instance in reservation['Instances'] if instance.get('ClientToken') == client_token]
+    return sorted(instances, key=lambda instance: instance['AmiLaunchIndex'])
+
+
+# Launch the instances of 'hostnames' (sorted) with one RunInstances call, and name those of 'missing'.  If an earlier call with the same client_token launched them,
+# its instances are adopted, rather than new ones launched.
+def launch_group(module, connection, spec, hostnames, missing, client_token, security_group_ids):
+    params = {
+        'ClientToken': client_token,
+        'ImageId': spec['image_id'],
+        'InstanceType': spec['instance_type'],
+        'MinCount': len(hostnames),
+        'MaxCount': len(hostnames),
+        'NetworkInterfaces': [{'DeviceIndex': 0, 'SubnetId': spec['subnet_id'], 'AssociatePublicIpAddress': module.params['assign_public_ip'], 'Groups': security_group_ids}],
+        'DisableApiTermination': module.params['termination_protection'],
+        'TagSpecifications': [{'ResourceType': 'instance', 'Tags': ansible_dict_to_boto3_tag_list(spec['tags'])}]
+    }
+    if spec['block_device_mappings']:
+        params['BlockDeviceMappings'] = spec['block_device_mappings']
+    if module.params['key_name']:
+        params['KeyName'] = module.params['key_name']
+    if module.params['user_data']:
+        params['UserData'] = module.params['user_data']
+    if spec['instance_role']:
+        params['IamInstanceProfile'] = {'Arn': spec['instance_role']} if spec['instance_role'].startswith('arn:') else {'Name': spec['instance_role']}
+    if spec['instance_initiated_shutdown_behavior']:
+        params['InstanceInitiatedShutdownBehavior'] = spec['instance_initiated_shutdown_behavior']
+
+    instances = get_client_token_instances(connection, spec, client_token)
+    if len(instances) != len(hostnames):
+        instances = sorted(connection.run_instances(aws_retry=True, **params)['Instances'], key=lambda instance: instance['AmiLaunchIndex'])
+    instance_ids = dict(zip(hostnames, [instance['InstanceId'] for instance in instances]))
+    for hostname in missing:
+        connection.create_tags(aws_retry=True, Resources=[instance_ids[hostname]], Tags=[{'Key': 'Name', 'Value': hostname}])
+    return dict((hostname, instance_ids[hostname]) for hostname in missing)
+
+
+def main():
+    module = AnsibleAWSModule(
+        argument_spec=dict(
+            hosts=dict(type='list', elements='dict', required=True),
+            key_name=dict(type='str'),
+            security_groups=dict(type='list', elements='str', default=[]),
+            assign_public_ip=dict(type='bool', default=False),
+            termination_protection=dict(type='bool', default=False),
+            user_data=dict(type='str'),
+            tags=dict(type='dict', default={}),
+            wait=dict(type='bool', default=True),
+            wait_timeout=dict(type='int', default=600)
+        ),
+        supports_check_mode=True
+    )
+
+    hosts = dict((host['hostname'], host) for host in module.params['hosts'])
+    connection = module.client('ec2', retry_decorator=AWSRetry.jittered_backoff(retries=10))
+
+    try:
+        existing = get_existing_instances(connection, sorted(hosts))
+    except (BotoCoreError, ClientError) as e:
+        module.fail_json_aws(e, msg="Failed to describe the existing instances")
+    instance_ids = dict((hostname, instance['instance_id']) for hostname, instance in existing.items())
+
+    # All the hosts (existing or not) of each launch specification, and those that are missing.
+    groups = {}
+    for hostname in sorted(hosts):
+        spec = launch_spec(module, hosts[hostname])
+        spec, spec_hostnames, missing = groups.setdefault(json.dumps(spec, sort_keys=True), (spec, [], []))
+        spec_hostnames.append(hostname)
+        if hostname not in existing:
+            missing.append(hostname)
+
+    created = []
+    launch_calls = 0
+    if not module.check_mode:
+        security_group_ids_cache = {}
+        for spec, spec_hostnames, missing in groups.values():
+            if not missing:
+                continue
+            try:
+                security_group_ids = get_security_group_ids(connection, module.params['security_groups'], spec['subnet_id'], security_group_ids_cache)
+                hostnames, client_token = get_launch_hosts(module, spec, spec_hostnames, missing, existing, security_group_ids)
+                launch_calls += 1
+                instance_ids.update(launch_group(module, connection, spec, hostnames, missing, client_token, security_group_ids))
+                created.extend(missing)
+            except ValueError as e:
+                module.fail_json(msg=str(e), created=created)
+            except (BotoCoreError, ClientError) as e:
+                module.fail_json_aws(e, msg="Failed to launch %s" % ", ".join(missing), created=created)
+
+        if module.params['wait'] and created:
+            try:
+                for instance_ids_batch in batches([instance_ids[hostname] for hostname in created]):
+                    connection.get_waiter('instance_running').wait(InstanceIds=instance_ids_batch, WaiterConfig={'Delay': 5, 'MaxAttempts': max(1, module.params['wait_timeout'] // 5)})
+            except (BotoCoreError, WaiterError) as e:
+                module.fail_json_aws(e, msg="Timed out waiting for the instances to be running", created=created)
+    else:
+        created = [hostname for spec, spec_hostnames, missing in groups.values() for hostname in missing]
+
+    instances = [{'hostname': hostname, 'instance_id': instance_ids.get(hostname), 'changed': hostname in created} for hostname in sorted(hosts)]
+    module.exit_json(changed=bool(created), instances=instances, created=sorted(created), launch_calls=launch_calls)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+# Copyright 2021 Dougal Seeley <github@dougalseeley.com>
+# BSD 3-Clause License
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+DOCUMENTATION = '''
+---
+module: ec2_tags_bulk
+version_added: 1.0.0
+short_description: Add or update tags on many EC2 instances at once
+description:
+    - Adds (or updates) the same tags on many EC2 instances, using batched C(CreateTags) calls (many instances per call), rather than one call per instance.
+    - Instances whose (known) tags already match are skipped.
+    - Calls are retried with jittered exponential backoff on throttling (C(RequestLimitExceeded)).
+    - If a batch fails (e.g. one of the instances no longer exists), the instances in that batch are tagged individually, so the result is per-instance.
+authors:
+    - Dougal Seeley <github@dougalseeley.com>
+options:
+  instances:
+    description:
+      - The instances to tag, as dicts with an C(instance_id) key (e.g. C(cluster_hosts_state)).
+      - If an instance dict has a C(name), it is used to identify the instance in the results.
+      - If an instance dict has C(tagslabels) (its current tags), the instance is skipped if these already contain I(tags).
+    required: true
+    type: list
+    elements: dict
+  tags:
+    description: The tags to add or update.  Other existing tags are not changed.
+    required: true
+    type: dict
+  batch_size:
+    description: The maximum number of instances tagged in each C(CreateTags) call.
+    required: false
+    default: 200
+    type: int
+  retries:
+    description: The number of times each call is retried (with backoff) on throttling.
+    required: false
+    default: 10
+    type: int
+extends_documentation_fragment:
+- amazon.aws.aws
+- amazon.aws.ec2
+'''
+
+EXAMPLES = '''
+- name: Set lifecycle_state=retiring on all the hosts
+  ec2_tags_bulk:
+    aws_access_key: "{{cluster_vars[buildenv].aws_access_key}}"
+    aws_secret_key: "{{cluster_vars[buildenv].aws_secret_key}}"
+    region: "{{cluster_vars.region}}"
+    instances: "{{ cluster_hosts_state }}"
+    tags: { lifecycle_state: "retiring" }
+  register: r__ec2_tags_bulk
+'''
+
+RETURN = '''
+results:
+  description: The per-instance result.
+  returned: always
+  type: list
+  sample: [{"name": "test-sysdisks0-a0-1620000000", "instance_id": "i-0123456789abcdef0", "changed": true, "failed": false}]
+calls:
+  description: The number of C(CreateTags) calls that were made.
+  returned: always
+  type: int
+  sample: 1
+'''
+
+from ansible_collections.amazon.aws.plugins.module_utils.core import AnsibleAWSModule
+from ansible_collections.amazon.aws.plugins.module_utils.ec2 import AWSRetry, ansible_dict_to_boto3_tag_list
+from ansible.module_utils._text import to_native, to_text
+
+try:
+    from botocore.exceptions import (BotoCoreError, ClientError)
+except ImportError:
+    pass  # caught by imported AnsibleAWSModule
+
+
+def create_tags(connection, instance_ids, tags):
+    connection.create_tags(aws_retry=True, Resources=instance_ids, Tags=ansible_dict_to_boto3_tag_list(tags))
+
+
+def main():
+    module = AnsibleAWSModule(
+        argument_spec=dict(
+            instances=dict(type='list', elements='dict', required=True),
+            tags=dict(type='dict', required=True),
+            batch_size=dict(type='int', default=200),
+            retries=dict(type='int', default=10)
+        ),
+        supports_check_mode=True
+    )
+
+    tags = dict((to_text(key), to_text(value)) for key, value in module.params['tags'].items())
+    results = []
+    for instance in module.params['instances']:
+        if not instance.get('instance_id'):
+            module.fail_json(msg="Each of 'instances' must have an instance_id: %s" % instance)
+        current_tags = instance.get('tagslabels')
+        changed = current_tags is None or any(to_text(current_tags.get(key)) != value for key, value in tags.items())
+        results.append({'name': instance.get('name', instance['instance_id']), 'instance_id': instance['instance_id'], 'changed': changed, 'failed': False})
+
+    to_tag = [result for result in results if result['changed']]
+    calls = 0
+    if to_tag and not module.check_mode:
+        connection = module.client('ec2', retry_decorator=AWSRetry.jittered_backoff(retries=module.params['retries']))
+        batch_size = max(module.params['batch_size'], 1)
+        for batch in [to_tag[i:i + batch_size] for i in range(0, len(to_tag), batch_size)]:
+            try:
+                calls += 1
+                create_tags(connection, [result['instance_id'] for result in batch], tags)
+            except (BotoCoreError, ClientError) as batch_exc:
+                if len(batch) == 1:
+                    batch[0].update({'changed': False, 'failed': True, 'msg': to_native(batch_exc)})
+                    continue
+                # One bad instance fails the whole batch - tag the instances individually to find (and report) which.
+                for result in batch:
+                    try:
+                        calls += 1
+                        create_tags(connection, [result['instance_id']], tags)
+                    except (BotoCoreError, ClientError) as e:
+                        result.update({'changed': False, 'failed': True, 'msg': to_native(e)})
+
+    failed = [result for result in results if result['failed']]
+    if failed:
+        module.fail_json(msg="Failed to tag %d of %d instances: %s" % (len(failed), len(results), ", ".join(result['name'] for result in failed)), results=results, calls=calls)
+
+    module.exit_json(changed=any(result['changed'] for result in results), results=results, calls=calls)
+
+
+if __name__ == '__main__':
+    main()
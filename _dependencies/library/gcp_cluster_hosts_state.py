@@ -0,0 +1,142 @@
+# Copyright 2021 Dougal Seeley <github@dougalseeley.com>
+# BSD 3-Clause License
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+DOCUMENTATION = '''
+---
+module: gcp_cluster_hosts_state
+version_added: 1.0.0
+short_description: Get the cluster_hosts_state of a GCP cluster
+description:
+    - Gets the instances of a cluster (by their C(cluster_name) label) in all zones, using a single (paged) C(aggregatedList) call, rather than one call per zone.
+    - The image of each instance is the C(sourceImage) of its boot disk.  The boot disks are also found with C(aggregatedList) calls (filtered by disk name, in
+      batches, concurrently), rather than one call per instance.
+    - Returns C(cluster_hosts_state), in the same form as for the other clouds.
+authors:
+    - Dougal Seeley <github@dougalseeley.com>
+options:
+  cluster_name:
+    description: The value of the C(cluster_name) label of the cluster's instances.
+    required: true
+    type: str
+  zones:
+    description: Only return the instances in these zones.  By default, instances in all zones are returned.
+    required: false
+    default: []
+    type: list
+    elements: str
+  disk_batch_size:
+    description: The maximum number of boot disk names in each (concurrent) disk lookup.
+    required: false
+    default: 50
+    type: int
+  retries:
+    description: The number of times each call is retried (with backoff) on throttling or server errors.
+    required: false
+    default: 8
+    type: int
+extends_documentation_fragment:
+- google.cloud.gcp
+'''
+
+EXAMPLES = '''
+- name: Get the cluster_hosts_state
+  gcp_cluster_hosts_state:
+    cluster_name: "{{cluster_name}}"
+    zones: ["europe-west1-b", "europe-west1-c"]
+    project: "{{cluster_vars[buildenv].vpc_project_id}}"
+    auth_kind: "serviceaccount"
+    service_account_file: "{{gcp_credentials_file}}"
+  register: r__gcp_cluster_hosts_state
+'''
+
+RETURN = '''
+cluster_hosts_state:
+  description: The cluster's instances.
+  returned: always
+  type: list
+  sample: [{"name": "test-sys-b0-1620000000", "regionzone": "europe-west1-b", "tagslabels": {"hosttype": "sys", "cluster_name": "test-gcp-euw1"},
+            "instance_id": "1234567890123456789", "instance_state": "RUNNING", "ipv4": {"private": "10.132.0.2", "public": null},
+            "disk_info_cloud": [], "image": "https://www.googleapis.com/compute/v1/projects/ubuntu-os-cloud/global/images/ubuntu-2004-focal-v20210623"}]
+api_calls:
+  description: The number of API calls that were made.
+  returned: always
+  type: int
+  sample: 2
+'''
+
+import re
+
+from ansible_collections.google.cloud.plugins.module_utils.gcp_utils import GcpModule
+from ansible.module_utils._text import to_native
+
+from ansible.module_utils.gcp_compute_api import GcpComputeApi, GcpComputeApiError
+
+
+def basename(url):
+    return url.split('/')[-1] if url else url
+
+
+# The source image of each (boot) disk: {disk selfLink: sourceImage}.  The disks are looked up by name, in batches (as a regex filter), concurrently.
+def get_disk_images(module, api, disk_names):
+    if not disk_names:
+        return {}
+    batch_size = max(1, module.params['disk_batch_size'])
+    batches = [disk_names[i:i + batch_size] for i in range(0, len(disk_names), batch_size)]
+    filters = ['name eq "(%s)"' % "|".join(re.escape(name) for name in batch) for batch in batches]
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=min(len(filters), 8)) as executor:
+        disks_by_scope_batches = list(executor.map(lambda disk_filter: api.aggregated_list('disks', filter=disk_filter), filters))
+
+    return dict((disk['selfLink'], disk.get('sourceImage')) for disks_by_scope in disks_by_scope_batches for disks in disks_by_scope.values() for disk in disks)
+
+
+def to_cluster_host_state(instance, disk_images):
+    network_interface = (instance.get('networkInterfaces') or [{}])[0]
+    boot_disk = next((disk for disk in instance.get('disks', []) if disk.get('boot')), {})
+    return {
+        'name': instance['name'],
+        'regionzone': basename(instance['zone']),
+        'tagslabels': instance.get('labels'),
+        'instance_id': instance['id'],
+        'instance_state': instance['status'],
+        'ipv4': {'private': network_interface.get('networkIP'), 'public': (network_interface.get('accessConfigs') or [{}])[0].get('natIP')},
+        'disk_info_cloud': instance.get('disks'),
+        'image': disk_images.get(boot_disk.get('source'))
+    }
+
+
+def main():
+    module = GcpModule(
+        argument_spec=dict(
+            cluster_name=dict(type='str', required=True),
+            zones=dict(type='list', elements='str', default=[]),
+            disk_batch_size=dict(type='int', default=50),
+            retries=dict(type='int', default=8)
+        ),
+        supports_check_mode=True
+    )
+
+    if not module.params['scopes']:
+        module.params['scopes'] = ['https://www.googleapis.com/auth/compute.readonly']
+
+    api = GcpComputeApi(module, retries=module.params['retries'])
+    try:
+        instances_by_scope = api.aggregated_list('instances', filter='labels.cluster_name = "%s"' % module.params['cluster_name'])
+        zones = module.params['zones'] or sorted(basename(scope) for scope in instances_by_scope)
+        instances = [instance for zone in zones for instance in instances_by_scope.get('zones/' + zone, []) if instance.get('labels')]
+
+        boot_disk_names = sorted(set(basename(disk['source']) for instance in instances for disk in instance.get('disks', []) if disk.get('boot') and disk.get('source')))
+        disk_images = get_disk_images(module, api, boot_disk_names)
+    except GcpComputeApiError as e:
+        module.fail_json(msg=to_native(e))
+
+    module.exit_json(changed=False, cluster_hosts_state=[to_cluster_host_state(instance, disk_images) for instance in instances], api_calls=api.calls)
+
+
+if __name__ == '__main__':
+    main()
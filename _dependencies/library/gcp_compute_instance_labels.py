@@ -0,0 +1,142 @@
+# Copyright 2021 Dougal Seeley <github@dougalseeley.com>
+# BSD 3-Clause License
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+DOCUMENTATION = '''
+---
+module: gcp_compute_instance_labels
+version_added: 1.0.0
+short_description: Add or update labels on many GCP instances concurrently
+description:
+    - Adds (or updates) the same labels on many GCP compute instances, using concurrent C(setLabels) calls.
+    - Unlike gcp_compute_instance, only the labels are sent (not the whole instance definition), and existing labels that are not in I(labels) are kept.
+    - Each instance's current C(labelFingerprint) is read before it is relabelled; if the labels are changed by something else in the meantime (HTTP 412), they are re-read and the update is retried.
+    - Calls are retried with jittered exponential backoff on throttling (HTTP 429, C(rateLimitExceeded)) and on server errors.
+authors:
+    - Dougal Seeley <github@dougalseeley.com>
+options:
+  instances:
+    description:
+      - The instances to label, as dicts with C(name) and C(regionzone) keys (e.g. C(cluster_hosts_state)).  C(regionzone) may be a zone name or URL.
+    required: true
+    type: list
+    elements: dict
+  labels:
+    description: The labels to add or update.  Other existing labels are not changed.
+    required: true
+    type: dict
+  max_concurrency:
+    description: The maximum number of instances that are relabelled at the same time.
+    required: false
+    default: 16
+    type: int
+  retries:
+    description: The number of times each call is retried (with backoff) on throttling, server errors or fingerprint conflicts.
+    required: false
+    default: 8
+    type: int
+  timeout:
+    description: The maximum time (in seconds) to wait for each C(setLabels) operation to complete.
+    required: false
+    default: 300
+    type: int
+extends_documentation_fragment:
+- google.cloud.gcp
+'''
+
+EXAMPLES = '''
+- name: Set lifecycle_state=retiring on all the hosts
+  gcp_compute_instance_labels:
+    project: "{{cluster_vars[buildenv].vpc_project_id}}"
+    auth_kind: "serviceaccount"
+    service_account_file: "{{gcp_credentials_file}}"
+    instances: "{{ cluster_hosts_state }}"
+    labels: { lifecycle_state: "retiring" }
+  register: r__gcp_compute_instance_labels
+'''
+
+RETURN = '''
+results:
+  description: The per-instance result.
+  returned: always
+  type: list
+  sample: [{"name": "test-sysdisks0-a0-1620000000", "zone": "europe-west1-b", "changed": true, "failed": false, "attempts": 1}]
+'''
+
+from ansible_collections.google.cloud.plugins.module_utils.gcp_utils import GcpModule
+from ansible.module_utils._text import to_native, to_text
+
+from ansible.module_utils.gcp_compute_api import GcpComputeApi, GcpComputeApiError
+
+
+class InstanceLabeller(object):
+    def __init__(self, module):
+        self.module = module
+        self.api = GcpComputeApi(module, retries=module.params['retries'])
+
+    def label(self, instance):
+        zone = to_text(instance['regionzone']).split('/')[-1]
+        result = {'name': instance['name'], 'zone': zone, 'changed': False, 'failed': False, 'attempts': 0}
+        url = self.api.url("zones/%s/instances/%s" % (zone, instance['name']))
+        try:
+            for attempt in range(self.module.params['retries'] + 1):
+                result['attempts'] = attempt + 1
+                current = self.api.check(self.api.request('GET', url, params={'fields': 'labels,labelFingerprint'}))
+                current_labels = current.get('labels', {})
+                new_labels = dict(current_labels, **self.module.params['labels'])
+                if new_labels == current_labels:
+                    return result
+                result['changed'] = True
+                if self.module.check_mode:
+                    return result
+                response = self.api.request('POST', url + '/setLabels', json={'labels': new_labels, 'labelFingerprint': current['labelFingerprint']})
+                if response.status_code == 412:  # The labels were changed since we read the fingerprint; re-read them and try again.
+                    self.api.backoff(attempt)
+                    continue
+                self.api.wait_for_operation(self.api.check(response), self.module.params['timeout'])
+                return result
+            raise GcpComputeApiError("The labels were changed concurrently %d times" % result['attempts'])
+        except Exception as e:
+            result.update({'failed': True, 'msg': to_native(e)})
+            return result
+
+
+def main():
+    module = GcpModule(
+        argument_spec=dict(
+            instances=dict(type='list', elements='dict', required=True),
+            labels=dict(type='dict', required=True),
+            max_concurrency=dict(type='int', default=16),
+            retries=dict(type='int', default=8),
+            timeout=dict(type='int', default=300)
+        ),
+        supports_check_mode=True
+    )
+
+    if not module.params['scopes']:
+        module.params['scopes'] = ['https://www.googleapis.com/auth/compute']
+    module.params['labels'] = dict((to_text(key), to_text(value)) for key, value in module.params['labels'].items())
+
+    for instance in module.params['instances']:
+        if not instance.get('name') or not instance.get('regionzone'):
+            module.fail_json(msg="Each of 'instances' must have a name and regionzone: %s" % instance)
+
+    results = []
+    if module.params['instances']:
+        from concurrent.futures import ThreadPoolExecutor
+        labeller = InstanceLabeller(module)
+        with ThreadPoolExecutor(max_workers=max(1, min(module.params['max_concurrency'], len(module.params['instances'])))) as executor:
+            results = list(executor.map(labeller.label, module.params['instances']))
+
+    failed = [result for result in results if result['failed']]
+    if failed:
+        module.fail_json(msg="Failed to label %d of %d instances: %s" % (len(failed), len(results), ", ".join(result['name'] for result in failed)), results=results)
+
+    module.exit_json(changed=any(result['changed'] for result in results), results=results)
+
+
+if __name__ == '__main__':
+    main()
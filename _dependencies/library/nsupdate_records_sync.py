@@ -0,0 +1,188 @@
+# Copyright 2021 Dougal Seeley <github@dougalseeley.com>
+# BSD 3-Clause License
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+DOCUMENTATION = '''
+---
+module: nsupdate_records_sync
+version_added: 1.0.0
+short_description: Make a set of DNS records present or absent on a (BIND) DNS server, in one RFC2136 update
+description:
+    - Queries the server for the current value of each of I(records), and compares them.
+    - Only the records that differ are changed, all in one (TSIG-signed) RFC2136 update message, (rather than one update per record).
+    - With I(state=absent), a record is only deleted if its current values match the given C(values) (if any).
+authors:
+    - Dougal Seeley <github@dougalseeley.com>
+requirements:
+    - dnspython
+options:
+  server:
+    description: The DNS server (name or IP) to query and update.
+    required: true
+    type: str
+  port:
+    description: The port of the DNS server.
+    required: false
+    default: 53
+    type: int
+  key_name:
+    description: The name of the TSIG key.  If not given, the queries and update are not signed.
+    required: false
+    type: str
+  key_secret:
+    description: The (base64-encoded) secret of the TSIG key.
+    required: false
+    type: str
+  key_algorithm:
+    description: The algorithm of the TSIG key.
+    required: false
+    default: hmac-md5
+    choices: ['HMAC-MD5.SIG-ALG.REG.INT', 'hmac-md5', 'hmac-sha1', 'hmac-sha224', 'hmac-sha256', 'hmac-sha384', 'hmac-sha512']
+    type: str
+  zone:
+    description: The zone to update.
+    required: true
+    type: str
+  records:
+    description:
+      - The records, as dicts of C(name), C(type) (default C(A)), C(ttl) (default 60) and C(values) (or C(value)).
+      - Names that are not fully-qualified are relative to I(zone).
+    required: true
+    type: list
+    elements: dict
+  state:
+    description: Whether the records should be present or absent.
+    required: false
+    default: present
+    choices: ['present', 'absent']
+    type: str
+  timeout:
+    description: The timeout (in seconds) of each query, and of the update.
+    required: false
+    default: 10
+    type: int
+'''
+
+EXAMPLES = '''
+- name: Delete the A records of the hosts
+  nsupdate_records_sync:
+    key_name: "{{bind9[buildenv].key_name}}"
+    key_secret: "{{bind9[buildenv].key_secret}}"
+    server: "{{bind9[buildenv].server}}"
+    zone: "{{cluster_vars.dns_nameserver_zone}}"
+    records: [{ name: "test-sys-a0-1620000000.sandbox", type: "A" }]
+    state: absent
+'''
+
+RETURN = '''
+changes:
+  description: The records that were created, updated or deleted.
+  returned: always
+  type: list
+  sample: [{"action": "create", "name": "test-sys-a0-1620000000.sandbox.example.com.", "type": "A", "ttl": 60, "values": ["10.0.0.1"]}]
+'''
+
+import base64
+import socket
+import traceback
+
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible.module_utils._text import to_native, to_text
+
+from ansible.module_utils.dns_records import normalise_records, diff_records, changes_summary, record_key
+
+try:
+    import dns.message
+    import dns.name
+    import dns.query
+    import dns.rcode
+    import dns.rdataclass
+    import dns.rdatatype
+    import dns.update
+    HAS_DNSPYTHON = True
+except ImportError:
+    DNSPYTHON_IMP_ERR = traceback.format_exc()
+    HAS_DNSPYTHON = False
+
+
+class RecordsSync(object):
+    def __init__(self, module):
+        self.module = module
+        self.server = socket.getaddrinfo(module.params['server'], module.params['port'])[0][4][0]
+        self.keyring = None
+        self.keyalgorithm = None
+        if module.params['key_name']:
+            self.keyring = {dns.name.from_text(module.params['key_name']): base64.b64decode(module.params['key_secret'])}
+            self.keyalgorithm = dns.name.from_text('HMAC-MD5.SIG-ALG.REG.INT' if module.params['key_algorithm'] == 'hmac-md5' else module.params['key_algorithm'])
+
+    def send(self, message):
+        if self.keyring:
+            message.use_tsig(keyring=self.keyring, algorithm=self.keyalgorithm)
+        response = dns.query.tcp(message, self.server, timeout=self.module.params['timeout'], port=self.module.params['port'])
+        if response.rcode() not in [dns.rcode.NOERROR, dns.rcode.NXDOMAIN]:
+            raise Exception("%s returned %s" % (self.module.params['server'], dns.rcode.to_text(response.rcode())))
+        return response
+
+    # The current records, for the names and types of 'records'.  (There is one query per record, as zone transfers are usually not allowed.)
+    def get_current_records(self, records):
+        current = {}
+        for key in sorted(set(record_key(record) for record in records)):
+            name, record_type = key
+            response = self.send(dns.message.make_query(name, record_type))
+            try:
+                rrset = response.find_rrset(response.answer, dns.name.from_text(name), dns.rdataclass.IN, dns.rdatatype.from_text(record_type))
+            except KeyError:
+                continue
+            current[key] = {'name': name, 'type': record_type, 'ttl': rrset.ttl, 'values': sorted(to_text(rdata.to_text()).lower() if record_type == 'CNAME' else to_text(rdata.to_text()) for rdata in rrset)}
+        return current
+
+    def apply(self, changes):
+        update = dns.update.Update(self.module.params['zone'])
+        for record in changes['create'] + [record for current_record, record in changes['update']]:
+            update.replace(dns.name.from_text(record['name']), record['ttl'], record['type'], *record['values'])
+        for record in changes['delete']:
+            update.delete(dns.name.from_text(record['name']), record['type'])
+        self.send(update)
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            server=dict(type='str', required=True),
+            port=dict(type='int', default=53),
+            key_name=dict(type='str'),
+            key_secret=dict(type='str', no_log=True),
+            key_algorithm=dict(type='str', default='hmac-md5', choices=['HMAC-MD5.SIG-ALG.REG.INT', 'hmac-md5', 'hmac-sha1', 'hmac-sha224', 'hmac-sha256', 'hmac-sha384', 'hmac-sha512']),
+            zone=dict(type='str', required=True),
+            records=dict(type='list', elements='dict', required=True),
+            state=dict(type='str', default='present', choices=['present', 'absent']),
+            timeout=dict(type='int', default=10)
+        ),
+        required_together=[['key_name', 'key_secret']],
+        supports_check_mode=True
+    )
+
+    if not HAS_DNSPYTHON:
+        module.fail_json(msg=missing_required_lib('dnspython'), exception=DNSPYTHON_IMP_ERR)
+
+    desired = normalise_records(module.params['records'], module.params['zone'])
+    if not desired:
+        module.exit_json(changed=False, changes=[])
+
+    try:
+        records_sync = RecordsSync(module)
+        changes = diff_records(desired, records_sync.get_current_records(desired), module.params['state'])
+        changed = any(changes.values())
+        if changed and not module.check_mode:
+            records_sync.apply(changes)
+    except Exception as e:
+        module.fail_json(msg="Failed to sync the records of %s: %s" % (module.params['zone'], to_native(e)), exception=traceback.format_exc())
+
+    module.exit_json(changed=changed, changes=changes_summary(changes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+# Copyright 2021 Dougal Seeley <github@dougalseeley.com>
+# BSD 3-Clause License
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+DOCUMENTATION = '''
+---
+module: route53_records_sync
+version_added: 1.0.0
+short_description: Make a set of Route53 records present or absent, in one change batch
+description:
+    - Reads the current records of the hosted zone (only the part of the zone that contains I(records)), and compares them with I(records).
+    - Only the records that differ are changed, all in one C(ChangeResourceRecordSets) batch, (rather than one change per record), and the module waits once
+      for the batch to be C(INSYNC).
+    - With I(state=absent), a record is only deleted if its current values match the given C(values) (if any).
+    - Alias, weighted and other routing-policy records are not managed.
+authors:
+    - Dougal Seeley <github@dougalseeley.com>
+options:
+  zone:
+    description: The name of the hosted zone.
+    required: true
+    type: str
+  hosted_zone_id:
+    description: The ID of the hosted zone (if not given, it is looked up from I(zone) and I(private_zone)).
+    required: false
+    type: str
+  private_zone:
+    description: Whether the hosted zone is private.
+    required: false
+    default: false
+    type: bool
+  vpc_id:
+    description: If there is more than one (private) hosted zone called I(zone), the one associated with this VPC.
+    required: false
+    type: str
+  records:
+    description:
+      - The records, as dicts of C(name), C(type) (default C(A)), C(ttl) (default 60) and C(values) (or C(value)).
+      - Names that are not fully-qualified are relative to I(zone).
+    required: true
+    type: list
+    elements: dict
+  state:
+    description: Whether the records should be present or absent.
+    required: false
+    default: present
+    choices: ['present', 'absent']
+    type: str
+  wait:
+    description: Wait for the changes to be replicated to all the Route53 DNS servers (C(INSYNC)).
+    required: false
+    default: true
+    type: bool
+  wait_timeout:
+    description: The maximum time (in seconds) to wait for the changes to be C(INSYNC).
+    required: false
+    default: 300
+    type: int
+extends_documentation_fragment:
+- amazon.aws.aws
+- amazon.aws.ec2
+'''
+
+EXAMPLES = '''
+- name: Create/update the A records of the hosts
+  route53_records_sync:
+    zone: "{{cluster_vars.dns_nameserver_zone}}"
+    private_zone: true
+    records: "{{ cluster_hosts_target | map(attribute='hostname') | map('regex_replace', '^(.*)$', '\\\\1.' + cluster_vars.dns_user_domain) | ... }}"
+'''
+
+RETURN = '''
+changes:
+  description: The records that were created, updated or deleted.
+  returned: always
+  type: list
+  sample: [{"action": "create", "name": "test-sys-a0-1620000000.sandbox.example.com.", "type": "A", "ttl": 60, "values": ["10.0.0.1"]}]
+change_ids:
+  description: The IDs of the change batches.
+  returned: always
+  type: list
+  sample: ["/change/C2682N5HXP0BZ4"]
+'''
+
+from ansible_collections.amazon.aws.plugins.module_utils.core import AnsibleAWSModule
+from ansible_collections.amazon.aws.plugins.module_utils.ec2 import AWSRetry
+
+from ansible.module_utils.dns_records import fqdn, normalise_records, diff_records, changes_summary, record_key
+
+try:
+    from botocore.exceptions import (BotoCoreError, ClientError, WaiterError)
+except ImportError:
+    pass  # caught by imported AnsibleAWSModule
+
+# The maximum number of changes in each ChangeResourceRecordSets call (the API limit is 1000)
+CHANGE_BATCH_SIZE = 500
+
+
+def get_hosted_zone_id(module, connection):
+    zone_name = fqdn(module.params['zone'])
+    zones = connection.list_hosted_zones_by_name(aws_retry=True, DNSName=zone_name)['HostedZones']
+    zones = [zone for zone in zones if zone['Name'] == zone_name and zone['Config'].get('PrivateZone', False) == module.params['private_zone']]
+    if module.params['vpc_id'] and len(zones) > 1:
+        zones = [zone for zone in zones if module.params['vpc_id'] in [vpc['VPCId'] for vpc in connection.get_hosted_zone(aws_retry=True, Id=zone['Id']).get('VPCs', [])]]
+    if not zones:
+        module.fail_json(msg="Hosted zone %s (private_zone=%s) not found" % (zone_name, module.params['private_zone']))
+    return zones[0]['Id']
+
+
+# The longest (label-wise) common suffix of the names, i.e. the part of the zone that contains them all.
+def common_suffix(names):
+    suffix = names[0].rstrip('.').split('.')[::-1]
+    for labels in [name.rstrip('.').split('.')[::-1] for name in names[1:]]:
+        common = 0
+        while common < min(len(suffix), len(labels)) and suffix[common] == labels[common]:
+            common += 1
+        suffix = suffix[:common]
+    return '.'.join(suffix[::-1]) + '.'
+
+
+# The current (simple) records under 'suffix'.  Route53 returns the records in the order of their reversed labels, so those under a name are contiguous, starting at that name.
+def get_current_records(connection, hosted_zone_id, suffix):
+    records = {}
+    params = {'HostedZoneId': hosted_zone_id, 'StartRecordName': suffix, 'MaxItems': '300'}
+    while True:
+        response = connection.list_resource_record_sets(aws_retry=True, **params)
+        for record_set in response['ResourceRecordSets']:
+            name = record_set['Name'].lower()
+            if not (name == suffix or name.endswith('.' + suffix)):
+                return records
+            if 'ResourceRecords' in record_set and 'SetIdentifier' not in record_set:
+                record = {'name': name, 'type': record_set['Type'], 'ttl': record_set.get('TTL'), 'values': sorted(rr['Value'] for rr in record_set['ResourceRecords'])}
+                records[record_key(record)] = record
+        if not response.get('IsTruncated'):
+            return records
+        params.update({'StartRecordName': response['NextRecordName'], 'StartRecordType': response['NextRecordType']})
+
+
+def to_change(action, record):
+    return {'Action': action, 'ResourceRecordSet': {'Name': record['name'], 'Type': record['type'], 'TTL': record['ttl'], 'ResourceRecords': [{'Value': value} for value in record['values']]}}
+
+
+def main():
+    module = AnsibleAWSModule(
+        argument_spec=dict(
+            zone=dict(type='str', required=True),
+            hosted_zone_id=dict(type='str'),
+            private_zone=dict(type='bool', default=False),
+            vpc_id=dict(type='str'),
+            records=dict(type='list', elements='dict', required=True),
+            state=dict(type='str', default='present', choices=['present', 'absent']),
+            wait=dict(type='bool', default=True),
+            wait_timeout=dict(type='int', default=300)
+        ),
+        supports_check_mode=True
+    )
+
+    desired = normalise_records(module.params['records'], module.params['zone'])
+    if not desired:
+        module.exit_json(changed=False, changes=[], change_ids=[])
+
+    # Route53 is a global service, but requests to an endpoint_url (e.g. a local simulator) still need a region with which to be signed.
+    connection = module.client('route53', retry_decorator=AWSRetry.jittered_backoff(retries=10, catch_extra_error_codes=['PriorRequestNotComplete']), **({} if module.region else {'region': 'us-east-1'}))
+    try:
+        hosted_zone_id = module.params['hosted_zone_id'] or get_hosted_zone_id(module, connection)
+        changes = diff_records(desired, get_current_records(connection, hosted_zone_id, common_suffix([record['name'] for record in desired])), module.params['state'])
+    except (BotoCoreError, ClientError) as e:
+        module.fail_json_aws(e, msg="Failed to read the records of %s" % module.params['zone'])
+
+    route53_changes = [to_change('CREATE', record) for record in changes['create']] + [to_change('UPSERT', record) for current_record, record in changes['update']] + [to_change('DELETE', record) for record in changes['delete']]
+    change_ids = []
+    if route53_changes and not module.check_mode:
+        try:
+            for batch in [route53_changes[i:i + CHANGE_BATCH_SIZE] for i in range(0, len(route53_changes), CHANGE_BATCH_SIZE)]:
+                change_ids.append(connection.change_resource_record_sets(aws_retry=True, HostedZoneId=hosted_zone_id, ChangeBatch={'Changes': batch})['ChangeInfo']['Id'])
+        except (BotoCoreError, ClientError) as e:
+            module.fail_json_aws(e, msg="Failed to change the records of %s" % module.params['zone'], changes=changes_summary(changes), change_ids=change_ids)
+
+        if module.params['wait']:
+            try:
+                for change_id in change_ids:
+                    connection.get_waiter('resource_record_sets_changed').wait(Id=change_id, WaiterConfig={'Delay': 5, 'MaxAttempts': max(1, module.params['wait_timeout'] // 5)})
+            except (BotoCoreError, WaiterError) as e:
+                module.fail_json_aws(e, msg="Timed out waiting for the record changes to be INSYNC", changes=changes_summary(changes), change_ids=change_ids)
+
+    module.exit_json(changed=bool(route53_changes), changes=changes_summary(changes), change_ids=change_ids)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# Copyright (c) 2020, Sky UK Ltd
+# BSD 3-Clause License
+#
+# A persistent, TTL-bounded, on-disk cache for the results of (slow-changing) cloud discovery calls, e.g. instance type or image information.
+# Each entry is a JSON file, stored under <cache_dir>/<resource>/<sha1 of the key>.json, where the key is a dict that identifies the query (e.g. region,
+# account/credential identity and filters).  Writes are atomic (write to a temporary file, then rename), so concurrent runs may safely share a cache_dir.
+#
+#   from ansible.module_utils.discovery_cache import DiscoveryCache
+#
+#   cache = DiscoveryCache(module.params['cache_dir'], 'instance_types', ttl=module.params['cache_ttl'])
+#   key = {'region': region, 'account': cache.identity(aws_access_key), 'instance_types': instance_types, 'filters': filters}
+#   if module.params['cache_invalidate']:
+#       cache.invalidate()
+#   instance_types = cache.get(key)
+#   if instance_types is None:
+#       instance_types = describe_instance_types(...)
+#       cache.set(key, instance_types)
+#
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+DISCOVERY_CACHE_VERSION = 1
+
+
+class DiscoveryCache(object):
+    def __init__(self, cache_dir, resource, ttl=0):
+        self.cache_dir = os.path.join(os.path.expanduser(os.path.expandvars(cache_dir)), resource)
+        self.resource = resource
+        self.ttl = int(ttl or 0)
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    # A non-reversible identifier for a credential (e.g. an access key or profile name), so that cache entries are partitioned by account without storing secrets.
+    @staticmethod
+    def identity(*credentials):
+        return hashlib.sha1(json.dumps([c for c in credentials if c], sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        try:
+            with open(self._path(key), 'r') as cache_file:
+                entry = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+
+        if entry.get('version') != DISCOVERY_CACHE_VERSION or entry.get('key') != json.loads(json.dumps(key, sort_keys=True, default=str)) or time.time() - entry.get('created', 0) > self.ttl:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return entry['value']
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, 0o700)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as tmp_file:
+                json.dump({'version': DISCOVERY_CACHE_VERSION, 'resource': self.resource, 'created': time.time(), 'key': key, 'value': value}, tmp_file, sort_keys=True, default=str)
+            os.rename(tmp_path, self._path(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    # Remove one entry (if key is given), or all the entries for this resource.
+    def invalidate(self, key=None):
+        if not os.path.isdir(self.cache_dir):
+            return
+        paths = [self._path(key)] if key is not None else [os.path.join(self.cache_dir, filename) for filename in os.listdir(self.cache_dir) if filename.endswith('.json')]
+        for cache_path in paths:
+            if os.path.exists(cache_path):
+                os.unlink(cache_path)
+
+    def stats(self):
+        return {'resource': self.resource, 'enabled': self.enabled, 'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,71 @@
+# Copyright (c) 2020, Sky UK Ltd
+# BSD 3-Clause License
+#
+# Computes the changes needed to make a DNS zone contain (state=present) or not contain (state=absent) a set of records, so that DNS modules can apply them all
+# in one batch, (rather than one change, and one wait, per record).
+#
+# Records are dicts of {'name', 'type', 'ttl', 'values'}.  Names are fully-qualified (with a trailing '.'), and CNAME values are made fully-qualified.
+# For state=absent, a record is only deleted if its current values match the given 'values' (if any), e.g. a CNAME is only deleted if it still points to the host.
+#
+#   from ansible.module_utils.dns_records import normalise_records, diff_records
+#
+#   desired = normalise_records(module.params['records'], zone)
+#   changes = diff_records(desired, current_records_by_key, module.params['state'])
+#   # changes == {'create': [record, ...], 'update': [(current_record, record), ...], 'delete': [current_record, ...]}
+#
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from ansible.module_utils._text import to_text
+
+
+def fqdn(name, zone=None):
+    name = to_text(name).lower()
+    if name.endswith('.'):
+        return name
+    if zone and not (name == zone.rstrip('.').lower() or name.endswith('.' + zone.rstrip('.').lower())):
+        name = name + '.' + zone.rstrip('.').lower()
+    return name + '.'
+
+
+def record_key(record):
+    return (record['name'], record['type'])
+
+
+def normalise_record(record, zone=None, default_ttl=60):
+    record_type = to_text(record.get('type', 'A')).upper()
+    values = record.get('values', record.get('value'))
+    if values is None:
+        values = []
+    elif not isinstance(values, list):
+        values = [values]
+    values = [fqdn(value) if record_type == 'CNAME' else to_text(value) for value in values]
+    return {'name': fqdn(record['name'], zone), 'type': record_type, 'ttl': int(record.get('ttl') or default_ttl), 'values': sorted(values)}
+
+
+def normalise_records(records, zone=None, default_ttl=60):
+    return [normalise_record(record, zone, default_ttl) for record in records]
+
+
+# If a record (name and type) is given more than once, the last one is used when state=present (as if each had been applied in turn).
+def diff_records(desired, current, state='present'):
+    changes = {'create': [], 'update': [], 'delete': []}
+    if state == 'present':
+        desired = list(dict((record_key(record), record) for record in desired).values())
+    deleted = set()
+    for record in desired:
+        current_record = current.get(record_key(record))
+        if state == 'present':
+            if current_record is None:
+                changes['create'].append(record)
+            elif current_record['values'] != record['values'] or current_record['ttl'] != record['ttl']:
+                changes['update'].append((current_record, record))
+        elif current_record is not None and record_key(record) not in deleted and (not record['values'] or current_record['values'] == record['values']):
+            changes['delete'].append(current_record)
+            deleted.add(record_key(record))
+    return changes
+
+
+def changes_summary(changes):
+    return [dict(record, action=action) for action in ['create', 'delete'] for record in changes[action]] + [dict(record, action='update', previous_values=current_record['values']) for current_record, record in changes['update']]
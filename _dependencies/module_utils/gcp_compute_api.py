@@ -0,0 +1,89 @@
+# Copyright (c) 2020, Sky UK Ltd
+# BSD 3-Clause License
+#
+# A thin client for the GCP compute REST API, for modules that make many (concurrent) calls.  Authentication uses the google.cloud collection's GcpSession, but
+# one authorised session is kept per thread (GcpSession otherwise creates a new session, and fetches a new token, for every request).  Requests are retried,
+# with jittered exponential backoff, on throttling (HTTP 429, or 403 rateLimitExceeded) and server errors.
+#
+#   from ansible.module_utils.gcp_compute_api import GcpComputeApi, GcpComputeApiError
+#
+#   api = GcpComputeApi(module, retries=module.params['retries'])
+#   instances = api.aggregated_list('instances', filter='labels.cluster_name = "%s"' % cluster_name)
+#
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import random
+import threading
+import time
+
+from ansible_collections.google.cloud.plugins.module_utils.gcp_utils import GcpSession
+
+COMPUTE_API = "https://compute.googleapis.com/compute/v1"
+
+
+class GcpComputeApiError(Exception):
+    pass
+
+
+class GcpComputeApi(object):
+    def __init__(self, module, retries=8):
+        self.module = module
+        self.retries = retries
+        self.gcp_session = GcpSession(module, 'compute')
+        self.thread_local = threading.local()
+        self.calls = 0
+
+    def session(self):
+        if not hasattr(self.thread_local, 'session'):
+            self.thread_local.session = self.gcp_session.session()
+        return self.thread_local.session
+
+    def url(self, path):
+        return "%s/projects/%s/%s" % (COMPUTE_API, self.module.params['project'], path)
+
+    @staticmethod
+    def backoff(attempt):
+        time.sleep(min(30, (2 ** attempt) * 0.5) * random.uniform(0.5, 1.0))
+
+    # Make a request, retrying (with backoff) on throttling and server errors.  Returns the response (which may have any non-retryable status).
+    def request(self, method, url, **kwargs):
+        for attempt in range(self.retries + 1):
+            self.calls += 1
+            response = self.session().request(method, url, **kwargs)
+            if not (response.status_code == 429 or response.status_code >= 500 or (response.status_code == 403 and 'rateLimitExceeded' in response.text)):
+                return response
+            if attempt < self.retries:
+                self.backoff(attempt)
+        return response
+
+    @staticmethod
+    def check(response):
+        if response.status_code >= 400:
+            raise GcpComputeApiError("GCP returned %s: %s" % (response.status_code, response.text))
+        return response.json()
+
+    # All the resources of an aggregatedList call (e.g. 'instances', 'disks'), across all its pages: {scope (e.g. 'zones/europe-west1-b'): [resources]}
+    def aggregated_list(self, resource, filter=None, max_results=500):
+        params = {'maxResults': max_results, 'returnPartialSuccess': 'true'}
+        if filter:
+            params['filter'] = filter
+        resources_by_scope = {}
+        while True:
+            page = self.check(self.request('GET', self.url('aggregated/' + resource), params=params))
+            for scope, scoped_list in page.get('items', {}).items():
+                if scoped_list.get(resource):
+                    resources_by_scope.setdefault(scope, []).extend(scoped_list[resource])
+            if not page.get('nextPageToken'):
+                return resources_by_scope
+            params['pageToken'] = page['nextPageToken']
+
+    def wait_for_operation(self, operation, timeout):
+        deadline = time.time() + timeout
+        while operation.get('status') != 'DONE':
+            if time.time() > deadline:
+                raise GcpComputeApiError("Timed out waiting for operation %s" % operation.get('name'))
+            operation = self.check(self.request('POST', operation['selfLink'] + '/wait'))
+        if operation.get('error'):
+            raise GcpComputeApiError("Operation %s failed: %s" % (operation.get('name'), operation['error']))
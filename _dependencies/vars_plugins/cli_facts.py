@@ -18,7 +18,7 @@ requirements:
 '''
 
 from ansible.plugins.vars import BaseVarsPlugin
-from ansible.context import CLIARGS
+from ansible import context
 import sys
 
 
@@ -27,4 +27,4 @@ class VarsModule(BaseVarsPlugin):
 
     def get_vars(self, loader, path, entities, cache=True):
         super(VarsModule, self).get_vars(loader, path, entities)
-        return {"cliargs": dict(CLIARGS), "argv": sys.argv}
+        return {"cliargs": dict(context.CLIARGS), "argv": sys.argv}      # context.CLIARGS (not imported directly), because it is replaced for nested (run_playbook) runs
@@ -0,0 +1,202 @@
+# Copyright (c) 2020, Sky UK Ltd
+# BSD 3-Clause License
+#
+# Local stand-ins for the cloud APIs, for the benchmark suite (suite.py):
+#   + MotoSimulator: moto (server mode, for EC2 and Route53), run in a thread of this process.
+#   + GceSimulator:  the fake GCE (and Cloud DNS) API of fake_gce.py, reached through a local HTTPS proxy (see fake_gce.py).
+#
+# Each counts the API calls it serves (per service and operation), so that the suite can report how many calls a run makes, and each can be reset (emptied) and
+# seeded with the pre-existing resources that a cluster needs (the VPC/network, subnets, DNS zone and image).
+#
+
+from __future__ import (absolute_import, division, print_function)
+
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import Counter
+
+try:
+    from urllib.parse import parse_qs
+except ImportError:
+    from urlparse import parse_qs
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+AWS_REGION = 'eu-west-1'
+AWS_AMI = 'ami-785db401'        # One of moto's default AMIs (Ubuntu 16.04, x86_64)
+DNS_ZONE = 'bench.example.com'      # The private DNS zone, in Route53 and Cloud DNS
+GCP_REGION = 'europe-west1'
+GCP_PROJECT = 'bench-project'
+GCP_NETWORK = 'bench-sandbox'
+GCP_IMAGES = [('ubuntu-os-cloud', 'ubuntu-2004-focal-v20210623', '2021-06-23T12:00:00.000-07:00'),
+              ('ubuntu-os-cloud', 'ubuntu-2004-focal-v20210820', '2021-08-20T12:00:00.000-07:00')]
+
+
+# WSGI middleware that counts the requests to 'app', by the key that 'request_key' returns for each (or None, not to count it).
+class CountingMiddleware(object):
+    def __init__(self, app, request_key):
+        self.app = app
+        self.request_key = request_key
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        key = self.request_key(environ)
+        if key:
+            with self.lock:
+                self.calls[key] += 1
+        return self.app(environ, start_response)
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.calls)
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+# Serves a WSGI app (threaded) on a free port of 127.0.0.1.
+class WsgiServer(object):
+    def __init__(self, app, ssl_context=None):
+        self.server = make_server('127.0.0.1', 0, app, threaded=True, ssl_context=ssl_context, request_handler=QuietRequestHandler)
+        self.port = self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, name='wsgi-%d' % self.port)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+
+# The AWS operation of a request to moto: the 'Action' of the query APIs (EC2), or the method and (normalised) path of the REST APIs (Route53).
+def aws_request_key(environ):
+    path = environ.get('PATH_INFO', '')
+    if path.startswith('/moto-api'):
+        return None
+    credential_scope = re.search(r'Credential=[^/]+/[^/]+/[^/]+/([^/]+)/', environ.get('HTTP_AUTHORIZATION', ''))
+    service = credential_scope.group(1) if credential_scope else 'unsigned'
+    action = parse_qs(environ.get('QUERY_STRING', '')).get('Action')
+    if not action and environ.get('CONTENT_TYPE', '').startswith('application/x-www-form-urlencoded'):
+        body = environ['wsgi.input'].read(int(environ.get('CONTENT_LENGTH') or 0))
+        environ['wsgi.input'] = io.BytesIO(body)
+        action = parse_qs(body.decode('utf-8', 'replace')).get('Action')
+    if action:
+        return '%s:%s' % (service, action[0])
+    return '%s:%s %s' % (service, environ.get('REQUEST_METHOD'), re.sub(r'/(?=[A-Z0-9]*\d)[A-Z0-9]{8,}(?=/|$)', '/{id}', re.sub(r'^/\d{4}-\d{2}-\d{2}', '', path)))
+
+
+class MotoSimulator(object):
+    def __init__(self):
+        from moto.moto_server.werkzeug_app import DomainDispatcherApplication, create_backend_app
+        self.app = CountingMiddleware(DomainDispatcherApplication(create_backend_app), aws_request_key)
+        self.server = WsgiServer(self.app)
+        self.url = 'http://127.0.0.1:%d' % self.server.port
+
+    def start(self):
+        self.server.start()
+        return self
+
+    def stop(self):
+        self.server.stop()
+
+    def client(self, service):
+        import boto3
+        return boto3.client(service, region_name=AWS_REGION, endpoint_url=self.url, aws_access_key_id='testing', aws_secret_access_key='testing')
+
+    # Empty all of moto's backends, and create what the (fixture) cluster needs to exist already: the VPC and a subnet per AZ (named as vpc_name and
+    # vpc_subnet_name_prefix in the fixture cluster_defs), the key pair, and the private Route53 zone.
+    def reset(self):
+        import requests
+        requests.post(self.url + '/moto-api/reset').raise_for_status()
+        ec2 = self.client('ec2')
+        vpc_id = ec2.create_vpc(CidrBlock='10.0.0.0/16', TagSpecifications=[{'ResourceType': 'vpc', 'Tags': [{'Key': 'Name', 'Value': 'benchsandbox'}]}])['Vpc']['VpcId']
+        for index, az in enumerate('abc'):
+            ec2.create_subnet(VpcId=vpc_id, CidrBlock='10.0.%d.0/20' % (index * 16), AvailabilityZone=AWS_REGION + az,
+                              TagSpecifications=[{'ResourceType': 'subnet', 'Tags': [{'Key': 'Name', 'Value': 'sandbox-bench-%s%s' % (AWS_REGION, az)}]}])
+        ec2.create_key_pair(KeyName='bench__id_rsa')
+        self.client('route53').create_hosted_zone(Name=DNS_ZONE, CallerReference='bench', HostedZoneConfig={'PrivateZone': True},
+                                                  VPC={'VPCRegion': AWS_REGION, 'VPCId': vpc_id})
+        self.app.reset()
+
+    # The environment and extra vars of the playbooks run against the simulator
+    def env(self):
+        return {'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing', 'AWS_DEFAULT_REGION': AWS_REGION}
+
+    def extra_vars(self):
+        return {'bench_endpoint_url': self.url}
+
+    def calls_reset(self):
+        self.app.reset()
+
+    def calls(self):
+        return self.app.snapshot()
+
+    # The number of (non-terminated) instances, by state
+    def instance_states(self):
+        states = Counter()
+        for page in self.client('ec2').get_paginator('describe_instances').paginate():
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    states[instance['State']['Name']] += 1
+        states.pop('terminated', None)
+        return dict(states)
+
+
+class GceSimulator(object):
+    def __init__(self):
+        from fake_gce import FakeGce, ConnectProxy, make_certificates, make_service_account_file, server_ssl_context
+        self.directory = tempfile.mkdtemp(prefix='fake_gce.')
+        self.certificates = make_certificates(self.directory)
+        self.credentials_file = make_service_account_file(os.path.join(self.directory, 'gcp__%s.json' % GCP_PROJECT), GCP_PROJECT)
+        self.app = FakeGce(GCP_PROJECT, GCP_REGION)
+        self.server = WsgiServer(self.app, ssl_context=server_ssl_context(self.certificates))
+        self.proxy = ConnectProxy(self.server.port)
+        self.proxy_thread = threading.Thread(target=self.proxy.serve_forever, name='proxy-%d' % self.proxy.port)
+        self.proxy_thread.daemon = True
+
+    def start(self):
+        self.server.start()
+        self.proxy_thread.start()
+        return self
+
+    def stop(self):
+        self.proxy.shutdown()
+        self.server.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    # Empty the fake project, and create the network (vpc_network_name in the fixture cluster_defs), the public images and the private Cloud DNS zone.
+    def reset(self):
+        self.app.reset(network=GCP_NETWORK, images=GCP_IMAGES, dns_zone=DNS_ZONE)
+
+    # The GCP clients (google-auth/requests, httplib2 and libcloud) reach the fake through the proxy, and trust its CA.
+    def env(self):
+        proxy_url = 'http://127.0.0.1:%d' % self.proxy.port
+        ca_file = self.certificates['ca.pem']
+        return {'HTTPS_PROXY': proxy_url, 'https_proxy': proxy_url, 'REQUESTS_CA_BUNDLE': ca_file, 'SSL_CERT_FILE': ca_file, 'HTTPLIB2_CA_CERTS': ca_file}
+
+    def extra_vars(self):
+        return {'gcp_credentials_file': self.credentials_file, 'bench_gcp_project': GCP_PROJECT}
+
+    def calls_reset(self):
+        self.app.calls_reset()
+
+    def calls(self):
+        return self.app.calls_snapshot()
+
+    # The number of instances, by state (named as on AWS: 'running' or 'stopped')
+    def instance_states(self):
+        states = Counter({'RUNNING': 'running', 'TERMINATED': 'stopped'}.get(instance['status'], instance['status'].lower()) for instance in list(self.app.instances.values()))
+        return dict(states)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# Copyright (c) 2020, Sky UK Ltd
+# BSD 3-Clause License
+#
+# Benchmarks building the dynamic inventory (the dynamic_inventory role) for a large number of synthetic hosts, without any cloud infrastructure.
+#
+# It runs the role's own inventory-building tasks (dynamic_inventory/tasks/main.yml, without the cloud call that gets cluster_hosts_state, and without the
+# deprecated ssh wait) against a synthetic cluster_hosts_state, in ansible-playbook, and reports the wall-clock time of the run, and of the
+# cluster_hosts_inventory/cluster_hosts_inventory_ini filters on their own.  With '--compare <git revision>', the same is done with the role's tasks (and filters) at
+# that revision, so a change can be compared with what it replaced.  E.g. to compare with the per-host add_host loop and INI template that the filters replaced:
+#   python3 benchmark/dynamic_inventory.py --hosts 1000 --compare bfa7c81^
+#
+# The tasks are run with the python and ansible-playbook of the current environment, so the results of both revisions are comparable with each other, but not
+# with other machines.
+
+from __future__ import (absolute_import, division, print_function)
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def git_show(revision, path):
+    return subprocess.check_output(['git', '-C', REPO_DIR, 'show', '%s:%s' % (revision, path)]).decode()
+
+
+# A synthetic cluster_hosts_state, as set by get_cluster_hosts_state_aws.yml: 'hosts' running hosts, across 3 zones and 'hosttypes' hosttypes.
+def synthetic_cluster_hosts_state(cluster_name, hosts, hosttypes):
+    cluster_hosts_state = []
+    for index in range(hosts):
+        hosttype = 'type%d' % (index % hosttypes)
+        zone = 'abc'[index % 3]
+        cluster_hosts_state.append({'name': '%s-%s-%s%d-%d' % (cluster_name, hosttype, zone, index // 3, 1000000000 + index), 'regionzone': 'eu-west-1' + zone,
+                                    'tagslabels': {'Name': '%s-%s-%s%d' % (cluster_name, hosttype, zone, index // 3), 'cluster_name': cluster_name, 'hosttype': hosttype, 'lifecycle_state': 'current'},
+                                    'instance_id': 'i-%017x' % index, 'instance_state': 'running', 'image': 'ami-00000000000000000',
+                                    'ipv4': {'private': '10.%d.%d.%d' % (index // 65536, (index // 256) % 256, index % 256), 'public': None}, 'disk_info_cloud': []})
+    return cluster_hosts_state
+
+
+# The role's tasks at 'revision' (or in the working tree), without the tasks that get cluster_hosts_state from the cloud.
+def dynamic_inventory_tasks(revision):
+    if revision:
+        tasks = yaml.safe_load(git_show(revision, 'dynamic_inventory/tasks/main.yml'))
+    else:
+        with open(os.path.join(REPO_DIR, 'dynamic_inventory', 'tasks', 'main.yml'), 'r') as tasks_file:
+            tasks = yaml.safe_load(tasks_file)
+    return [task for task in tasks if 'include_role' not in task]
+
+
+# The filter plugins at 'revision' (or in the working tree)
+def filter_plugins_dir(workdir, revision):
+    if not revision:
+        return os.path.join(REPO_DIR, '_dependencies', 'filter_plugins')
+    plugins_dir = os.path.join(workdir, 'filter_plugins')
+    os.makedirs(plugins_dir)
+    with open(os.path.join(plugins_dir, 'custom.py'), 'w') as custom_file:
+        custom_file.write(git_show(revision, '_dependencies/filter_plugins/custom.py'))
+    return plugins_dir
+
+
+def run_playbook(workdir, revision, cluster_vars, cluster_hosts_state):
+    playbook = os.path.join(workdir, 'dynamic_inventory.yml')
+    with open(playbook, 'w') as playbook_file:
+        yaml.safe_dump([{'hosts': 'localhost', 'connection': 'local', 'gather_facts': False, 'tasks': dynamic_inventory_tasks(revision)}], playbook_file)
+    extra_vars = os.path.join(workdir, 'extra_vars.json')
+    with open(extra_vars, 'w') as extra_vars_file:
+        json.dump({'cluster_name': 'bench-sandbox', 'clusterid': 'bench', 'buildenv': 'sandbox', 'cluster_vars': cluster_vars, 'cluster_hosts_state': cluster_hosts_state,
+                   'skip_dynamic_inventory_sshwait': True}, extra_vars_file)
+
+    env = dict(os.environ, ANSIBLE_FILTER_PLUGINS=filter_plugins_dir(workdir, revision), ANSIBLE_LIBRARY=os.path.join(REPO_DIR, '_dependencies', 'library'),
+               ANSIBLE_ACTION_PLUGINS=os.path.join(REPO_DIR, '_dependencies', 'action_plugins'), ANSIBLE_PYTHON_INTERPRETER=sys.executable,
+               ANSIBLE_LOCALHOST_WARNING='false', ANSIBLE_INVENTORY_UNPARSED_WARNING='false')
+    ansible_playbook = os.path.join(os.path.dirname(sys.executable), 'ansible-playbook')
+    start_time = time.time()
+    process = subprocess.run([ansible_playbook if os.path.isfile(ansible_playbook) else 'ansible-playbook', '-i', 'localhost,', playbook, '-e', '@' + extra_vars],
+                             env=env, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    duration = round(time.time() - start_time, 3)
+    if process.returncode != 0:
+        raise RuntimeError("ansible-playbook failed:\n" + process.stdout.decode()[-4000:])
+    with open(os.path.join(workdir, 'inventory_bench-sandbox'), 'r') as inventory_file:
+        inventory_lines = len(inventory_file.read().splitlines())
+    return duration, inventory_lines
+
+
+# The filters on their own (only at revisions that have them)
+def time_filters(workdir, revision, cluster_vars, cluster_hosts_state, repeat):
+    sys.path.insert(0, filter_plugins_dir(os.path.join(workdir, 'filters'), revision))
+    try:
+        sys.modules.pop('custom', None)
+        import custom
+        if not hasattr(custom, 'cluster_hosts_inventory'):
+            return None
+        start_time = time.time()
+        for _ in range(repeat):
+            inventory = custom.cluster_hosts_inventory(cluster_hosts_state, 'bench-sandbox', 'bench', inventory_ip=cluster_vars['inventory_ip'], host_vars={'ansible_user': 'ansible'})
+            custom.cluster_hosts_inventory_ini(inventory)
+        return round((time.time() - start_time) / repeat, 4)
+    finally:
+        sys.path.pop(0)
+        sys.modules.pop('custom', None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark building the dynamic inventory for synthetic hosts")
+    parser.add_argument('--hosts', type=int, default=1000, help="The number of (running) synthetic hosts (default 1000)")
+    parser.add_argument('--hosttypes', type=int, default=4, help="The number of hosttypes (default 4)")
+    parser.add_argument('--compare', metavar='REVISION', help="Also benchmark the dynamic_inventory tasks and filters at this git revision")
+    parser.add_argument('--repeat', type=int, default=3, help="The number of runs of each (the fastest is reported; default 3)")
+    parser.add_argument('--json', help="Also write the results to this file")
+    args = parser.parse_args()
+
+    cluster_vars = {'type': 'aws', 'inventory_ip': 'private', 'sandbox': {'ssh_connection_cfg': {'host': {'ansible_user': 'ansible'}}}}
+    cluster_hosts_state = synthetic_cluster_hosts_state('bench-sandbox', args.hosts, args.hosttypes)
+
+    results = {}
+    for name, revision in [('working tree', None)] + ([(args.compare, args.compare)] if args.compare else []):
+        runs = []
+        for _ in range(args.repeat):
+            workdir = tempfile.mkdtemp(prefix='dynamic_inventory.')
+            try:
+                runs.append(run_playbook(workdir, revision, cluster_vars, cluster_hosts_state))
+                filters_time = time_filters(workdir, revision, cluster_vars, cluster_hosts_state, 10)
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+        duration, inventory_lines = min(runs)
+        results[name] = {'hosts': args.hosts, 'playbook': duration, 'filters': filters_time, 'inventory_lines': inventory_lines}
+        print("%-14s %5d hosts  playbook: %8.3fs  filters: %s  (inventory file: %d lines)" % (name, args.hosts, duration, ('%.4fs' % filters_time) if filters_time is not None else 'n/a', inventory_lines))
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,533 @@
+# Copyright (c) 2020, Sky UK Ltd
+# BSD 3-Clause License
+#
+# A fake of the parts of the GCE (compute/v1), Cloud DNS (dns/v1) and OAuth2 token APIs that clusterverse uses, for the benchmark suite (suite.py).  The resources
+# are held in memory, and every operation completes immediately (operations are returned DONE, DNS changes 'done').
+#
+# The GCP modules (google.cloud, community.google, and the ones in _dependencies/library) have the API hostnames built in, so the fake is served over HTTPS with a
+# certificate (for the googleapis.com/ accounts.google.com hostnames) signed by a CA of its own, and reached through a local CONNECT proxy that tunnels only
+# those hostnames to it.  The playbooks are run with HTTPS_PROXY set to the proxy, and the CA bundle (REQUESTS_CA_BUNDLE, SSL_CERT_FILE, HTTPLIB2_CA_CERTS) set to
+# the CA, (see GceSimulator in cloud_sim.py).
+#
+# Each request is counted by its API method (e.g. 'compute.instances.insert'); unknown requests are counted (as 'unknown: <method> <path>') and answered 404.
+#
+
+from __future__ import (absolute_import, division, print_function)
+
+import base64
+import datetime
+import fnmatch
+import hashlib
+import itertools
+import json
+import os
+import re
+import select
+import socket
+import ssl
+import threading
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from werkzeug.wrappers import Request, Response
+
+GOOGLE_API_HOSTS = ['compute.googleapis.com', 'www.googleapis.com', 'dns.googleapis.com', 'oauth2.googleapis.com', 'accounts.google.com']
+COMPUTE_URL = 'https://www.googleapis.com/compute/v1'
+DNS_URL = 'https://dns.googleapis.com/dns/v1'
+
+_PROJECT = r'/projects/(?P<project>[^/]+)'
+_ZONE = _PROJECT + r'/zones/(?P<zone>[^/]+)'
+_NAME = r'/(?P<name>[^/]+)'
+_SCOPE = _PROJECT + r'/(?P<scope>global|zones/[^/]+|regions/[^/]+)'
+_MANAGED_ZONE = _PROJECT + r'/managedZones/(?P<managed_zone>[^/]+)'
+
+
+def now():
+    return datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + '-00:00'
+
+
+def fingerprint(value):
+    return base64.b64encode(hashlib.md5(json.dumps(value, sort_keys=True).encode()).digest()[:8]).decode()
+
+
+def basename(url):
+    return url.rstrip('/').split('/')[-1] if url else url
+
+
+def get_path(resource, path):
+    for key in path.split('.'):
+        if not isinstance(resource, dict):
+            return None
+        resource = resource.get(key)
+    return resource
+
+
+# Whether 'resource' matches a (compute API) filter expression: one or more '<field> <op> <value>' terms (optionally in parentheses, implicitly ANDed), where the
+# op is '=' or '!=' (value may contain '*' wildcards), or 'eq' or 'ne' (value is a regular expression).
+def matches_filter(resource, filter_expression):
+    for field, operator, quoted_value, value in re.findall(r'([\w.]+)\s*(!=|=|\beq\b|\bne\b)\s*(?:"([^"]*)"|([^\s)]+))', filter_expression or ''):
+        actual = get_path(resource, field)
+        actual = '' if actual is None else (str(actual).lower() if isinstance(actual, bool) else str(actual))
+        value = quoted_value or value
+        if operator in ('=', '!='):
+            matched = fnmatch.fnmatchcase(actual, value)
+        else:
+            matched = re.match('(?:%s)$' % value, actual) is not None
+        if matched != (operator in ('=', 'eq')):
+            return False
+    return True
+
+
+class GceApiError(Exception):
+    def __init__(self, status, message, reason='invalid'):
+        super(GceApiError, self).__init__(message)
+        self.status = status
+        self.reason = reason
+
+    def response(self):
+        return {'error': {'code': self.status, 'message': str(self), 'errors': [{'domain': 'global', 'reason': self.reason, 'message': str(self)}]}}
+
+
+class FakeGce(object):
+    """The WSGI application: the in-memory compute and DNS resources of one project, and the routes of the API methods that act on them."""
+
+    def __init__(self, project, region):
+        self.project = project
+        self.region = region
+        self.zones = ['%s-%s' % (region, az) for az in 'bcd']
+        self.lock = threading.RLock()
+        self.calls = {}
+        self.routes = [(method, re.compile(pattern + '$'), api_method, getattr(self, handler)) for method, pattern, api_method, handler in [
+            ('POST', r'/token', 'oauth2.token', 'token'),
+            ('POST', r'/o/oauth2/token', 'oauth2.token', 'token'),
+            ('GET', r'/compute/v1' + _PROJECT + r'/aggregated/(?P<collection>instances|disks)', 'compute.{collection}.aggregatedList', 'aggregated_list'),
+            ('GET', r'/compute/v1' + _PROJECT + r'/zones', 'compute.zones.list', 'list_zones'),
+            ('GET', r'/compute/v1' + _ZONE, 'compute.zones.get', 'get_zone'),
+            ('GET', r'/compute/v1' + _PROJECT + r'/regions', 'compute.regions.list', 'list_regions'),
+            ('GET', r'/compute/v1' + _PROJECT + r'/regions/(?P<region>[^/]+)', 'compute.regions.get', 'get_region'),
+            ('GET', r'/compute/v1' + _ZONE + r'/(?P<collection>instances|disks)', 'compute.{collection}.list', 'list_zonal'),
+            ('GET', r'/compute/v1' + _ZONE + r'/(?P<collection>instances|disks)' + _NAME, 'compute.{collection}.get', 'get_zonal'),
+            ('POST', r'/compute/v1' + _ZONE + r'/instances', 'compute.instances.insert', 'insert_instance'),
+            ('DELETE', r'/compute/v1' + _ZONE + r'/instances' + _NAME, 'compute.instances.delete', 'delete_instance'),
+            ('POST', r'/compute/v1' + _ZONE + r'/instances' + _NAME + r'/(?P<verb>start|stop|setLabels|setMachineType|setDeletionProtection|detachDisk|attachDisk)',
+             'compute.instances.{verb}', 'instance_verb'),
+            ('POST', r'/compute/v1' + _ZONE + r'/disks' + _NAME + r'/setLabels', 'compute.disks.setLabels', 'set_disk_labels'),
+            ('DELETE', r'/compute/v1' + _ZONE + r'/disks' + _NAME, 'compute.disks.delete', 'delete_disk'),
+            ('GET', r'/compute/v1' + _SCOPE + r'/operations' + _NAME, 'compute.operations.get', 'get_operation'),
+            ('POST', r'/compute/v1' + _SCOPE + r'/operations' + _NAME + r'/wait', 'compute.operations.wait', 'get_operation'),
+            ('GET', r'/compute/v1/projects/(?P<image_project>[^/]+)/global/images', 'compute.images.list', 'list_images'),
+            ('GET', r'/compute/v1/projects/(?P<image_project>[^/]+)/global/images' + _NAME, 'compute.images.get', 'get_image'),
+            ('GET', r'/compute/v1' + _PROJECT + r'/global/(?P<collection>networks|firewalls)', 'compute.{collection}.list', 'list_global'),
+            ('GET', r'/compute/v1' + _PROJECT + r'/global/(?P<collection>networks|firewalls)' + _NAME, 'compute.{collection}.get', 'get_global'),
+            ('POST', r'/compute/v1' + _PROJECT + r'/global/firewalls', 'compute.firewalls.insert', 'insert_firewall'),
+            ('PATCH', r'/compute/v1' + _PROJECT + r'/global/firewalls' + _NAME, 'compute.firewalls.patch', 'update_firewall'),
+            ('PUT', r'/compute/v1' + _PROJECT + r'/global/firewalls' + _NAME, 'compute.firewalls.update', 'update_firewall'),
+            ('DELETE', r'/compute/v1' + _PROJECT + r'/global/firewalls' + _NAME, 'compute.firewalls.delete', 'delete_firewall'),
+            ('GET', r'/compute/v1' + _PROJECT + r'/regions/(?P<region>[^/]+)/subnetworks', 'compute.subnetworks.list', 'list_subnetworks'),
+            ('GET', r'/dns/v1' + _PROJECT + r'/managedZones', 'dns.managedZones.list', 'list_managed_zones'),
+            ('GET', r'/dns/v1' + _MANAGED_ZONE + r'/rrsets', 'dns.resourceRecordSets.list', 'list_rrsets'),
+            ('POST', r'/dns/v1' + _MANAGED_ZONE + r'/changes', 'dns.changes.create', 'create_change'),
+            ('GET', r'/dns/v1' + _MANAGED_ZONE + r'/changes' + _NAME, 'dns.changes.get', 'get_change'),
+        ]]
+        self.reset()
+
+    # Empty the project, and create what a cluster needs to exist already: the network, and the (public) images and the private DNS zone.
+    def reset(self, network='default', images=None, dns_zone=None):
+        with self.lock:
+            self.ids = itertools.count(1000000000000000000)
+            self.ips = itertools.count(2)
+            self.instances = {}             # {(zone, name): instance}
+            self.disks = {}                 # {(zone, name): disk}
+            self.operations = {}            # {name: operation}
+            self.images = {}                # {(project, name): image}
+            self.firewalls = {}
+            self.networks = {}
+            self.managed_zones = {}         # {name: {'zone': managed zone, 'rrsets': {(name, type): rrset}, 'changes': [change]}}
+            self.networks[network] = {'kind': 'compute#network', 'id': str(next(self.ids)), 'name': network, 'autoCreateSubnetworks': True,
+                                      'selfLink': '%s/projects/%s/global/networks/%s' % (COMPUTE_URL, self.project, network), 'creationTimestamp': now()}
+            for image_project, image_name, created in images or []:
+                self.images[(image_project, image_name)] = {'kind': 'compute#image', 'id': str(next(self.ids)), 'name': image_name, 'status': 'READY', 'labels': {},
+                                                            'selfLink': '%s/projects/%s/global/images/%s' % (COMPUTE_URL, image_project, image_name),
+                                                            'creationTimestamp': created, 'diskSizeGb': '10'}
+            if dns_zone:
+                name = dns_zone.rstrip('.').replace('.', '-')
+                self.managed_zones[name] = {'zone': {'kind': 'dns#managedZone', 'id': str(next(self.ids)), 'name': name, 'dnsName': dns_zone.rstrip('.') + '.',
+                                                     'visibility': 'private', 'nameServers': ['ns-gcp-private.googledomains.com.']},
+                                            'rrsets': {}, 'changes': []}
+            self.calls = {}
+
+    def calls_snapshot(self):
+        with self.lock:
+            return dict(self.calls)
+
+    def calls_reset(self):
+        with self.lock:
+            self.calls = {}
+
+    def __call__(self, environ, start_response):
+        request = Request(environ)
+        for method, pattern, api_method, handler in self.routes:
+            match = pattern.match(request.path)
+            if match and request.method == method:
+                api_method = api_method.format(**match.groupdict())
+                break
+        else:
+            api_method, handler, match = 'unknown: %s %s' % (request.method, re.sub(r'/projects/[^/]+', '/projects/{project}', request.path)), None, None
+        with self.lock:
+            self.calls[api_method] = self.calls.get(api_method, 0) + 1
+            try:
+                if not handler:
+                    raise GceApiError(404, 'The requested URL was not found (%s %s)' % (request.method, request.path), 'notFound')
+                body = request.get_json(silent=True) if request.method in ('POST', 'PUT', 'PATCH') else None
+                status, result = 200, handler(request, body, **match.groupdict())
+            except GceApiError as e:
+                status, result = e.status, e.response()
+        return Response(json.dumps(result), status=status, content_type='application/json; charset=UTF-8')(environ, start_response)
+
+    @staticmethod
+    def page(request, items, kind, key='items'):
+        max_results = int(request.args.get('maxResults') or 500)
+        start = int(request.args.get('pageToken') or 0)
+        result = {'kind': kind, key: items[start:start + max_results]}
+        if start + max_results < len(items):
+            result['nextPageToken'] = str(start + max_results)
+        return result
+
+    def link(self, path, project=None):
+        return '%s/projects/%s/%s' % (COMPUTE_URL, project or self.project, path)
+
+    def operation(self, scope, operation_type, target_link):
+        name = 'operation-%d' % next(self.ids)
+        operation = {'kind': 'compute#operation', 'id': str(next(self.ids)), 'name': name, 'operationType': operation_type, 'targetLink': target_link, 'status': 'DONE',
+                     'progress': 100, 'insertTime': now(), 'startTime': now(), 'endTime': now(), 'selfLink': self.link('%s/operations/%s' % (scope, name))}
+        if scope.startswith('zones/'):
+            operation['zone'] = self.link(scope)
+        self.operations[name] = operation
+        return operation
+
+    def not_found(self, what):
+        return GceApiError(404, "The resource '%s' was not found" % what, 'notFound')
+
+    def zonal(self, collection, zone, name):
+        resource = getattr(self, collection).get((zone, name))
+        if not resource:
+            raise self.not_found('projects/%s/zones/%s/%s/%s' % (self.project, zone, collection, name))
+        return resource
+
+    # OAuth2 (both the google-auth and libcloud service account flows): any assertion is good for a token.
+    def token(self, request, body):
+        return {'access_token': 'fake-access-token', 'token_type': 'Bearer', 'expires_in': 3600}
+
+    def aggregated_list(self, request, body, project, collection):
+        resources = [resource for resource in getattr(self, collection).values() if matches_filter(resource, request.args.get('filter'))]
+        page = self.page(request, resources, 'compute#%sAggregatedList' % collection[:-1])
+        items = {}
+        for resource in page.pop('items'):
+            items.setdefault('zones/' + basename(resource['zone']), {collection: []})[collection].append(resource)
+        return dict(page, items=items)
+
+    def zone(self, zone):
+        return {'kind': 'compute#zone', 'id': str(2000 + self.zones.index(zone)), 'name': zone, 'status': 'UP', 'description': zone, 'region': self.link('regions/' + self.region),
+                'selfLink': self.link('zones/' + zone), 'creationTimestamp': '1969-12-31T16:00:00.000-08:00', 'availableCpuPlatforms': ['Intel Skylake']}
+
+    def list_zones(self, request, body, project):
+        return self.page(request, [self.zone(zone) for zone in self.zones], 'compute#zoneList')
+
+    def get_zone(self, request, body, project, zone):
+        if zone not in self.zones:
+            raise self.not_found('projects/%s/zones/%s' % (project, zone))
+        return self.zone(zone)
+
+    def list_regions(self, request, body, project):
+        return self.page(request, [self.get_region(request, body, project, self.region)], 'compute#regionList')
+
+    def get_region(self, request, body, project, region):
+        return {'kind': 'compute#region', 'id': '1100', 'name': region, 'status': 'UP', 'description': region, 'zones': [self.link('zones/' + zone) for zone in self.zones],
+                'selfLink': self.link('regions/' + region), 'quotas': [], 'creationTimestamp': '1969-12-31T16:00:00.000-08:00'}
+
+    def list_zonal(self, request, body, project, zone, collection):
+        resources = [resource for (resource_zone, _), resource in sorted(getattr(self, collection).items()) if resource_zone == zone and matches_filter(resource, request.args.get('filter'))]
+        return self.page(request, resources, 'compute#%sList' % collection[:-1])
+
+    def get_zonal(self, request, body, project, zone, collection, name):
+        resource = self.zonal(collection, zone, name)
+        fields = request.args.get('fields')
+        return dict((field, resource[field]) for field in fields.split(',') if field in resource) if fields else resource
+
+    # Creates the instance, its (initialize_params) disks, and attaches its (source) disks.  As GCE does, a disk with a source is attached, even if it also has
+    # initialize_params (as the kept disks do in _scheme_rmvm_keepdisk_rollback).
+    def insert_instance(self, request, body, project, zone):
+        name = body['name']
+        if (zone, name) in self.instances:
+            raise GceApiError(409, "The resource 'projects/%s/zones/%s/instances/%s' already exists" % (project, zone, name), 'alreadyExists')
+        self_link = self.link('zones/%s/instances/%s' % (zone, name))
+        attached_disks = []
+        for index, disk in enumerate(body.get('disks', [])):
+            if disk.get('initializeParams') and not disk.get('source'):
+                params = disk['initializeParams']
+                disk_name = params.get('diskName') or name
+                if (zone, disk_name) in self.disks:
+                    raise GceApiError(409, "The resource 'projects/%s/zones/%s/disks/%s' already exists" % (project, zone, disk_name), 'alreadyExists')
+                source_image = params.get('sourceImage')
+                if source_image:
+                    image_project, image_name = re.match(r'(?:.*/)?projects/([^/]+)/global/images/(.*)$', source_image).groups()
+                    if (image_project, image_name) not in self.images:
+                        raise self.not_found('projects/%s/global/images/%s' % (image_project, image_name))
+                    source_image = self.images[(image_project, image_name)]['selfLink']
+                self.disks[(zone, disk_name)] = {'kind': 'compute#disk', 'id': str(next(self.ids)), 'name': disk_name, 'sizeGb': str(params.get('diskSizeGb') or 10),
+                                                 'zone': self.link('zones/' + zone), 'status': 'READY', 'sourceImage': source_image, 'labels': {}, 'labelFingerprint': fingerprint({}),
+                                                 'type': self.link('zones/%s/diskTypes/%s' % (zone, basename(params.get('diskType')) or 'pd-standard')),
+                                                 'selfLink': self.link('zones/%s/disks/%s' % (zone, disk_name)), 'creationTimestamp': now(), 'users': []}
+                source = self.disks[(zone, disk_name)]
+            else:
+                source = self.zonal('disks', zone, basename(disk.get('source')))
+                if source['users']:
+                    raise GceApiError(400, "The disk resource '%s' is already being used by '%s'" % (source['selfLink'], source['users'][0]), 'resourceInUseByAnotherResource')
+            source['users'] = [self_link]
+            attached_disks.append({'kind': 'compute#attachedDisk', 'type': 'PERSISTENT', 'mode': disk.get('mode', 'READ_WRITE'), 'source': source['selfLink'],
+                                   'deviceName': disk.get('deviceName') or source['name'], 'index': index, 'boot': bool(disk.get('boot')),
+                                   'autoDelete': bool(disk.get('autoDelete')), 'interface': disk.get('interface', 'SCSI'), 'diskSizeGb': source['sizeGb']})
+        network_interfaces = []
+        for index, network_interface in enumerate(body.get('networkInterfaces') or [{}]):
+            ip = next(self.ips)
+            network_interfaces.append(dict(network_interface, kind='compute#networkInterface', name='nic%d' % index, networkIP='10.132.%d.%d' % (ip // 250, ip % 250 + 2),
+                                           network=network_interface.get('network') or self.networks['default']['selfLink'],
+                                           accessConfigs=[dict(access_config, natIP='35.0.%d.%d' % (ip // 250, ip % 250 + 2)) for access_config in network_interface.get('accessConfigs', [])]))
+        instance = dict(body, kind='compute#instance', id=str(next(self.ids)), status='RUNNING', zone=self.link('zones/' + zone), selfLink=self_link,
+                        creationTimestamp=now(), disks=attached_disks, networkInterfaces=network_interfaces, labels=body.get('labels') or {},
+                        labelFingerprint=fingerprint(body.get('labels') or {}), deletionProtection=bool(body.get('deletionProtection')))
+        if 'metadata' in instance:
+            instance['metadata'] = dict(instance['metadata'], fingerprint=fingerprint(instance['metadata']))
+        instance['tags'] = dict(instance.get('tags') or {}, fingerprint=fingerprint((instance.get('tags') or {}).get('items') or []))
+        self.instances[(zone, name)] = instance
+        return self.operation('zones/' + zone, 'insert', self_link)
+
+    # Deletes the instance, and its autoDelete disks (the others are detached)
+    def delete_instance(self, request, body, project, zone, name):
+        instance = self.zonal('instances', zone, name)
+        if instance.get('deletionProtection'):
+            raise GceApiError(400, "Invalid resource usage: 'Resource cannot be deleted if it's protected against deletion.'", 'resourceIsProtected')
+        for disk in instance['disks']:
+            if disk['autoDelete']:
+                self.disks.pop((zone, basename(disk['source'])), None)
+            elif (zone, basename(disk['source'])) in self.disks:
+                self.disks[(zone, basename(disk['source']))]['users'] = []
+        del self.instances[(zone, name)]
+        return self.operation('zones/' + zone, 'delete', instance['selfLink'])
+
+    def instance_verb(self, request, body, project, zone, name, verb):
+        instance = self.zonal('instances', zone, name)
+        if verb in ('start', 'stop'):
+            instance['status'] = 'RUNNING' if verb == 'start' else 'TERMINATED'
+        elif verb == 'setLabels':
+            if body.get('labelFingerprint') != instance['labelFingerprint']:
+                raise GceApiError(412, "Labels fingerprint either invalid or resource labels have changed", 'conditionNotMet')
+            instance['labels'] = body.get('labels') or {}
+            instance['labelFingerprint'] = fingerprint(instance['labels'])
+        elif verb == 'setMachineType':
+            instance['machineType'] = body.get('machineType') or instance['machineType']      # gcp_compute_instance sends a null machineType when it is not given (e.g. to change the status)
+        elif verb == 'setDeletionProtection':
+            instance['deletionProtection'] = request.args.get('deletionProtection', 'true') == 'true'
+        elif verb == 'detachDisk':
+            disk = next((disk for disk in instance['disks'] if disk['deviceName'] == request.args.get('deviceName')), None)
+            if not disk:
+                raise GceApiError(400, "No attached disk found with device name '%s'" % request.args.get('deviceName'))
+            instance['disks'].remove(disk)
+            self.disks[(zone, basename(disk['source']))]['users'] = []
+        elif verb == 'attachDisk':
+            source = self.zonal('disks', zone, basename(body['source']))
+            source['users'] = [instance['selfLink']]
+            instance['disks'].append({'kind': 'compute#attachedDisk', 'type': 'PERSISTENT', 'mode': body.get('mode', 'READ_WRITE'), 'source': source['selfLink'],
+                                      'deviceName': body.get('deviceName') or source['name'], 'index': len(instance['disks']), 'boot': False,
+                                      'autoDelete': bool(body.get('autoDelete')), 'interface': body.get('interface', 'SCSI'), 'diskSizeGb': source['sizeGb']})
+        return self.operation('zones/' + zone, verb, instance['selfLink'])
+
+    def set_disk_labels(self, request, body, project, zone, name):
+        disk = self.zonal('disks', zone, name)
+        if body.get('labelFingerprint') != disk['labelFingerprint']:
+            raise GceApiError(412, "Labels fingerprint either invalid or resource labels have changed", 'conditionNotMet')
+        disk['labels'] = body.get('labels') or {}
+        disk['labelFingerprint'] = fingerprint(disk['labels'])
+        return self.operation('zones/' + zone, 'setLabels', disk['selfLink'])
+
+    def delete_disk(self, request, body, project, zone, name):
+        disk = self.zonal('disks', zone, name)
+        if disk['users']:
+            raise GceApiError(400, "The disk resource '%s' is already being used by '%s'" % (disk['selfLink'], disk['users'][0]), 'resourceInUseByAnotherResource')
+        del self.disks[(zone, name)]
+        return self.operation('zones/' + zone, 'delete', disk['selfLink'])
+
+    def get_operation(self, request, body, project, scope, name):
+        if name not in self.operations:
+            raise self.not_found('projects/%s/%s/operations/%s' % (project, scope, name))
+        return self.operations[name]
+
+    def list_images(self, request, body, image_project):
+        images = [image for (project, _), image in sorted(self.images.items()) if project == image_project and matches_filter(image, request.args.get('filter'))]
+        return self.page(request, images, 'compute#imageList')
+
+    def get_image(self, request, body, image_project, name):
+        if (image_project, name) not in self.images:
+            raise self.not_found('projects/%s/global/images/%s' % (image_project, name))
+        return self.images[(image_project, name)]
+
+    def list_global(self, request, body, project, collection):
+        resources = [resource for _, resource in sorted(getattr(self, collection).items()) if matches_filter(resource, request.args.get('filter'))]
+        return self.page(request, resources, 'compute#%sList' % collection[:-1])
+
+    def get_global(self, request, body, project, collection, name):
+        if name not in getattr(self, collection):
+            raise self.not_found('projects/%s/global/%s/%s' % (project, collection, name))
+        return getattr(self, collection)[name]
+
+    def insert_firewall(self, request, body, project):
+        if body['name'] in self.firewalls:
+            raise GceApiError(409, "The resource 'projects/%s/global/firewalls/%s' already exists" % (project, body['name']), 'alreadyExists')
+        self_link = self.link('global/firewalls/' + body['name'])
+        self.firewalls[body['name']] = dict(body, kind='compute#firewall', id=str(next(self.ids)), selfLink=self_link, creationTimestamp=now())
+        return self.operation('global', 'insert', self_link)
+
+    def update_firewall(self, request, body, project, name):
+        firewall = self.get_global(request, body, project, 'firewalls', name)
+        firewall.update(body)
+        return self.operation('global', 'patch', firewall['selfLink'])
+
+    def delete_firewall(self, request, body, project, name):
+        firewall = self.get_global(request, body, project, 'firewalls', name)
+        del self.firewalls[name]
+        return self.operation('global', 'delete', firewall['selfLink'])
+
+    def list_subnetworks(self, request, body, project, region):
+        return self.page(request, [], 'compute#subnetworkList')
+
+    def managed_zone(self, managed_zone):
+        if managed_zone not in self.managed_zones:
+            raise GceApiError(404, "The 'parameters.managedZone' resource named '%s' does not exist." % managed_zone, 'notFound')
+        return self.managed_zones[managed_zone]
+
+    def list_managed_zones(self, request, body, project):
+        zones = [managed_zone['zone'] for managed_zone in self.managed_zones.values() if request.args.get('dnsName') in (None, managed_zone['zone']['dnsName'])]
+        return {'kind': 'dns#managedZonesListResponse', 'managedZones': zones}
+
+    def list_rrsets(self, request, body, project, managed_zone):
+        rrsets = [rrset for _, rrset in sorted(self.managed_zone(managed_zone)['rrsets'].items())]
+        return self.page(request, rrsets, 'dns#resourceRecordSetsListResponse', key='rrsets')
+
+    # Applies the deletions, then the additions, atomically (each deletion must match an existing rrset exactly, and each addition must not exist already).
+    def create_change(self, request, body, project, managed_zone):
+        zone = self.managed_zone(managed_zone)
+        rrsets = dict(zone['rrsets'])
+        for rrset in body.get('deletions', []):
+            key = (rrset['name'], rrset['type'])
+            if key not in rrsets or sorted(rrsets[key]['rrdatas']) != sorted(rrset['rrdatas']):
+                raise GceApiError(412, "The resource record set '%s' does not match the existing one" % (key,), 'conditionNotMet')
+            del rrsets[key]
+        for rrset in body.get('additions', []):
+            key = (rrset['name'], rrset['type'])
+            if key in rrsets:
+                raise GceApiError(409, "The resource record set '%s' already exists" % (key,), 'alreadyExists')
+            rrsets[key] = dict(rrset, kind='dns#resourceRecordSet')
+        zone['rrsets'] = rrsets
+        change = dict(body, kind='dns#change', id=str(len(zone['changes']) + 1), status='done', startTime=now())
+        zone['changes'].append(change)
+        return change
+
+    def get_change(self, request, body, project, managed_zone, name):
+        changes = self.managed_zone(managed_zone)['changes']
+        if not name.isdigit() or not 0 < int(name) <= len(changes):
+            raise GceApiError(404, "The 'parameters.changeId' resource named '%s' does not exist." % name, 'notFound')
+        return changes[int(name) - 1]
+
+
+# A CA, and a certificate signed by it for the Google API hostnames, (written to 'directory' as ca.pem, and server.pem/server.key).
+def make_certificates(directory):
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    def key_and_builder(common_name, issuer_name):
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        start = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+        builder = x509.CertificateBuilder().subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])).issuer_name(issuer_name or x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])) \
+            .public_key(key.public_key()).serial_number(x509.random_serial_number()).not_valid_before(start).not_valid_after(start + datetime.timedelta(days=30))
+        return key, builder
+
+    ca_key, ca_builder = key_and_builder('clusterverse benchmark CA', None)
+    ca_cert = ca_builder.add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True).sign(ca_key, hashes.SHA256())
+    server_key, server_builder = key_and_builder(GOOGLE_API_HOSTS[0], ca_cert.subject)
+    server_cert = server_builder.add_extension(x509.SubjectAlternativeName([x509.DNSName(host) for host in GOOGLE_API_HOSTS]), critical=False) \
+        .add_extension(x509.BasicConstraints(ca=False, path_length=None), critical=True).sign(ca_key, hashes.SHA256())
+
+    paths = dict((name, os.path.join(directory, name)) for name in ['ca.pem', 'server.pem', 'server.key'])
+    with open(paths['ca.pem'], 'wb') as ca_file:
+        ca_file.write(ca_cert.public_bytes(serialization.Encoding.PEM))
+    with open(paths['server.pem'], 'wb') as cert_file:
+        cert_file.write(server_cert.public_bytes(serialization.Encoding.PEM))
+    with open(paths['server.key'], 'wb') as key_file:
+        key_file.write(server_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL, serialization.NoEncryption()))
+    return paths
+
+
+def server_ssl_context(certificates):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certificates['server.pem'], certificates['server.key'])
+    return context
+
+
+# A service account key file for the fake project (the key is real, as the clients sign their token requests with it, but the fake accepts any signature).
+def make_service_account_file(path, project):
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    with open(path, 'w') as service_account_file:
+        json.dump({'type': 'service_account', 'project_id': project, 'private_key_id': 'bench', 'client_id': '100000000000000000000',
+                   'private_key': key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()).decode(),
+                   'client_email': 'bench@%s.iam.gserviceaccount.com' % project, 'auth_uri': 'https://accounts.google.com/o/oauth2/auth',
+                   'token_uri': 'https://oauth2.googleapis.com/token'}, service_account_file, indent=2)
+    return path
+
+
+# An HTTP proxy that only serves CONNECT requests to the Google API hostnames (on port 443), by tunnelling them to the fake's (HTTPS) port.  Anything else is
+# refused, so a run cannot reach the real APIs.
+class ConnectProxy(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, target_port):
+        self.target_port = target_port
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), ConnectProxyHandler)
+        self.port = self.server_address[1]
+
+
+class ConnectProxyHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        head = b''
+        while b'\r\n\r\n' not in head:
+            data = self.request.recv(4096)
+            if not data:
+                return
+            head += data
+        request_line = head.split(b'\r\n', 1)[0].decode('latin-1').split()
+        if len(request_line) < 2 or request_line[0] != 'CONNECT' or request_line[1] not in ['%s:443' % host for host in GOOGLE_API_HOSTS]:
+            self.request.sendall(b'HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            return
+        upstream = socket.create_connection(('127.0.0.1', self.server.target_port))
+        try:
+            self.request.sendall(b'HTTP/1.1 200 Connection established\r\n\r\n')
+            sockets = [self.request, upstream]
+            while True:
+                readable, _, _ = select.select(sockets, [], [], 300)
+                if not readable:
+                    return
+                for sock in readable:
+                    data = sock.recv(65536)
+                    if not data:
+                        return
+                    (upstream if sock is self.request else self.request).sendall(data)
+        finally:
+            upstream.close()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# Copyright (c) 2020, Sky UK Ltd
+# BSD 3-Clause License
+#
+# Benchmarks the creation of the auto_volumes filesystems against loop devices (sparse files), so the mkfs profiles (mkfs_profiles in
+# _dependencies/defaults/main.yml), the concurrency of the auto_volumes module, and linear vs striped LVM logical volumes can be compared without cloud volumes.
+#
+# For each fstype and mkfs profile, it runs the (real) auto_volumes module against 'count' loop devices, once with mkfs run one device at a time, and once
+# concurrently, and reports the module's mkfs and mount timings.  If the LVM tools are installed, it also creates a volume group from the loop devices, and times
+# mkfs on a linear and on a striped logical volume (with the lvcreate options that the LVM tasks in config/tasks/disks_auto_cloud.yml use).
+#
+# Needs root (losetup, mount).  E.g.:
+#   sudo python3 benchmark/mkfs_loopdev.py --count 4 --size 8G --fstypes ext4 xfs --json /tmp/mkfs_loopdev.json
+#
+# Note: the loop devices are backed by files in 'workdir', so the results depend on the filesystem of 'workdir' (use a fast local disk, and the same one for the
+# runs being compared).  They show relative, rather than absolute, differences from real (NVMe) devices.
+
+from __future__ import (absolute_import, division, print_function)
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AUTO_VOLUMES = os.path.join(REPO_DIR, '_dependencies', 'library', 'auto_volumes.py')
+
+
+def run(cmd):
+    return subprocess.check_output(cmd, stderr=subprocess.STDOUT).decode().strip()
+
+
+def mkfs_profiles():
+    with open(os.path.join(REPO_DIR, '_dependencies', 'defaults', 'main.yml'), 'r') as defaults_file:
+        return yaml.safe_load(defaults_file)['mkfs_profiles']
+
+
+class LoopDevices(object):
+    def __init__(self, workdir, count, size):
+        self.workdir = workdir
+        self.count = count
+        self.size = size
+        self.devices = []
+
+    def __enter__(self):
+        for index in range(self.count):
+            backing_file = os.path.join(self.workdir, 'loop%d.img' % index)
+            run(['truncate', '-s', self.size, backing_file])
+            self.devices.append(run(['losetup', '--find', '--show', backing_file]))
+        return self.devices
+
+    def __exit__(self, *args):
+        for device in self.devices:
+            subprocess.call(['losetup', '--detach', device])
+        for index in range(self.count):
+            os.remove(os.path.join(self.workdir, 'loop%d.img' % index))
+
+
+# Runs the auto_volumes module (as Ansible would, with its arguments in a file), against a device_map of the loop devices, as returned by blockdevmap.
+def auto_volumes(workdir, devices, fstype, mkfs_opts, max_concurrency):
+    device_map = [{'NAME': device.split('/')[-1], 'device_name_os': device, 'device_name_cloud': device, 'TYPE': 'disk', 'FSTYPE': '', 'MOUNTPOINT': '', 'UUID': ''} for device in devices]
+    volumes = [{'device_name': device, 'mountpoint': os.path.join(workdir, 'mnt', device.split('/')[-1]), 'fstype': fstype} for device in devices]
+    fstab = os.path.join(workdir, 'fstab')
+    open(fstab, 'w').close()
+    args_file = os.path.join(workdir, 'args.json')
+    with open(args_file, 'w') as f:
+        json.dump({'ANSIBLE_MODULE_ARGS': {'volumes': volumes, 'device_map': device_map, 'mkfs_opts': {fstype: mkfs_opts}, 'fstab': fstab, 'opts': 'defaults',
+                                           'max_concurrency': max_concurrency}}, f)
+    try:
+        result = json.loads(subprocess.check_output([sys.executable, AUTO_VOLUMES, args_file]).decode())
+    except subprocess.CalledProcessError as e:
+        result = json.loads(e.output.decode())
+    finally:
+        for volume in volumes:
+            subprocess.call(['umount', volume['mountpoint']], stderr=subprocess.DEVNULL)
+        for device in devices:
+            subprocess.call(['wipefs', '--all', '--quiet', device])
+    if result.get('failed'):
+        raise RuntimeError(result.get('msg'))
+    return result['timings']
+
+
+# mkfs on a logical volume across all the loop devices, linear, or striped (one stripe per PV, as 'stripes: true' in lvmparams)
+def lvm_mkfs(devices, fstype, mkfs_opts, stripes, stripe_size):
+    vg_name = 'cvbench%d' % os.getpid()
+    run(['vgcreate', '--quiet', vg_name] + devices)
+    try:
+        stripe_opts = ['-i', str(len(devices)), '-I', stripe_size] if stripes else []
+        run(['lvcreate', '--quiet', '--yes', '-l', '100%VG', '-n', 'lv0'] + stripe_opts + [vg_name])
+        start_time = time.time()
+        run(['mkfs.' + fstype] + mkfs_opts.split() + ['/dev/%s/lv0' % vg_name])
+        return round(time.time() - start_time, 3)
+    finally:
+        subprocess.call(['vgremove', '--force', '--quiet', vg_name], stdout=subprocess.DEVNULL)
+        for device in devices:
+            subprocess.call(['pvremove', '--force', '--quiet', device], stdout=subprocess.DEVNULL)
+            subprocess.call(['wipefs', '--all', '--quiet', device])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the auto_volumes mkfs profiles, concurrency and LVM striping against loop devices")
+    parser.add_argument('--count', type=int, default=4, help="The number of loop devices (default 4)")
+    parser.add_argument('--size', default='4G', help="The (sparse) size of each loop device (default 4G)")
+    parser.add_argument('--fstypes', nargs='+', default=['ext4', 'xfs'], help="The fstypes to benchmark (default ext4 xfs)")
+    parser.add_argument('--profiles', nargs='+', help="The mkfs profiles to benchmark (default: all those in mkfs_profiles)")
+    parser.add_argument('--stripe-size', default='256k', help="The stripe size of the striped logical volume (default 256k)")
+    parser.add_argument('--workdir', help="The directory for the loop devices' backing files (default: a temporary directory)")
+    parser.add_argument('--json', help="Also write the results to this file")
+    args = parser.parse_args()
+
+    if os.geteuid() != 0:
+        parser.error("must be run as root (losetup, mount)")
+
+    profiles = mkfs_profiles()
+    workdir = tempfile.mkdtemp(prefix='mkfs_loopdev.', dir=args.workdir)
+    results = []
+    try:
+        with LoopDevices(workdir, args.count, args.size) as devices:
+            for fstype in args.fstypes:
+                if not shutil.which('mkfs.' + fstype):
+                    print("%s: mkfs.%s is not installed - skipped" % (fstype, fstype))
+                    continue
+                for profile in args.profiles or sorted(profiles):
+                    mkfs_opts = profiles[profile].get(fstype, '')
+                    for mode, max_concurrency in [('sequential', 1), ('concurrent', len(devices))]:
+                        timings = auto_volumes(workdir, devices, fstype, mkfs_opts, max_concurrency)
+                        results.append({'test': 'auto_volumes', 'fstype': fstype, 'profile': profile, 'mode': mode, 'mkfs': timings['mkfs'], 'mount': timings['mount']})
+                        print("auto_volumes  %-5s %-10s %-10s mkfs: %7.3fs  mount: %7.3fs" % (fstype, profile, mode, timings['mkfs'], timings['mount']))
+                    if shutil.which('lvcreate'):
+                        for mode in ['linear', 'striped']:
+                            mkfs_time = lvm_mkfs(devices, fstype, mkfs_opts, mode == 'striped', args.stripe_size)
+                            results.append({'test': 'lvm', 'fstype': fstype, 'profile': profile, 'mode': mode, 'mkfs': mkfs_time})
+                            print("lvm           %-5s %-10s %-10s mkfs: %7.3fs" % (fstype, profile, mode, mkfs_time))
+            if not shutil.which('lvcreate'):
+                print("The LVM tools are not installed - the linear/striped logical volume benchmark was skipped")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump({'count': args.count, 'size': args.size, 'results': results}, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# Copyright (c) 2020, Sky UK Ltd
+# BSD 3-Clause License
+#
+# Benchmarks the redeploy drivers (redeploy_driver, see _dependencies/action_plugins/run_playbook.py): the wall-clock time per redeployed host of a rolling redeploy
+# when each nested cluster.yml run is a new ansible-playbook process ('subprocess'), and when it runs in the redeploy's own ansible process, reusing the cluster
+# definitions and cluster state that the redeploy has already discovered ('inprocess').
+#
+# For each driver, a cluster of '--size' hosts is created in a fresh (simulated) cloud (as in suite.py), and then redeployed, one host at a time
+# (redeploy_batch_size=1), with each '--schemes' scheme in turn.  E.g.:
+#   python3 benchmark/redeploy_driver.py --cloud aws --size 6 --json /tmp/redeploy_driver.json
+#
+# As for suite.py, the timings are only comparable with each other, not with other machines.
+
+from __future__ import (absolute_import, division, print_function)
+
+import argparse
+import json
+import os
+import shutil
+import sys
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARK_DIR)
+
+from suite import CLOUDS, SCHEMES, Runner, check, make_workdir, start_launcher  # noqa: E402
+
+ROLLING_SCHEMES = ['_scheme_addnewvm_rmdisk_rollback', '_scheme_rmvm_rmdisk_only', '_scheme_rmvm_keepdisk_rollback']
+DRIVERS = ['subprocess', 'inprocess']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the wall-clock time per redeployed host of the redeploy drivers, against a local cloud simulator")
+    parser.add_argument('--cloud', choices=sorted(CLOUDS), default='aws', help="The cloud to simulate (default: aws)")
+    parser.add_argument('--size', type=int, default=6, help="The number of hosts in the cluster (at least 3; default 6)")
+    parser.add_argument('--schemes', nargs='+', choices=ROLLING_SCHEMES, default=ROLLING_SCHEMES[:1], help="The (rolling) redeploy schemes (default: %s)" % ROLLING_SCHEMES[0])
+    parser.add_argument('--drivers', nargs='+', choices=DRIVERS, default=DRIVERS, help="The redeploy drivers (default: both)")
+    parser.add_argument('--json', help="Also write the results to this file")
+    parser.add_argument('--workdir', help="The directory in which to create the working directories (default: a temporary directory)")
+    parser.add_argument('--keep', action='store_true', help="Keep the working directories (the playbooks, logs and profile traces of each run)")
+    args = parser.parse_args()
+    if args.size < 3:
+        parser.error("the cluster size must be at least 3")
+
+    results = {}
+    failed = False
+    print("%-12s %-36s %9s %14s %9s %10s" % ('Driver', 'Scheme', 'Seconds', 'Seconds/host', 'API calls', 'Memory(MB)'))
+    start_launcher()
+    simulator = CLOUDS[args.cloud]['simulator']().start()
+    try:
+        for driver in args.drivers:
+            simulator.reset()
+            workdir = make_workdir(args.workdir)
+            runner = Runner(args.cloud, simulator, workdir, [])
+            try:
+                create = runner.run('create', 'cluster.yml', args.size, {})
+                failure = ('cluster.yml failed (rc=%s, see %s)' % (create['rc'], create['log'])) if create['rc'] != 0 else check(simulator, args.size)
+                for scheme in [scheme for scheme in SCHEMES if scheme in args.schemes] if not failure else []:
+                    result = runner.run('%s/redeploy/%s' % (driver, scheme), 'redeploy.yml', args.size, {'redeploy_scheme': scheme, 'canary': 'none', 'canary_tidy_on_success': True,
+                                                                                                       'redeploy_batch_size': 1, 'redeploy_driver': driver})
+                    failure = ('redeploy.yml failed (rc=%s, see %s)' % (result['rc'], result['log'])) if result['rc'] != 0 else check(simulator, args.size)
+                    result = dict(result, seconds_per_host=round(result['seconds'] / args.size, 2), failure=failure)
+                    results['%s/%s' % (driver, scheme)] = result
+                    print("%-12s %-36s %9.2f %14.2f %9d %10.1f  %s" % (driver, scheme, result['seconds'], result['seconds_per_host'], result['api_calls'], result['maxrss_mb'], 'FAILED: ' + failure if failure else ''))
+                    sys.stdout.flush()
+                    if failure:
+                        break
+                if failure:
+                    failed = True
+                    if create['rc'] != 0 or not results:
+                        print("%-12s %s" % (driver, 'FAILED: ' + failure))
+            finally:
+                if not args.keep and not failed:
+                    shutil.rmtree(workdir, ignore_errors=True)
+    finally:
+        simulator.stop()
+
+    for scheme in args.schemes:
+        if all('%s/%s' % (driver, scheme) in results for driver in DRIVERS):
+            subprocess_result, inprocess_result = [results['%s/%s' % (driver, scheme)] for driver in DRIVERS]
+            print("%s: inprocess takes %.2fs per host, vs %.2fs with subprocess (x%.2f)" % (scheme, inprocess_result['seconds_per_host'], subprocess_result['seconds_per_host'],
+                                                                                         inprocess_result['seconds'] / subprocess_result['seconds']))
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump({'cloud': args.cloud, 'size': args.size, 'results': results}, json_file, indent=2, sort_keys=True)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# Copyright (c) 2020, Sky UK Ltd
+# BSD 3-Clause License
+#
+# The offline test-and-benchmark suite: runs EXAMPLE/cluster.yml and EXAMPLE/redeploy.yml (every redeploy scheme) against local simulators of the cloud APIs (moto
+# for EC2/Route53, fake_gce.py for GCE/Cloud DNS; see cloud_sim.py), for clusters of different sizes, and records for each run the wall-clock time, the API calls
+# made (per operation), and the peak memory of the controller (ansible-playbook, its workers and nested runs).  Each run is also checked (the playbook succeeds,
+# and the cluster afterwards has the expected number of running/stopped hosts), so the suite doubles as a functional test of the cloud roles.
+#
+# For each cloud and cluster size, a fresh (simulated) cloud is used for this sequence of runs:
+#   create                                        cluster.yml on an empty cloud
+#   rerun                                         cluster.yml again (nothing to change)
+#   redeploy/<scheme>                             redeploy.yml (canary=none, canary_tidy_on_success=true, redeploy_batch_size a tenth of the hosts), for each scheme
+#                                                 in redeploy/, each starting from the cluster the previous one left.  _noredeploy_scale_in_only (last) removes one host.
+#
+# The results are compared with those of the same run in a baseline file (default: benchmark/baseline.json), and a metric that is worse than the baseline by more
+# than the threshold is flagged as a regression (and the suite exits non-zero).  Update the baseline with '--update-baseline' (only the runs that were run are
+# replaced).  Timings are only comparable on the same machine, so for a change, run the suite on the baseline revision with --update-baseline first, e.g.:
+#   git stash; python3 benchmark/suite.py --clouds aws --sizes 3 50 --update-baseline; git stash pop
+#   python3 benchmark/suite.py --clouds aws --sizes 3 50
+#
+# The simulated hosts cannot be connected to, so cluster.yml is run with '--skip-tags clusterverse_config', and the other per-host plays run on the controller.
+# Needs the Python packages of the Pipfile, including its dev-packages: moto[server] (also for its werkzeug web server), and cryptography and PySocks (for GCP).
+#
+
+from __future__ import (absolute_import, division, print_function)
+
+import argparse
+import glob
+import json
+import multiprocessing
+import multiprocessing.forkserver
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+from cloud_sim import AWS_REGION, GCP_REGION, GceSimulator, MotoSimulator  # noqa: E402
+
+CLOUDS = {
+    'aws': {'region': AWS_REGION, 'azs': 'abc', 'hosttypes': ['sys', 'sysdisks'], 'simulator': MotoSimulator},
+    'gcp': {'region': GCP_REGION, 'azs': 'bcd', 'hosttypes': ['sys', 'sysdisks'], 'simulator': GceSimulator},
+}
+SCHEMES = ['_scheme_addallnew_rmdisk_rollback', '_scheme_addnewvm_rmdisk_rollback', '_scheme_rmvm_rmdisk_only', '_scheme_rmvm_keepdisk_rollback', '_noredeploy_scale_in_only']
+DEFAULT_SIZES = [3, 50, 500]
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, 'baseline.json')
+
+# Differences smaller than these are never regressions (they are noise)
+REGRESSION_MIN = {'seconds': 2.0, 'api_calls': 2, 'maxrss_mb': 20.0}
+
+
+# The hosts of each hosttype in each AZ, for a cluster of 'size' hosts: a third of them (at least one) have disks, and each hosttype is spread across the AZs.
+def vms_by_az(size, hosttypes, azs):
+    sizes = {hosttypes[1]: max(1, size // 3)}
+    sizes[hosttypes[0]] = size - sizes[hosttypes[1]]
+    return {hosttype: {az: count // len(azs) + (1 if index < count % len(azs) else 0) for index, az in enumerate(azs)} for hosttype, count in sizes.items()}
+
+
+# The playbooks (those in EXAMPLE), with the fixtures (ansible.cfg, cluster_defs) in place of the EXAMPLE ones, and roles/clusterverse linked to this repo.
+def make_workdir(parent):
+    workdir = tempfile.mkdtemp(prefix='clusterverse-bench.', dir=parent)
+    for playbook in ['cluster.yml', 'redeploy.yml']:
+        shutil.copy(os.path.join(REPO_DIR, 'EXAMPLE', playbook), workdir)
+    shutil.copytree(os.path.join(REPO_DIR, 'EXAMPLE', 'group_vars'), os.path.join(workdir, 'group_vars'))
+    shutil.copytree(os.path.join(REPO_DIR, 'EXAMPLE', 'roles'), os.path.join(workdir, 'roles'))
+    os.symlink(REPO_DIR, os.path.join(workdir, 'roles', 'clusterverse'))
+    for fixture in ['ansible.cfg', 'requirements.yml']:
+        shutil.copy(os.path.join(BENCHMARK_DIR, 'fixtures', fixture), workdir)
+    shutil.copytree(os.path.join(BENCHMARK_DIR, 'fixtures', 'cluster_defs'), os.path.join(workdir, 'cluster_defs'))
+    return workdir
+
+
+# The playbooks are started from a process of the forkserver (which is started, small, before the simulators are loaded): exec() keeps the peak memory of the
+# process that it replaces, so a playbook started from this process would report (at least) the memory of the simulators.
+LAUNCHER = multiprocessing.get_context('forkserver')
+
+
+def start_launcher():
+    multiprocessing.forkserver.ensure_running()
+
+
+# Runs cmd (in the launcher), and sends its exit code and peak memory (and that of its waited-for descendants) to conn.
+def launch(cmd, cwd, env, log_filename, conn):
+    with open(log_filename, 'w') as log_file:
+        process = subprocess.Popen(cmd, cwd=cwd, env=env, stdin=subprocess.DEVNULL, stdout=log_file, stderr=subprocess.STDOUT)
+        _, status, rusage = os.wait4(process.pid, 0)
+    conn.send((os.waitstatus_to_exitcode(status) if hasattr(os, 'waitstatus_to_exitcode') else (status >> 8), rusage.ru_maxrss))
+    conn.close()
+
+
+class Runner(object):
+    def __init__(self, cloud, simulator, workdir, extra_args):
+        self.cloud = cloud
+        self.simulator = simulator
+        self.workdir = workdir
+        self.extra_args = extra_args
+        bin_dir = os.path.dirname(sys.executable)
+        self.ansible_playbook = os.path.join(bin_dir, 'ansible-playbook') if os.path.isfile(os.path.join(bin_dir, 'ansible-playbook')) else 'ansible-playbook'
+        self.env = dict(os.environ, ANSIBLE_CONFIG=os.path.join(workdir, 'ansible.cfg'), ANSIBLE_PYTHON_INTERPRETER=sys.executable,
+                        ANSIBLE_CALLBACK_PLUGINS=os.path.join(REPO_DIR, '_dependencies', 'callback_plugins'), ANSIBLE_LOCALHOST_WARNING='false',
+                        CLUSTERVERSE_PROFILE_OUTPUT_DIR=os.path.join(workdir, 'profile'), PATH=bin_dir + os.pathsep + os.environ.get('PATH', ''),
+                        NO_PROXY='127.0.0.1,localhost', no_proxy='127.0.0.1,localhost')
+        self.env.update(simulator.env())
+
+    # Runs a playbook, and returns its metrics.  The peak memory is that of ansible-playbook and all its (waited-for) descendants (workers, nested runs).
+    def run(self, name, playbook, size, extra_vars, extra_args=None):
+        cmd = [self.ansible_playbook, playbook, '-e', 'buildenv=sandbox', '-e', 'clusterid=bench', '-e', 'cloud_type=%s' % self.cloud, '-e', 'region=%s' % CLOUDS[self.cloud]['region'],
+               '-e', json.dumps(dict(self.simulator.extra_vars(), bench_vms_by_az=vms_by_az(size, CLOUDS[self.cloud]['hosttypes'], CLOUDS[self.cloud]['azs']),
+                                     cloud_discovery_cache_dir=os.path.join(self.workdir, 'cache'), **extra_vars)),
+               '--skip-tags', 'clusterverse_config'] + (extra_args or []) + self.extra_args
+        for metrics_file in glob.glob(os.path.join(self.workdir, 'profile', '*.metrics.json')):
+            os.remove(metrics_file)
+        self.simulator.calls_reset()
+        log_filename = os.path.join(self.workdir, 'logs', '%s.log' % name.replace('/', '_'))
+        if not os.path.isdir(os.path.dirname(log_filename)):
+            os.makedirs(os.path.dirname(log_filename))
+        receiver, sender = LAUNCHER.Pipe(duplex=False)
+        launcher = LAUNCHER.Process(target=launch, args=(cmd, self.workdir, self.env, log_filename, sender))
+        start_time = time.time()
+        launcher.start()
+        sender.close()
+        returncode, maxrss = receiver.recv()
+        seconds = time.time() - start_time
+        launcher.join()
+        calls = self.simulator.calls()
+
+        result = {'seconds': round(seconds, 2), 'api_calls': sum(calls.values()), 'maxrss_mb': round(maxrss / (1048576.0 if sys.platform == 'darwin' else 1024.0), 1),
+                  'api_calls_by_operation': dict(sorted(calls.items())), 'rc': returncode, 'log': log_filename}
+        metrics_files = glob.glob(os.path.join(self.workdir, 'profile', '*.metrics.json'))
+        if metrics_files:
+            with open(metrics_files[0], 'r') as metrics_file:
+                metrics = json.load(metrics_file)
+            result['roles'] = metrics['roles']
+        return result
+
+
+# The rolling schemes replace a tenth of the hosts at a time, so that a redeploy of any size takes ten batches.
+def redeploy_batch_size(size):
+    return max(1, size // 10)
+
+
+def scenarios(size):
+    yield 'create', 'cluster.yml', size, {}
+    yield 'rerun', 'cluster.yml', size, {}
+    for scheme in SCHEMES:
+        yield 'redeploy/' + scheme, 'redeploy.yml', (size - 1 if scheme == '_noredeploy_scale_in_only' else size), {'redeploy_scheme': scheme, 'canary': 'none', 'canary_tidy_on_success': True,
+                                                                                                                 'redeploy_batch_size': redeploy_batch_size(size)}
+
+
+# The expected number of (non-terminated) hosts after each run: 'running' hosts.  (Redeploys tidy the hosts they replace.)
+def check(simulator, size):
+    states = simulator.instance_states()
+    if states != {'running': size}:
+        return 'expected %d running hosts, found %s' % (size, states)
+    return None
+
+
+def compare(result, base, threshold):
+    regressions = []
+    for metric, min_difference in sorted(REGRESSION_MIN.items()):
+        if base.get(metric) and result[metric] > base[metric] * threshold and result[metric] - base[metric] > min_difference:
+            regressions.append('%s %s -> %s (x%.2f)' % (metric, base[metric], result[metric], result[metric] / float(base[metric])))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run cluster.yml and redeploy.yml (every scheme) against local cloud simulators; record and compare wall-clock time, API calls and memory")
+    parser.add_argument('--clouds', nargs='+', choices=sorted(CLOUDS), default=sorted(CLOUDS), help="The clouds to simulate (default: all)")
+    parser.add_argument('--sizes', nargs='+', type=int, default=DEFAULT_SIZES, help="The cluster sizes (numbers of hosts, at least 3; default: %s)" % ' '.join(str(size) for size in DEFAULT_SIZES))
+    parser.add_argument('--schemes', nargs='+', choices=SCHEMES, default=SCHEMES, help="The redeploy schemes to run (default: all)")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="The baseline file (default: benchmark/baseline.json)")
+    parser.add_argument('--update-baseline', action='store_true', help="Store the results in the baseline file, rather than comparing them with it")
+    parser.add_argument('--threshold', type=float, default=1.2, help="The ratio (of a metric to its baseline) above which it is a regression (default 1.2)")
+    parser.add_argument('--json', help="Also write the results to this file")
+    parser.add_argument('--workdir', help="The directory in which to create the working directories (default: a temporary directory)")
+    parser.add_argument('--keep', action='store_true', help="Keep the working directories (the playbooks, logs and profile traces of each run)")
+    parser.add_argument('ansible_args', nargs=argparse.REMAINDER, help="Extra arguments for ansible-playbook (after '--'), e.g. -- -e redeploy_driver=inprocess")
+    args = parser.parse_args()
+    if min(args.sizes) < 3:
+        parser.error("the cluster sizes must be at least 3")
+    ansible_args = args.ansible_args[1:] if args.ansible_args[:1] == ['--'] else args.ansible_args
+
+    baseline = {'results': {}}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+
+    start_launcher()
+    results = {}
+    failures = []
+    regressions = {}
+    print("%-48s %9s %9s %10s  %s" % ('Run', 'Seconds', 'API calls', 'Memory(MB)', 'vs baseline'))
+    for cloud in args.clouds:
+        simulator = CLOUDS[cloud]['simulator']().start()
+        try:
+            for size in sorted(args.sizes):
+                simulator.reset()
+                workdir = make_workdir(args.workdir)
+                runner = Runner(cloud, simulator, workdir, ansible_args)
+                try:
+                    for name, playbook, expected_size, extra_vars in scenarios(size):
+                        if name.startswith('redeploy/') and name[len('redeploy/'):] not in args.schemes:
+                            continue
+                        key = '%s/%d/%s' % (cloud, size, name)
+                        result = runner.run(name, playbook, expected_size, extra_vars)
+                        failure = ('%s failed (rc=%s, see %s)' % (playbook, result['rc'], result['log'])) if result['rc'] != 0 else check(simulator, expected_size)
+                        if failure:
+                            failures.append('%s: %s' % (key, failure))
+                        results[key] = dict(result, failure=failure)
+                        if not args.update_baseline and key in baseline['results']:
+                            regressions[key] = compare(result, baseline['results'][key], args.threshold)
+                        print("%-48s %9.2f %9d %10.1f  %s" % (key, result['seconds'], result['api_calls'], result['maxrss_mb'],
+                                                            'FAILED: ' + failure if failure else ('REGRESSION: ' + '; '.join(regressions[key]) if regressions.get(key) else ('ok' if key in regressions else '-'))))
+                        sys.stdout.flush()
+                        if failure:
+                            break
+                finally:
+                    if not args.keep and not failures:
+                        shutil.rmtree(workdir, ignore_errors=True)
+        finally:
+            simulator.stop()
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=2, sort_keys=True)
+
+    if args.update_baseline and not failures:
+        baseline['machine'] = {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()}
+        for key, result in results.items():
+            baseline['results'][key] = {metric: result[metric] for metric in ['seconds', 'api_calls', 'maxrss_mb', 'api_calls_by_operation']}
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+        print("Baseline written to %s" % args.baseline)
+
+    regressed = sorted(key for key, regression in regressions.items() if regression)
+    if failures:
+        print("\n%d run(s) failed:\n  %s" % (len(failures), '\n  '.join(failures)))
+    if regressed:
+        print("\n%d run(s) regressed (more than x%s the baseline): %s" % (len(regressed), args.threshold, ', '.join(regressed)))
+    sys.exit(1 if failures or regressed else 0)
+
+
+if __name__ == '__main__':
+    main()